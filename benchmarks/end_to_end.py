@@ -0,0 +1,205 @@
+"""
+Drive `SearchPipeline.hndl_search` end to end against local stand-ins for every upstream.
+
+Synthetic Telegram updates with distinct photos are searched at several concurrency levels. Telegram, SauceNAO, the
+boorus and pixiv are answered by the stand-in server of `standins.py` with configurable latency and error rates.
+Each concurrency level runs in a fresh process, so its peak memory is measured on its own (the image preparation
+workers are separate processes and not included).
+
+Usage:
+    poetry run python benchmarks/end_to_end.py --concurrency 1 4 16 --searches 40 --latency saucenao=0.5
+    poetry run python benchmarks/end_to_end.py --error-rate booru=0.05 --pages 10
+"""
+
+import resource
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from asyncio import Semaphore, gather, get_running_loop, run
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from typing import Any
+
+from standins import GROUPS, StandInConfig, StandInServer, redirect_upstreams
+
+TOKEN = "123456:benchmark"
+
+
+def create_update(number: int, chat_id: int) -> dict[str, Any]:
+    """Telegram update of a user sending a photo, every number is a distinct photo."""
+    return {
+        "update_id": number,
+        "message": {
+            "message_id": number,
+            "date": int(time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Benchmark"},
+            "photo": [
+                {"file_id": f"search{number}", "file_unique_id": f"search{number}", "width": 1280, "height": 960}
+            ],
+        },
+    }
+
+
+async def run_level(args: Namespace, port: int, concurrency: int, offset: int) -> dict[str, Any]:
+    """Search `args.searches` photos with the given concurrency in a fresh bot instance."""
+    from telegram import Bot, Update
+    from telegram.request import HTTPXRequest
+
+    from reverse_image_search.app import SearchPipeline
+    from reverse_image_search.cache import FileIdCache, ResultCache
+    from reverse_image_search.engines.saucenao import SauceNaoSearchEngine
+    from reverse_image_search.media import MediaPreparer
+    from reverse_image_search.metrics import MetricsServer
+    from reverse_image_search.phash import PerceptualHashIndex
+    from reverse_image_search.providers.booru import BooruProvider
+    from reverse_image_search.providers.pixiv import PixivProvider
+    from reverse_image_search.quota import SauceNaoScheduler
+
+    with TemporaryDirectory() as directory, redirect_upstreams(port):
+        root = Path(directory)
+        arguments = SearchPipeline.Arguments(
+            downloads=root / "downloads",
+            file_url="https://files.example.com/",
+            saucenao=SauceNaoSearchEngine.Config(
+                api_key="benchmark",
+                upload=args.upload,
+                scheduler=SauceNaoScheduler.Config(short_limit=10**6, long_limit=10**9, max_waiting=10**6),
+            ),
+            boorus=BooruProvider.Config(danbooru_username="benchmark", danbooru_api_key="benchmark"),
+            pixiv=PixivProvider.Config(
+                access_token="benchmark", refresh_token="benchmark", token_path=root / "pixiv_tokens.json"
+            ),
+            cache=ResultCache.Config(path=root / "cache.sqlite3"),
+            file_ids=FileIdCache.Config(path=root / "file_ids.sqlite3"),
+            hash_index=PerceptualHashIndex.Config(path=root / "hashes.sqlite3"),
+            media=MediaPreparer.Config(path=root / "prepared", enabled=not args.no_prepare),
+            metrics=MetricsServer.Config(enabled=False),
+        )
+        bot = SearchPipeline(arguments)
+        await bot.initialize_components()
+
+        telegram = Bot(
+            TOKEN,
+            base_url=f"http://127.0.0.1:{port}/telegram/bot",
+            base_file_url=f"http://127.0.0.1:{port}/telegram/file/bot",
+            request=HTTPXRequest(connection_pool_size=4 * concurrency + 4),
+        )
+        await telegram.initialize()
+
+        errors = 0
+
+        async def search(number: int) -> float | None:
+            nonlocal errors
+            update = Update.de_json(create_update(number, chat_id=number % 100 + 1), telegram)
+            start = perf_counter()
+            try:
+                await bot.hndl_search(update, None)  # type: ignore[arg-type]
+            except Exception as error:
+                errors += 1
+                if args.verbose:
+                    print(f"search {number} failed: {error!r}")
+                return None
+            return perf_counter() - start
+
+        for number in range(offset, offset + args.warmup):
+            await search(number)
+        errors = 0
+        bot.send_paths.clear()
+
+        limit = Semaphore(concurrency)
+
+        async def limited(number: int) -> float | None:
+            async with limit:
+                return await search(number)
+
+        start = perf_counter()
+        timings = await gather(*(limited(offset + args.warmup + index) for index in range(args.searches)))
+        duration = perf_counter() - start
+
+        await telegram.shutdown()
+        await bot.shutdown_components()
+
+    return {
+        "timings": [timing for timing in timings if timing is not None],
+        "errors": errors,
+        "duration": duration,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "send_paths": dict(bot.send_paths),
+    }
+
+
+def run_level_process(args: Namespace, port: int, concurrency: int, offset: int) -> dict[str, Any]:
+    return run(run_level(args, port, concurrency, offset))
+
+
+def report(concurrency: int, result: dict[str, Any]) -> None:
+    timings = sorted(result["timings"])
+    if len(timings) > 1:
+        cuts = quantiles(timings, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = timings[0] if timings else float("nan")
+    print(
+        f"{concurrency:>5} {len(timings):>8} {result['errors']:>6} {p50 * 1000:>7.0f}ms {p95 * 1000:>7.0f}ms"
+        f" {p99 * 1000:>7.0f}ms {len(timings) / result['duration']:>9.2f} {result['peak_rss'] / 1024**2:>8.0f}MiB"
+        f"  {result['send_paths']}"
+    )
+
+
+async def main(args: Namespace) -> None:
+    server = StandInServer(
+        StandInConfig(
+            latency=StandInConfig().latency | args.latency,
+            error_rate=args.error_rate,
+            results=args.results,
+            pages=args.pages,
+            result_size=(args.result_width, args.result_height),
+        )
+    )
+    await server.start()
+
+    print(
+        f"{'conc':>5} {'searches':>8} {'errors':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'search/s':>9} {'peak RSS':>11}"
+    )
+    offset = 1
+    for concurrency in args.concurrency:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            result = await get_running_loop().run_in_executor(
+                pool, run_level_process, args, server.port, concurrency, offset
+            )
+        report(concurrency, result)
+        offset += args.warmup + args.searches
+
+    print("\nupstream requests (injected errors):")
+    print("  " + ", ".join(f"{group} {server.requests[group]} ({server.errors[group]})" for group in GROUPS))
+    await server.stop()
+
+
+def group_values(value: str) -> tuple[str, float]:
+    group, _, number = value.partition("=")
+    if group not in GROUPS or not number:
+        raise ArgumentTypeError(f"expected <group>=<number> with group one of {', '.join(GROUPS)}")
+    return group, float(number)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--searches", type=int, default=40, help="Searches per concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="Sequential searches before measuring")
+    parser.add_argument("--latency", type=group_values, action="append", default=[], help="e.g. saucenao=0.5")
+    parser.add_argument("--error-rate", type=group_values, action="append", default=[], help="e.g. booru=0.05")
+    parser.add_argument("--results", type=int, default=3, help="SauceNAO results per search")
+    parser.add_argument("--pages", type=int, default=3, help="Pages per pixiv post")
+    parser.add_argument("--result-width", type=int, default=2400)
+    parser.add_argument("--result-height", type=int, default=1600)
+    parser.add_argument("--upload", action="store_true", help="Upload searched images to SauceNAO")
+    parser.add_argument("--no-prepare", action="store_true", help="Send result images without preparing them")
+    parser.add_argument("--verbose", action="store_true", help="Print failed searches")
+    arguments = parser.parse_args()
+    arguments.latency = dict(arguments.latency)
+    arguments.error_rate = dict(arguments.error_rate)
+    run(main(arguments))
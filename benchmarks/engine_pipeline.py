@@ -0,0 +1,92 @@
+"""
+Measure the per search overhead of the search engines, merging their result streams and building their keyboard.
+
+All built-in link only engines are used, SauceNAO is replaced by a stand-in which yields a single result right away.
+The merged stream of all engines is compared to the stream of the engines giving inline results, the keyboard
+formatted from the URL templates for every search to the precompiled `SearchKeyboard`.
+
+Usage:
+    poetry run python benchmarks/engine_pipeline.py --searches 2000
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from pathlib import Path
+from time import perf_counter
+from typing import AsyncGenerator, Awaitable, Callable
+
+from aiostream import stream
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from reverse_image_search.engines import ENGINES
+from reverse_image_search.engines.base import SearchEngine
+from reverse_image_search.keyboard import SearchKeyboard
+from reverse_image_search.utils import chunks
+
+FILE_URL = "https://files.example.com/0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef.jpg"
+
+
+class StandInEngine(SearchEngine):
+    name = "Stand-in"
+    description = "Yields one result without any request"
+    pros: list[str] = []
+    cons: list[str] = []
+    credit_url = "https://example.com"
+    query_url_template = "https://example.com/?url={file_url}"
+
+    def __init__(self) -> None:
+        super().__init__()
+
+    async def search(self, file_url: str, file: Path | None = None) -> AsyncGenerator[None, None]:
+        yield None
+
+
+async def merged(engines: list[SearchEngine]) -> int:
+    count = 0
+    async with stream.merge(*[engine.search(FILE_URL) for engine in engines]).stream() as streamer:
+        async for _ in streamer:
+            count += 1
+    return count
+
+
+def formatted_keyboard(engines: list[SearchEngine]) -> InlineKeyboardMarkup:
+    buttons = [InlineKeyboardButton(engine.name, engine.generate_search_url(FILE_URL)) for engine in engines]
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Open Image", url=FILE_URL)]] + list(chunks(buttons, 3)))
+
+
+async def measure(searches: int, search: Callable[[], Awaitable[object]]) -> float:
+    for _ in range(searches // 10):
+        await search()
+    start = perf_counter()
+    for _ in range(searches):
+        await search()
+    return (perf_counter() - start) / searches
+
+
+async def main(args: Namespace) -> None:
+    engines: list[SearchEngine] = [StandInEngine()]
+    engines += [ENGINES.create(name, None, None, {}, None, None) for name in ENGINES.plugins if name != "saucenao"]
+    inline_engines = [engine for engine in engines if engine.inline_results]
+    engine_urls = {engine: FILE_URL for engine in engines}
+    keyboard = SearchKeyboard(engines)
+
+    async def build_formatted() -> None:
+        formatted_keyboard(engines)
+
+    async def build_template() -> None:
+        keyboard.build(FILE_URL, engine_urls)
+
+    print(f"{len(engines)} engines, {len(inline_engines)} with inline results, {args.searches} searches")
+    for name, search in (
+        ("merge all engines", lambda: merged(engines)),
+        ("merge inline engines", lambda: merged(inline_engines)),
+        ("keyboard formatted", build_formatted),
+        ("keyboard template", build_template),
+    ):
+        print(f"{name:<22} {await measure(args.searches, search) * 1e6:>8.1f}µs per search")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--searches", type=int, default=2000)
+    run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+"""
+Compare SauceNAO URL mode against upload mode with local stand-in servers.
+
+A stand-in file host serves the searched image with configurable latency and bandwidth, a stand-in SauceNAO either
+fetches the image from it (URL mode) or reads the uploaded bytes (upload mode) before answering.
+
+Usage:
+    poetry run python benchmarks/saucenao_upload.py --searches 50 --concurrency 4 --host-latency 0.15
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import Semaphore, gather, run, sleep
+from pathlib import Path
+from statistics import mean, quantiles
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+from aiohttp import ClientSession, web
+from PIL import Image
+
+from reverse_image_search.cache import ResultCache
+from reverse_image_search.engines.saucenao import SauceNaoSearchEngine
+from reverse_image_search.quota import SauceNaoScheduler
+
+RESPONSE = {
+    "header": {"status": 0, "short_limit": "100000", "long_limit": "100000", "short_remaining": 99999},
+    "results": [],
+}
+
+
+def create_image(path: Path, width: int, height: int) -> None:
+    pixels = np.random.default_rng(0).integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+    Image.fromarray(pixels).resize((width, height), Image.Resampling.BICUBIC).save(path, quality=95)
+
+
+def create_app(args: Namespace, downloads: Path) -> web.Application:
+    received = {"bytes": 0}
+
+    async def file_host(request: web.Request) -> web.StreamResponse:
+        await sleep(args.host_latency)
+        data = (downloads / request.match_info["name"]).read_bytes()
+        response = web.StreamResponse(headers={"Content-Type": "image/jpeg", "Content-Length": str(len(data))})
+        await response.prepare(request)
+        chunk_size = 64 * 1024
+        for start in range(0, len(data), chunk_size):
+            await response.write(data[start : start + chunk_size])
+            await sleep(chunk_size / args.host_bandwidth)
+        return response
+
+    async def saucenao(request: web.Request) -> web.Response:
+        if request.method == "POST":
+            form = await request.post()
+            received["bytes"] += len(form["file"].file.read())  # type: ignore[union-attr]
+        else:
+            async with request.app["session"].get(request.query["url"]) as response:
+                data = await response.read()
+            received["bytes"] += len(data)
+        return web.json_response(RESPONSE)
+
+    async def session_context(app: web.Application):  # type: ignore[no-untyped-def]
+        app["session"] = ClientSession()
+        yield
+        await app["session"].close()
+
+    app = web.Application(client_max_size=100 * 1024**2)
+    app["received"] = received
+    app.cleanup_ctx.append(session_context)
+    app.router.add_get("/files/{name}", file_host)
+    app.router.add_route("*", "/search.php", saucenao)
+    return app
+
+
+async def measure(engine: SauceNaoSearchEngine, file_url: str, file: Path, args: Namespace) -> list[float]:
+    limit = Semaphore(args.concurrency)
+
+    async def single() -> float:
+        async with limit:
+            start = perf_counter()
+            await engine._api_search(file_url, file)
+            return perf_counter() - start
+
+    return await gather(*[single() for _ in range(args.searches)])
+
+
+async def main(args: Namespace) -> None:
+    with TemporaryDirectory() as directory:
+        downloads = Path(directory)
+        image = downloads / "image.jpg"
+        create_image(image, args.width, args.height)
+
+        app = create_app(args, downloads)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+
+        print(f"Image: {args.width}x{args.height}, {image.stat().st_size / 1024:.0f} KiB")
+        print(f"{'mode':<20} {'mean':>8} {'p50':>8} {'p95':>8} {'sent':>10}")
+
+        scheduler_config = SauceNaoScheduler.Config(short_limit=100000, long_limit=100000)
+        async with ClientSession() as session:
+            for name, upload, max_edge in (
+                ("url", False, None),
+                ("upload", True, None),
+                (f"upload <= {args.max_edge}px", True, args.max_edge),
+            ):
+                engine = SauceNaoSearchEngine(
+                    SauceNaoScheduler(["benchmark"], scheduler_config),
+                    session,
+                    {},
+                    ResultCache(),
+                    upload=upload,
+                    upload_max_edge=max_edge,
+                )
+                engine.api_url = f"http://127.0.0.1:{port}/search.php"
+
+                app["received"]["bytes"] = 0
+                timings = await measure(engine, f"http://127.0.0.1:{port}/files/{image.name}", image, args)
+                cuts = quantiles(timings, n=100)
+                sent = app["received"]["bytes"] / args.searches / 1024
+                print(
+                    f"{name:<20} {mean(timings) * 1000:>6.0f}ms {cuts[49] * 1000:>6.0f}ms {cuts[94] * 1000:>6.0f}ms"
+                    f" {sent:>7.0f}KiB"
+                )
+
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--searches", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--height", type=int, default=1440)
+    parser.add_argument("--max-edge", type=int, default=1200)
+    parser.add_argument("--host-latency", type=float, default=0.15, help="File host response latency in seconds")
+    parser.add_argument("--host-bandwidth", type=float, default=8 * 1024**2, help="File host bandwidth in bytes/s")
+    run(main(parser.parse_args()))
@@ -0,0 +1,461 @@
+"""
+Local stand-ins for every upstream the bot talks to.
+
+One aiohttp server answers for the Telegram Bot API, SauceNAO, Danbooru, Yandere, Gelbooru, Konachan and pixiv (API,
+OAuth and image servers). Requests are routed to it by rewriting their URL from `https://<host>/<path>` to
+`http://127.0.0.1:<port>/<host>/<path>`, see `redirect_upstreams`. Payloads follow the public API formats.
+
+Every upstream group ("telegram", "saucenao", "booru", "pixiv", "files") has its own injected latency and error rate.
+"""
+
+import json
+import re
+from asyncio import sleep
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import BytesIO
+from itertools import count
+from random import Random
+from time import time
+from typing import Any, Iterator
+
+import httpx
+import numpy as np
+from aiohttp import ClientSession, web
+from PIL import Image
+from yarl import URL
+
+GROUPS = ("telegram", "saucenao", "booru", "pixiv", "files")
+
+UPSTREAM_GROUPS = {
+    "saucenao.com": "saucenao",
+    "danbooru.donmai.us": "booru",
+    "yande.re": "booru",
+    "konachan.com": "booru",
+    "gelbooru.com": "booru",
+    "app-api.pixiv.net": "pixiv",
+    "oauth.secure.pixiv.net": "pixiv",
+}
+BOORU_INDEXES = {"danbooru": 9, "yandere": 12, "gelbooru": 25, "konachan": 26}
+"""SauceNAO index IDs of the boorus"""
+
+IMAGE_PATH = re.compile(r"\.(jpe?g|png|webp)$")
+
+LOCAL_HOSTS = {"127.0.0.1", "localhost"}
+
+
+def create_image(width: int, height: int, seed: int, quality: int = 92) -> bytes:
+    """
+    Create a JPEG with smooth random content, distinct seeds give perceptually distinct images.
+
+    Args:
+        width (int): The image width.
+        height (int): The image height.
+        seed (int): The random seed.
+        quality (int, optional): The JPEG quality (defaults to 92).
+
+    Returns:
+        bytes: The JPEG image.
+    """
+    pixels = np.random.default_rng(seed).integers(0, 256, (max(1, height // 32), max(1, width // 32), 3), np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).resize((width, height), Image.Resampling.BICUBIC).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def stand_in_url(url: str | URL, port: int) -> URL:
+    """
+    Get the stand-in URL for an upstream URL.
+
+    Args:
+        url (str | URL): The upstream URL.
+        port (int): The port of the stand-in server.
+
+    Returns:
+        URL: The rewritten URL, local URLs are returned unchanged.
+    """
+    url = URL(url)
+    if url.host in LOCAL_HOSTS:
+        return url
+    return URL(f"http://127.0.0.1:{port}/{url.host}{url.raw_path_qs}", encoded=True)
+
+
+@contextmanager
+def redirect_upstreams(port: int) -> Iterator[None]:
+    """
+    Route all aiohttp and httpx requests to the stand-in server while the context is active.
+
+    Args:
+        port (int): The port of the stand-in server.
+    """
+    aiohttp_request = ClientSession._request
+    httpx_send = httpx.AsyncClient.send
+
+    def _request(self: ClientSession, method: str, str_or_url: Any, **kwargs: Any) -> Any:
+        return aiohttp_request(self, method, stand_in_url(str_or_url, port), **kwargs)
+
+    async def send(self: httpx.AsyncClient, request: httpx.Request, **kwargs: Any) -> httpx.Response:
+        request.url = httpx.URL(str(stand_in_url(str(request.url), port)))
+        return await httpx_send(self, request, **kwargs)
+
+    ClientSession._request = _request  # type: ignore[method-assign]
+    httpx.AsyncClient.send = send  # type: ignore[method-assign]
+    try:
+        yield
+    finally:
+        ClientSession._request = aiohttp_request  # type: ignore[method-assign]
+        httpx.AsyncClient.send = httpx_send  # type: ignore[method-assign]
+
+
+@dataclass
+class StandInConfig:
+    """
+    Behaviour of the stand-in upstreams.
+
+    Attributes:
+        latency (dict[str, float]): Response latency in seconds per upstream group.
+        error_rate (dict[str, float]): Share of requests answered with 503 per upstream group.
+        results (int): Number of SauceNAO results per search, spread over the boorus and pixiv.
+        pages (int): Number of pages of each pixiv post.
+        result_size (tuple[int, int]): Width and height of result images.
+        search_size (tuple[int, int]): Width and height of the searched images.
+        seed (int): Seed for error injection.
+    """
+
+    latency: dict[str, float] = field(
+        default_factory=lambda: {"telegram": 0.05, "saucenao": 0.3, "booru": 0.1, "pixiv": 0.15, "files": 0.05}
+    )
+    error_rate: dict[str, float] = field(default_factory=dict)
+    results: int = 3
+    pages: int = 3
+    result_size: tuple[int, int] = (2400, 1600)
+    search_size: tuple[int, int] = (1280, 960)
+    seed: int = 0
+
+
+class StandInServer:
+    """
+    The stand-in server for all upstreams.
+
+    Attributes:
+        config (StandInConfig): The stand-in behaviour.
+        port (int): The port the server listens on, set by `start`.
+        requests (dict[str, int]): Number of requests per upstream group.
+        errors (dict[str, int]): Number of injected errors per upstream group.
+    """
+
+    def __init__(self, config: StandInConfig):
+        self.config = config
+        self.port = 0
+        self.requests = dict.fromkeys(GROUPS, 0)
+        self.errors = dict.fromkeys(GROUPS, 0)
+
+        self._random = Random(config.seed)
+        self._ids = count(1)
+        self._messages = count(1)
+        self._result_image = create_image(*config.result_size, seed=0)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        """Start listening on a free local port."""
+        app = web.Application(client_max_size=100 * 1024**2)
+        app.router.add_route("*", "/telegram/file/bot{token}/{path:.*}", self._telegram_file)
+        app.router.add_route("*", "/telegram/bot{token}/{method}", self._telegram)
+        app.router.add_route("*", "/{host}/{path:.*}", self._upstream)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+
+    async def stop(self) -> None:
+        """Stop the server."""
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _inject(self, group: str) -> None:
+        """Apply the latency of an upstream group and raise the injected errors."""
+        self.requests[group] += 1
+        if latency := self.config.latency.get(group, 0):
+            await sleep(latency)
+        if self._random.random() < self.config.error_rate.get(group, 0):
+            self.errors[group] += 1
+            raise web.HTTPServiceUnavailable()
+
+    # Telegram Bot API
+
+    async def _telegram_file(self, request: web.Request) -> web.Response:
+        await self._inject("telegram")
+        seed = int(re.sub(r"\D", "", request.match_info["path"]) or 0)
+        return web.Response(body=create_image(*self.config.search_size, seed=seed), content_type="image/jpeg")
+
+    def _message(self, chat_id: Any, **content: Any) -> dict[str, Any]:
+        return {
+            "message_id": next(self._messages),
+            "date": int(time()),
+            "chat": {"id": int(chat_id or 1), "type": "private"},
+            **content,
+        }
+
+    def _media(self, kind: str) -> dict[str, Any]:
+        file_id = f"sent_{kind}_{next(self._ids)}"
+        if kind == "photo":
+            return {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]}
+        extra = {"duration": 1} if kind in ("video", "animation") else {}
+        return {kind: {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960, **extra}}
+
+    async def _telegram(self, request: web.Request) -> web.Response:
+        await self._inject("telegram")
+        method = request.match_info["method"].lower()
+        data: dict[str, Any] = dict(await request.post()) if request.can_read_body else {}
+        if request.content_type == "application/json":
+            data = await request.json()
+        chat_id = data.get("chat_id")
+
+        result: Any
+        match method:
+            case "getme":
+                result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+            case "getfile":
+                file_id = str(data.get("file_id"))
+                result = {"file_id": file_id, "file_unique_id": file_id, "file_path": f"photos/{file_id}.jpg"}
+            case "sendmessage":
+                result = self._message(chat_id, text=data.get("text", ""))
+            case "sendphoto" | "sendvideo" | "sendanimation" | "senddocument":
+                result = self._message(chat_id, **self._media(method.removeprefix("send")))
+            case "sendmediagroup":
+                media = data.get("media", "[]")
+                items = json.loads(media) if isinstance(media, str) else media
+                result = [self._message(chat_id, **self._media(item.get("type", "photo"))) for item in items]
+            case _:
+                result = True
+        return web.json_response({"ok": True, "result": result})
+
+    # Other upstreams
+
+    async def _upstream(self, request: web.Request) -> web.Response:
+        host, path = request.match_info["host"], request.match_info["path"]
+        if IMAGE_PATH.search(path):
+            await self._inject("files")
+            return web.Response(body=self._result_image, content_type="image/jpeg")
+
+        await self._inject(UPSTREAM_GROUPS.get(host, "files"))
+        match host:
+            case "saucenao.com":
+                return web.json_response(self._saucenao())
+            case "danbooru.donmai.us":
+                if match := re.fullmatch(r"posts/(\d+)\.json", path):
+                    return web.json_response(self._danbooru_post(int(match[1])))
+                ids = re.findall(r"\d+", request.query.get("tags", ""))
+                return web.json_response([self._danbooru_post(int(post_id)) for post_id in ids])
+            case "yande.re" | "konachan.com":
+                ids = re.findall(r"\d+", request.query.get("tags", ""))
+                return web.json_response([self._moebooru_post(host, int(post_id)) for post_id in ids])
+            case "gelbooru.com":
+                post_id = int(request.query.get("id") or re.sub(r"\D", "", request.query.get("tags", "")) or 0)
+                return web.json_response({"@attributes": {"count": 1}, "post": [self._gelbooru_post(post_id)]})
+            case "app-api.pixiv.net":
+                return web.json_response({"illust": self._pixiv_illust(int(request.query.get("illust_id", 0)))})
+            case "oauth.secure.pixiv.net":
+                return web.json_response(
+                    {"access_token": "stand-in", "refresh_token": "stand-in", "expires_in": 3600, "user": {}}
+                )
+        raise web.HTTPNotFound()
+
+    def _saucenao(self) -> dict[str, Any]:
+        kinds = ("danbooru", "pixiv", "yandere", "konachan", "gelbooru")
+        results = []
+        for index in range(self.config.results):
+            kind = kinds[index % len(kinds)]
+            post_id = next(self._ids)
+            header = {"similarity": "93.5", "index_id": 5, "index_name": f"Index #5: Pixiv - {post_id}_p0.jpg"}
+            data: dict[str, Any] = {"pixiv_id": post_id}
+            if kind != "pixiv":
+                header = {"similarity": "93.5", "index_id": BOORU_INDEXES[kind], "index_name": f"Index: {kind}"}
+                data = {f"{kind}_id": post_id, "ext_urls": []}
+            results.append({"header": header, "data": data})
+        return {
+            "header": {
+                "status": 0,
+                "short_limit": "1000000",
+                "long_limit": "1000000",
+                "short_remaining": 999999,
+                "long_remaining": 999999,
+            },
+            "results": results,
+        }
+
+    def _file_url(self, host: str, post_id: int) -> str:
+        return f"https://{host}/data/{post_id:08d}.jpg"
+
+    def _danbooru_post(self, post_id: int) -> dict[str, Any]:
+        width, height = self.config.result_size
+        file_url = self._file_url("cdn.donmai.us", post_id)
+        return {
+            "id": post_id,
+            "created_at": "2023-01-01T00:00:00.000+00:00",
+            "updated_at": "2023-01-01T00:00:00.000+00:00",
+            "uploader_id": 1,
+            "approver_id": None,
+            "score": 10,
+            "up_score": 10,
+            "down_score": 0,
+            "fav_count": 10,
+            "source": "",
+            "md5": f"{post_id:032x}",
+            "rating": "g",
+            "image_width": width,
+            "image_height": height,
+            "file_ext": "jpg",
+            "file_size": len(self._result_image),
+            "tag_string": "1girl solo benchmark",
+            "tag_string_general": "1girl solo",
+            "tag_string_character": "",
+            "tag_string_copyright": "original",
+            "tag_string_artist": "benchmark",
+            "tag_string_meta": "",
+            "tag_count": 5,
+            "parent_id": None,
+            "has_children": False,
+            "has_large": True,
+            "has_active_children": False,
+            "has_visible_children": False,
+            "is_pending": False,
+            "is_flagged": False,
+            "is_deleted": False,
+            "is_banned": False,
+            "pixiv_id": None,
+            "bit_flags": 0,
+            "file_url": file_url,
+            "large_file_url": file_url,
+            "preview_file_url": file_url,
+        }
+
+    def _moebooru_post(self, host: str, post_id: int) -> dict[str, Any]:
+        width, height = self.config.result_size
+        file_url = self._file_url("files.yande.re" if host == "yande.re" else host, post_id)
+        return {
+            "id": post_id,
+            "tags": "benchmark solo",
+            "created_at": int(time()),
+            "updated_at": int(time()),
+            "creator_id": 1,
+            "author": "benchmark",
+            "change": 1,
+            "source": "",
+            "score": 10,
+            "md5": f"{post_id:032x}",
+            "file_size": len(self._result_image),
+            "file_ext": "jpg",
+            "file_url": file_url,
+            "is_shown_in_index": True,
+            "preview_url": file_url,
+            "preview_width": 150,
+            "preview_height": 100,
+            "actual_preview_width": 300,
+            "actual_preview_height": 200,
+            "sample_url": file_url,
+            "sample_width": width,
+            "sample_height": height,
+            "sample_file_size": len(self._result_image),
+            "jpeg_url": file_url,
+            "jpeg_width": width,
+            "jpeg_height": height,
+            "jpeg_file_size": 0,
+            "rating": "s",
+            "is_rating_locked": False,
+            "has_children": False,
+            "parent_id": None,
+            "status": "active",
+            "is_pending": False,
+            "width": width,
+            "height": height,
+            "is_held": False,
+            "frames_pending_string": "",
+            "frames_pending": [],
+            "frames_string": "",
+            "frames": [],
+            "is_note_locked": False,
+            "last_noted_at": 0,
+            "last_commented_at": 0,
+        }
+
+    def _gelbooru_post(self, post_id: int) -> dict[str, Any]:
+        width, height = self.config.result_size
+        file_url = self._file_url("img3.gelbooru.com", post_id)
+        return {
+            "id": post_id,
+            "created_at": "Sun Jan 01 00:00:00 -0500 2023",
+            "score": 10,
+            "width": width,
+            "height": height,
+            "md5": f"{post_id:032x}",
+            "directory": "00/00",
+            "image": f"{post_id:08d}.jpg",
+            "rating": "general",
+            "source": "",
+            "change": 1,
+            "owner": "benchmark",
+            "creator_id": 1,
+            "parent_id": 0,
+            "sample": 0,
+            "preview_height": 100,
+            "preview_width": 150,
+            "tags": "benchmark solo",
+            "title": "",
+            "has_notes": "false",
+            "has_comments": "false",
+            "file_url": file_url,
+            "preview_url": file_url,
+            "sample_url": "",
+            "sample_height": 0,
+            "sample_width": 0,
+            "status": "active",
+            "post_locked": 0,
+            "has_children": "false",
+        }
+
+    def _pixiv_illust(self, post_id: int) -> dict[str, Any]:
+        width, height = self.config.result_size
+        pages = [
+            {
+                "image_urls": {
+                    size: f"https://i.pximg.net/img-original/img/{post_id}_p{page}.jpg"
+                    for size in ("square_medium", "medium", "large", "original")
+                }
+            }
+            for page in range(self.config.pages)
+        ]
+        return {
+            "id": post_id,
+            "title": f"Benchmark {post_id}",
+            "type": "illust",
+            "image_urls": pages[0]["image_urls"],
+            "caption": "",
+            "restrict": 0,
+            "user": {
+                "id": 1,
+                "name": "Benchmark",
+                "account": "benchmark",
+                "profile_image_urls": {"medium": "https://i.pximg.net/user-profile/img/1.jpg"},
+                "is_followed": False,
+            },
+            "tags": [{"name": "benchmark", "translated_name": None}],
+            "tools": [],
+            "create_date": "2023-01-01T00:00:00+09:00",
+            "page_count": len(pages),
+            "width": width,
+            "height": height,
+            "sanity_level": 2,
+            "x_restrict": 0,
+            "series": None,
+            "meta_single_page": {},
+            "meta_pages": pages,
+            "total_view": 1,
+            "total_bookmarks": 1,
+            "is_bookmarked": False,
+            "visible": True,
+            "is_muted": False,
+            "illust_ai_type": 1,
+            "illust_book_style": 0,
+        }
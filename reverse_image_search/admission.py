@@ -0,0 +1,157 @@
+from asyncio import Future, get_running_loop
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+
+from pydantic import BaseModel, Field
+
+
+class Overloaded(Exception):
+    """Raised when a search is shed because the queues are full."""
+
+
+class AdmissionControl:
+    """
+    Limits how many searches run at the same time and queues the rest fairly.
+
+    Waiting searches are queued per chat and the queues are served round-robin, so a chat sending many files at
+    once only delays its own searches. Each chat may additionally only run a few searches at the same time. When the
+    queues are full new searches are shed with `Overloaded` instead of piling up.
+
+    Attributes:
+        config (AdmissionControl.Config): The admission configuration.
+        running (int): Number of searches currently running.
+        rejected (int): Total number of searches shed because the queues were full.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the AdmissionControl.
+
+        Attributes:
+            concurrency (int): Maximum number of searches running at the same time (defaults to 8).
+            chat_concurrency (int): Maximum number of searches of a single chat running at the same time (defaults
+                to 2).
+            chat_queue (int): Maximum number of searches a single chat may have waiting (defaults to 10).
+            queue (int): Maximum number of searches waiting in total (defaults to 200).
+        """
+
+        concurrency: int = Field(8, ge=1)
+        chat_concurrency: int = Field(2, ge=1)
+        chat_queue: int = Field(10, ge=0)
+        queue: int = Field(200, ge=0)
+
+    def __init__(self, config: "AdmissionControl.Config | None" = None):
+        """
+        Initialise the AdmissionControl.
+
+        Args:
+            config (AdmissionControl.Config, optional): The admission configuration (defaults to the default config).
+        """
+        self.config = config or AdmissionControl.Config()
+        self.running = 0
+        self.rejected = 0
+        self._active: Counter[Hashable] = Counter()
+        # Chats with waiting searches in round-robin order, the chat served last moves to the end
+        self._queues: OrderedDict[Hashable, deque[Future[None]]] = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        """Number of searches currently waiting"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _can_run(self, key: Hashable) -> bool:
+        return self.running < self.config.concurrency and self._active[key] < self.config.chat_concurrency
+
+    def _start(self, key: Hashable) -> None:
+        self.running += 1
+        self._active[key] += 1
+
+    def _finish(self, key: Hashable) -> None:
+        self.running -= 1
+        self._active[key] -= 1
+        if not self._active[key]:
+            del self._active[key]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the waiting searches, one chat after the other."""
+        while self.running < self.config.concurrency:
+            key = next((key for key in self._queues if self._can_run(key)), None)
+            if key is None:
+                return
+            queue = self._queues.pop(key)
+            future = queue.popleft()
+            if queue:
+                self._queues[key] = queue
+            self._start(key)
+            future.set_result(None)
+
+    def _remove(self, key: Hashable, future: "Future[None]") -> None:
+        if (queue := self._queues.get(key)) is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._queues[key]
+
+    def position(self, key: Hashable, index: int) -> int:
+        """
+        Estimate when a waiting search is served.
+
+        Args:
+            key (Hashable): The chat of the search.
+            index (int): The position of the search in the queue of its chat.
+
+        Returns:
+            int: The 1-based position among all waiting searches, assuming all chats are served round-robin.
+        """
+        position = index + 1
+        before = True
+        for other, queue in self._queues.items():
+            if other == key:
+                before = False
+                continue
+            position += min(len(queue), index + 1 if before else index)
+        return position
+
+    @asynccontextmanager
+    async def admit(
+        self, key: Hashable, on_queued: Callable[[int], Awaitable[object]] | None = None
+    ) -> AsyncIterator[None]:
+        """
+        Run a search once it is its turn.
+
+        Args:
+            key (Hashable): The chat of the search, searches of the same chat share a queue.
+            on_queued (Callable[[int], Awaitable[object]], optional): Called with the queue position if the search
+                has to wait (defaults to None).
+
+        Raises:
+            Overloaded: If the queue of the chat or all queues together are full.
+        """
+        future: Future[None] = get_running_loop().create_future()
+        queue = self._queues.setdefault(key, deque())
+        queue.append(future)
+        self._dispatch()
+
+        if not future.done():
+            if len(queue) > self.config.chat_queue or self.queued > self.config.queue:
+                self._remove(key, future)
+                self.rejected += 1
+                raise Overloaded("Too many searches waiting")
+
+            try:
+                if on_queued:
+                    await on_queued(self.position(key, queue.index(future)))
+                await future
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    # Cancelled right after getting a slot, pass it on
+                    self._finish(key)
+                else:
+                    future.cancel()
+                    self._remove(key, future)
+                raise
+
+        try:
+            yield
+        finally:
+            self._finish(key)
@@ -1,10 +1,16 @@
-from asyncio import create_task, gather
+import atexit
+import logging
+from asyncio import Queue, Task, create_task, gather, to_thread, wait_for
+from collections import Counter
+from contextlib import aclosing
+from functools import cached_property, partial
 from pathlib import Path
-from typing import Sequence, Tuple
+from time import monotonic
+from typing import AsyncGenerator, Sequence, Tuple
 
-from aiohttp import ClientSession
 from aiostream import stream
 from bots import Application
+from pydantic import BaseModel, Field
 from telegram import (
     Animation,
     Document,
@@ -19,63 +25,288 @@ from telegram import (
     Update,
     Video,
 )
-from telegram.constants import ParseMode
+from telegram.constants import InlineKeyboardMarkupLimit, MediaGroupLimit, MessageLimit, ParseMode
 from telegram.error import BadRequest
+from telegram.ext import Application as TelegramApplication
 from telegram.ext import CommandHandler, ContextTypes, MessageHandler, filters
+from tgtools.models.summaries import Downloadable, FileSummary
 from tgtools.telegram.compatibility import OutputFileType, make_tg_compatible
 from tgtools.utils.types import TELEGRAM_FILES
 from tgtools.utils.urls.emoji import FALLBACK_EMOJIS, host_name
+from yarl import URL
 
-from reverse_image_search.engines import initiate_engines
-from reverse_image_search.engines.saucenao import SauceNaoSearchEngine
-from reverse_image_search.providers import initiate_data_providers
+from reverse_image_search.admission import AdmissionControl, Overloaded
+from reverse_image_search.cache import MISSING, CacheKey, FileIdCache, ResultCache
+from reverse_image_search.deadline import SearchBudget
+from reverse_image_search.downloader import Downloader
+from reverse_image_search.engines import ENGINES, initiate_engines
+from reverse_image_search.engines.base import SearchEngine
+from reverse_image_search.engines.config import SauceNaoConfig
+from reverse_image_search.fileserver import FileServer
+from reverse_image_search.http import HttpPool
+from reverse_image_search.keyboard import SearchKeyboard
+from reverse_image_search.media import FrameExtractor, MediaPreparer
+from reverse_image_search.metrics import MAKE_TG_COMPATIBLE, REGISTRY, SEARCH, Callback, MetricsServer
+from reverse_image_search.phash import PerceptualHashIndex
+from reverse_image_search.preflight import probe_media
+from reverse_image_search.providers import PROVIDERS, Providers
 from reverse_image_search.providers.base import SearchResult
-from reverse_image_search.providers.booru import BooruProvider
-from reverse_image_search.providers.pixiv import PixivProvider
-from reverse_image_search.utils import chunks, download_file
+from reverse_image_search.providers.config import BooruConfig, PixivConfig
+from reverse_image_search.quota import SauceNaoQuota, SauceNaoScheduler
+from reverse_image_search.sender import Priority, SendScheduler
+from reverse_image_search.store import DownloadStore
+from reverse_image_search.utils import chunks, download_file, file_content, media_url
+from reverse_image_search.worker import WorkerPool
+
+logger = logging.getLogger(__name__)
 
 ZWS = "​"
 
 SUPPORTED_MEDIA = InputMediaPhoto | InputMediaVideo | InputMediaAnimation | InputMediaDocument
 
+SENDABLE = OutputFileType | str | bytes
+"""A file made compatible with Telegram, a Telegram `file_id` or the content of a prepared photo"""
+
+GROUP_FILE = tuple[SENDABLE, TELEGRAM_FILES, str | None, FileSummary | Downloadable]
+"""A prepared file with its Telegram type, the URL on the provider and the file as given by the provider"""
+
+ADDITIONAL_FILE = tuple[Task[tuple[SENDABLE | None, TELEGRAM_FILES]], str | None, FileSummary | Downloadable]
+"""An additional file being prepared, its URL on the provider and the file as given by the provider"""
+
+STREAMED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+"""Image types downloaded by the bot itself, streamed to disk and prepared as photos"""
+
+FILE_KINDS: dict[str, TELEGRAM_FILES] = {
+    "photo": PhotoSize,
+    "video": Video,
+    "animation": Animation,
+    "document": Document,
+}
+
+
+class SearchPipeline:
+    """
+    The search pipeline, everything `hndl_search` needs besides the Telegram application itself.
+
+    The bot runs it in its own process, or leaves it to the worker processes which create it on their own.
 
-class ReverseImageSearch(Application):
-    class Arguments(Application.Arguments):
+    Attributes:
+        arguments (SearchPipeline.Arguments): The arguments of the pipeline.
+        workers (WorkerPool | None): The worker processes searches are handed to, if the bot runs them.
+    """
+
+    class Arguments(BaseModel):
         downloads: Path
         file_url: str
-        saucenao: SauceNaoSearchEngine.Config
-        boorus: BooruProvider.Config
-        pixiv: PixivProvider.Config
+        saucenao: SauceNaoConfig
+        boorus: BooruConfig | None = None
+        pixiv: PixivConfig | None = None
+        engines: list[str] = Field(default_factory=lambda: list(ENGINES.plugins))
+        cache: ResultCache.Config = ResultCache.Config()
+        file_ids: FileIdCache.Config = FileIdCache.Config()
+        hash_index: PerceptualHashIndex.Config = PerceptualHashIndex.Config()
+        frame_extractor: FrameExtractor.Config = FrameExtractor.Config()
+        media: MediaPreparer.Config = MediaPreparer.Config()
+        downloads_store: DownloadStore.Config = DownloadStore.Config()
+        http: HttpPool.Config = HttpPool.Config()
+        downloader: Downloader.Config = Downloader.Config()
+        media_group_size: int = Field(5, ge=2, le=10)
+        aggregate_results: bool = False
+        aggregate_window: float = Field(1.5, ge=0)
+        file_server: FileServer.Config = FileServer.Config()
+        workers: WorkerPool.Config = WorkerPool.Config()
+        metrics: MetricsServer.Config = MetricsServer.Config()
+        budget: SearchBudget.Config = SearchBudget.Config()
+        admission: AdmissionControl.Config = AdmissionControl.Config()
+        sender: SendScheduler.Config = SendScheduler.Config()
 
-    arguments: "ReverseImageSearch.Arguments"
+    workers: WorkerPool | None = None
 
-    async def on_initialize(self) -> None:
-        await super().on_initialize()
-        self.arguments.downloads.mkdir(exist_ok=True, parents=True)
+    def __init__(self, arguments: "SearchPipeline.Arguments"):
+        """
+        Initialise the SearchPipeline, call `initialize_components` before searching.
 
-        self.application.add_handler(CommandHandler("start", self.cmd_start))
-        self.application.add_handler(
-            MessageHandler(
-                filters.PHOTO
-                | filters.Sticker.STATIC
-                | filters.Sticker.VIDEO
-                | filters.VIDEO
-                | filters.Document.VIDEO
-                | filters.Document.IMAGE
-                | filters.ANIMATION,
-                self.hndl_search,
-            )
-        )
+        Args:
+            arguments (SearchPipeline.Arguments): The arguments of the pipeline.
+        """
+        self.arguments = arguments
 
-        self.session = ClientSession()
-        self.providers = await initiate_data_providers(self.session, self.arguments)
-        self.engines = await initiate_engines(self.session, self.arguments, self.providers)
+    async def initialize_components(self, serve_files: bool = True) -> None:
+        """
+        Create the search pipeline, everything `hndl_search` needs besides the Telegram application itself.
 
-    async def cmd_start(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-        if not update.message:
+        Args:
+            serve_files (bool, optional): Start the file server if it is enabled, worker processes leave it to the
+                bot process (defaults to True).
+        """
+        self.downloads = DownloadStore(self.arguments.downloads, self.arguments.downloads_store)
+        await self.downloads.load()
+        self.downloads.start()
+        self.file_server = FileServer(self.downloads, self.arguments.file_server)
+        if serve_files:
+            await self.file_server.start()
+
+        self.http = HttpPool(self.arguments.http)
+        self.session = self.http.session
+        self.downloader = Downloader(self.session, self.downloads, self.arguments.downloader)
+        self.cache = ResultCache(self.arguments.cache)
+        self.file_ids = FileIdCache(self.arguments.file_ids)
+        self.send_paths: Counter[str] = Counter()
+        self.hash_index = PerceptualHashIndex(self.arguments.hash_index)
+        self.frame_extractor = FrameExtractor(self.arguments.frame_extractor)
+        self.media = MediaPreparer(self.arguments.media)
+        await self.media.start()
+        self.providers = Providers(self.session, self.downloader, self.arguments, self.cache)
+        self.admission = AdmissionControl(self.arguments.admission)
+        self.sender = SendScheduler(self.arguments.sender)
+        self.budget = SearchBudget(self.arguments.budget)
+        self.cache.register_lazy("engine", lambda: {f"engine.{engine.name}": engine for engine in self.engines})
+
+        self._register_metrics()
+        self.metrics = MetricsServer(REGISTRY, self.arguments.metrics)
+        await self.metrics.start()
+
+    @cached_property
+    def engines(self) -> list[SearchEngine]:
+        """The configured search engines, imported and created on the first search"""
+        return initiate_engines(self.session, self.arguments, self.providers, self.cache, self.budget)
+
+    @cached_property
+    def inline_engines(self) -> list[SearchEngine]:
+        """The engines taking part in the search itself, link only engines just get a button"""
+        return [engine for engine in self.engines if engine.inline_results]
+
+    @cached_property
+    def keyboard(self) -> SearchKeyboard:
+        """The keyboard with a button per search engine"""
+        return SearchKeyboard(self.engines)
+
+    def _saucenao_quotas(self) -> list[SauceNaoQuota]:
+        """The API key quotas of the SauceNAO engine, none until the engines are created"""
+        if "engines" not in self.__dict__:
+            return []
+        schedulers = [getattr(engine, "scheduler", None) for engine in self.engines]
+        return [
+            quota for scheduler in schedulers if isinstance(scheduler, SauceNaoScheduler) for quota in scheduler.quotas
+        ]
+
+    async def shutdown_components(self) -> None:
+        """Stop the background tasks and close the connections of the components, called once the bot shut down."""
+        await self.metrics.stop()
+        await self.file_server.stop()
+        self.downloads.stop()
+        self.downloads.close()
+        if self.workers:
             return
+        await self.providers.stop()
+        self.media.stop()
+        await self.http.close()
+        self.cache.close()
+        self.file_ids.close()
+        self.hash_index.close()
 
-        await update.message.reply_text("Hello")
+    def _register_metrics(self) -> None:
+        """Expose the statistics the components keep themselves as metrics."""
+        REGISTRY.register(
+            Callback(
+                "ris_result_cache_lookups_total",
+                "Result cache lookups by outcome",
+                lambda: {"memory": self.cache.hits, "disk": self.cache.disk_hits, "miss": self.cache.misses},
+                "counter",
+                "outcome",
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_result_cache_memory_bytes",
+                "Estimated size of the in-memory result cache",
+                lambda: self.cache.memory_bytes,
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_send_paths_total",
+                "Result files sent by how they reached Telegram",
+                lambda: dict(self.send_paths),
+                "counter",
+                "path",
+            )
+        )
+        REGISTRY.register(
+            Callback("ris_http_pool", "Usage of the shared HTTP connection pool", self.http.stats, labelname="stat")
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_frame_extraction_waiting",
+                "Videos queued or running for frame extraction",
+                lambda: self.frame_extractor.waiting,
+            )
+        )
+        REGISTRY.register(Callback("ris_downloads_bytes", "Size of the downloads store", lambda: self.downloads.size))
+        REGISTRY.register(
+            Callback("ris_admission_queued", "Searches waiting to be admitted", lambda: self.admission.queued)
+        )
+        REGISTRY.register(
+            Callback("ris_admission_running", "Searches currently running", lambda: self.admission.running)
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_admission_rejected_total",
+                "Searches shed because the queues were full",
+                lambda: self.admission.rejected,
+                "counter",
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_telegram_sends_waiting", "Telegram sends waiting for the flood limits", lambda: self.sender.waiting
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_telegram_retry_after_total",
+                "Telegram sends refused with RetryAfter",
+                lambda: self.sender.retried,
+                "counter",
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_plugin_load_seconds",
+                "Time it took to import and create each search engine and data provider",
+                lambda: {
+                    **{f"engine:{name}": seconds for name, seconds in ENGINES.load_times.items()},
+                    **{f"provider:{name}": seconds for name, seconds in PROVIDERS.load_times.items()},
+                },
+                labelname="plugin",
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_saucenao_long_remaining",
+                "Remaining daily SauceNAO quota per API key",
+                lambda: {quota.name: quota.headroom[1] for quota in self._saucenao_quotas()},
+                labelname="key",
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_saucenao_requests_total",
+                "SauceNAO requests per API key",
+                lambda: {quota.name: quota.requests for quota in self._saucenao_quotas()},
+                "counter",
+                "key",
+            )
+        )
+        REGISTRY.register(
+            Callback(
+                "ris_saucenao_rate_limited_total",
+                "SauceNAO requests refused with 429 per API key",
+                lambda: {quota.name: quota.rate_limited for quota in self._saucenao_quotas()},
+                "counter",
+                "key",
+            )
+        )
 
     async def hndl_search(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
         # Basically only for nice symbols / please the linter
@@ -92,99 +323,581 @@ class ReverseImageSearch(Application):
         ):
             return
 
-        file = await download_file(update, self.arguments.downloads)
-        if not file:
-            await update.message.reply_text("Something went wrong, try again or contact the bot author (/help)")
-            return
+        message = update.message
 
-        file_url = self.arguments.file_url + file.name
-        file_url = "https://v2.nachtalb.io/ris/f/AQADWb0xG1lWQVF-.jpg"
+        async def queued(position: int) -> None:
+            await self.sender.send(
+                message.chat,
+                partial(
+                    message.reply_text,
+                    f"The bot is busy, your search is queued as #{position}.",
+                    reply_to_message_id=message.id,
+                ),
+                Priority.FIRST,
+            )
 
-        buttons = [
-            InlineKeyboardButton(engine.name, engine.generate_search_url(str(file_url))) for engine in self.engines
-        ]
+        try:
+            if self.workers:
+                await self.workers.submit(update)
+                return
+            async with self.admission.admit(update.effective_chat.id, queued):
+                await self._search(update, message)
+        except Overloaded:
+            await self.sender.send(
+                message.chat,
+                partial(
+                    message.reply_text,
+                    "The bot is too busy right now, please try again in a few minutes.",
+                    reply_to_message_id=message.id,
+                ),
+                Priority.FIRST,
+            )
 
-        await update.message.reply_text(
-            "Use one of the buttons to open the search engine.",
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("Open Image", url=file_url)]] + list(chunks(buttons, 3))
-            ),
-            reply_to_message_id=update.message.id,
-        )
+    async def _search(self, update: Update, message: Message) -> None:
+        with SEARCH.time():
+            file = await download_file(update, self.downloads, self.frame_extractor)
+            if not file:
+                await self.sender.send(
+                    message.chat,
+                    partial(message.reply_text, "Something went wrong, try again or contact the bot author (/help)"),
+                    Priority.FIRST,
+                )
+                return
 
-        inline_search_results = stream.merge(*[engine.search(file_url) for engine in self.engines])
-        async with inline_search_results.stream() as streamer:
-            async for result in streamer:
-                if not result or result.message is None:
-                    continue
+            file_url = self.file_server.url(self.arguments.file_url, file)
+            engine_urls = {
+                engine: self.file_server.url(self.arguments.file_url, file, engine.file_max_edge)
+                for engine in self.engines
+            }
+
+            await self.sender.send(
+                message.chat,
+                partial(
+                    message.reply_text,
+                    "Use one of the buttons to open the search engine.",
+                    reply_markup=self.keyboard.build(file_url, engine_urls),
+                    reply_to_message_id=message.id,
+                ),
+                Priority.FIRST,
+            )
+
+            image_hash = await self.hash_index.hash_file(file)
+            if image_hash is not None and (known_results := self._known_results(image_hash)) is not None:
+                if self.arguments.aggregate_results:
+                    await self.send_results(known_results, message, Priority.FIRST)
+                    return
+                for index, result in enumerate(known_results):
+                    await self.send_message_construct(
+                        result, message, priority=Priority.RESULT if index else Priority.FIRST
+                    )
+                return
+
+            found: list[CacheKey] = []
+            with self.budget.search() as deadline:
+                async with aclosing(self._result_batches(engine_urls, file, deadline)) as batches:
+                    async for batch in batches:
+                        priority = Priority.RESULT if found else Priority.FIRST
+                        if self.arguments.aggregate_results:
+                            await self.send_results(batch, message, priority)
+                        else:
+                            await self.send_message_construct(batch[0], message, priority=priority)
+                        found.extend(result.query for result in batch if result.query is not None)
+
+            if image_hash is not None and found:
+                self.hash_index.add(image_hash, found)
+
+    async def _result_batches(
+        self, engine_urls: dict[SearchEngine, str], file: Path, deadline: float
+    ) -> AsyncGenerator[list[SearchResult], None]:
+        """
+        Search with the engines giving inline results and yield the results found before the deadline.
+
+        Results are yielded one by one. With `aggregate_results` each batch instead collects the results arriving
+        within `aggregate_window` seconds after its first one. The engines keep searching while a batch is sent.
+
+        Args:
+            engine_urls (dict[SearchEngine, str]): The public URL of the image for each search engine.
+            file (Path): The local copy of the image.
+            deadline (float): Monotonic time after which no more results are waited for.
+
+        Yields:
+            list[SearchResult]: The next results to send.
+        """
+        results: Queue[SearchResult | None] = Queue()
+
+        async def collect() -> None:
+            try:
+                inline_search_results = stream.merge(
+                    *[
+                        engine.search(engine_urls[engine], file if engine.supports_upload else None)
+                        for engine in self.inline_engines
+                    ]
+                )
+                async with inline_search_results.stream() as streamer:
+                    async for result in streamer:
+                        if result and result.message is not None:
+                            results.put_nowait(result)
+            finally:
+                results.put_nowait(None)
+
+        collector = create_task(collect())
+        try:
+            batch: list[SearchResult] = []
+            window_end = float("inf")
+            while True:
+                # Only waiting for results is bounded, a result already found is always sent completely
                 try:
-                    await self.send_message_construct(result, update.message)
-                except BadRequest:
-                    await self.send_message_construct(result, update.message, force_download=True)
+                    result = await wait_for(results.get(), max(0, min(deadline, window_end) - monotonic()))
+                except TimeoutError:
+                    if monotonic() >= deadline:
+                        logger.info("Search deadline reached, dropping results still on their way")
+                        break
+                    yield batch
+                    batch, window_end = [], float("inf")
+                    continue
 
-    async def send_message_construct(
-        self, result: SearchResult, query_message: Message, force_download: bool = False
-    ) -> None:
+                if result is None:
+                    await collector  # Raise the error of a failed search engine
+                    break
+                batch.append(result)
+                if not self.arguments.aggregate_results:
+                    yield batch
+                    batch = []
+                elif len(batch) == 1:
+                    window_end = monotonic() + self.arguments.aggregate_window
+            if batch:
+                yield batch
+        finally:
+            collector.cancel()
+            await gather(collector, return_exceptions=True)
+
+    def _known_results(self, image_hash: int) -> list[SearchResult] | None:
+        """
+        Get the results of an earlier search for the same or a near-duplicate image.
+
+        Args:
+            image_hash (int): The perceptual hash of the searched image.
+
+        Returns:
+            list[SearchResult] | None: The results or None if the image is unknown or any result is no longer cached.
+        """
+        if not (keys := self.hash_index.lookup(image_hash)):
+            return None
+
+        results = [self.cache.get(key) for key in keys]
+        if any(result is MISSING or result is None for result in results):
+            return None
+        return results
+
+    @staticmethod
+    def _result_buttons(result: SearchResult, prefix: str = "") -> list[InlineKeyboardButton]:
+        """The link buttons of a result, the source first."""
         buttons = [
             InlineKeyboardButton(
-                host_name(result.message.provider_url, with_emoji=True, fallback=FALLBACK_EMOJIS["globe"]),
+                prefix + host_name(result.message.provider_url, with_emoji=True, fallback=FALLBACK_EMOJIS["globe"]),
                 result.message.provider_url,
             )
         ]
         for url in result.message.additional_urls:
-            buttons.append(InlineKeyboardButton(host_name(url, with_emoji=True), url=url))
-
-        markup = InlineKeyboardMarkup(tuple(chunks(buttons, 3)))
+            buttons.append(InlineKeyboardButton(prefix + host_name(url, with_emoji=True), url=url))
+        return buttons
 
-        additional_files_tasks = [
-            create_task(make_tg_compatible(file=file, force_download=force_download))
-            for file in result.message.additional_files
+    def _prepare_additional_files(self, result: SearchResult, force_download: bool = False) -> list[ADDITIONAL_FILE]:
+        """Start preparing the additional files of a result in the background."""
+        return [
+            (create_task(self._prepare_file(file, source, force_download)), source, file)
+            for file, source in ((file, media_url(file)) for file in result.message.additional_files)
         ]
-        main_summary = None
-        type_: TELEGRAM_FILES = Document
-        if result.message.file:
-            main_summary, type_ = await make_tg_compatible(file=result.message.file, force_download=force_download)
-
-        # Send main file for the message
-        if main_summary:
-            result.message.file = main_summary
-            common_file = await main_summary.as_common()  #  pyright: ignore
-
-            if type_ is PhotoSize:
-                main_message = await query_message.reply_photo(
-                    photo=common_file, caption=result.caption, parse_mode=ParseMode.HTML, reply_markup=markup
+
+    @staticmethod
+    async def _discard_additional_files(files: list[ADDITIONAL_FILE]) -> None:
+        """Cancel preparing additional files which will not be sent and wait for them to stop."""
+        for task, _, _ in files:
+            task.cancel()
+        await gather(*(task for task, _, _ in files), return_exceptions=True)
+
+    async def send_message_construct(
+        self,
+        result: SearchResult,
+        query_message: Message,
+        force_download: bool = False,
+        priority: Priority = Priority.RESULT,
+    ) -> None:
+        markup = InlineKeyboardMarkup(tuple(chunks(self._result_buttons(result), 3)))
+
+        additional_files = self._prepare_additional_files(result, force_download)
+        try:
+            main_file: SENDABLE | None = None
+            main_source = None
+            type_: TELEGRAM_FILES = Document
+            if result.message.file:
+                main_source = media_url(result.message.file)
+                main_file, type_ = await self._prepare_file(result.message.file, main_source, force_download)
+
+            # Send main file for the message
+            if main_file and result.message.file:
+                try:
+                    main_message = await self._reply_file(
+                        query_message, main_file, type_, result.caption, markup, priority
+                    )
+                except BadRequest:
+                    # Telegram could not fetch the URL or file_id, upload only this file and keep the rest as is
+                    if not await self._is_remote(main_file):
+                        raise
+                    if main_source:
+                        # A stale file_id would be rejected again by every later search
+                        self.file_ids.forget(main_source)
+                    self.send_paths["retry_upload"] += 1
+                    main_file, type_ = await self._prepare_file(result.message.file, main_source, force_download=True)
+                    if not main_file:
+                        raise
+                    main_message = await self._reply_file(
+                        query_message, main_file, type_, result.caption, markup, priority
+                    )
+                self._remember_file_id(main_source, main_message)
+            else:
+                main_message = await self.sender.send(
+                    query_message.chat,
+                    partial(query_message.reply_html, text=result.caption, reply_markup=markup),
+                    priority,
                 )
-            elif type_ is Video:
-                main_message = await query_message.reply_video(
-                    video=common_file, caption=result.caption, parse_mode=ParseMode.HTML, reply_markup=markup
+
+            await self._send_additional_files(result, additional_files, main_message)
+        except BaseException:
+            await self._discard_additional_files(additional_files)
+            raise
+
+    async def send_results(
+        self, results: list[SearchResult], query_message: Message, priority: Priority = Priority.RESULT
+    ) -> None:
+        """
+        Send several results with as few messages as possible.
+
+        The main files of the results are sent together as albums, each captioned with its numbered result. One
+        combined message follows with the results without a file and the link buttons of all results, as albums
+        cannot have a keyboard. Results that do not fit the caption, text or keyboard limits, or whose file would be
+        alone in its album, are sent on their own.
+
+        Args:
+            results (list[SearchResult]): The results to send.
+            query_message (Message): The message to reply to.
+            priority (Priority, optional): The priority of the albums and the combined message (defaults to
+                Priority.RESULT).
+        """
+        if len(results) < 2:
+            for result in results:
+                await self.send_message_construct(result, query_message, priority=priority)
+            return
+
+        combined: list[SearchResult] = []
+        separate: list[SearchResult] = []
+        text_length = button_count = 0
+        for result in results:
+            # Estimated with the full caption, whether a result ends up in an album is only known once prepared
+            length = len(f"{len(combined) + 1}. {result.caption}\n\n")
+            buttons = 1 + len(result.message.additional_urls)
+            if (
+                length > MessageLimit.CAPTION_LENGTH
+                or text_length + length > MessageLimit.MAX_TEXT_LENGTH
+                or button_count + buttons > InlineKeyboardMarkupLimit.TOTAL_BUTTON_NUMBER
+            ):
+                separate.append(result)
+                continue
+            combined.append(result)
+            text_length += length
+            button_count += buttons
+
+        async def prepare(result: SearchResult) -> tuple[SENDABLE | None, TELEGRAM_FILES, str | None]:
+            if not result.message.file:
+                return None, Document, None
+            source = media_url(result.message.file)
+            file, type_ = await self._prepare_file(result.message.file, source)
+            return file, type_, source
+
+        prepared: list[tuple[SENDABLE | None, TELEGRAM_FILES, str | None]] = []
+        for result, outcome in zip(combined, await gather(*map(prepare, combined), return_exceptions=True)):
+            if isinstance(outcome, BaseException):
+                # The result is still listed in the combined message, just without its file
+                logger.warning("Preparing the file of %s failed: %r", result.message.provider_url, outcome)
+                outcome = None, Document, None
+            prepared.append(outcome)
+
+        # Documents cannot be mixed with other media in an album
+        kinds: dict[bool, list[int]] = {False: [], True: []}
+        for index, (file, type_, _) in enumerate(prepared):
+            if file is not None:
+                kinds[type_ is Document].append(index)
+        albums = [album for indices in kinds.values() for album in chunks(indices, MediaGroupLimit.MAX_MEDIA_LENGTH)]
+        for album in [album for album in albums if len(album) < 2]:
+            albums.remove(album)
+            separate.append(combined[album[0]])
+
+        in_albums = [index for album in albums for index in album]
+        as_text = [index for index, (file, _, _) in enumerate(prepared) if file is None]
+        numbers = {index: number for number, index in enumerate(in_albums + as_text, 1)}
+
+        additional_files = {index: self._prepare_additional_files(combined[index]) for index in numbers}
+        try:
+            replies: dict[int, Message | None] = {}
+            for album in albums:
+                group = [
+                    (prepared[index][0], prepared[index][1], prepared[index][2], combined[index].message.file)
+                    for index in album
+                ]
+                captions: list[str | None] = [f"{numbers[index]}. {combined[index].caption}" for index in album]
+                sent = await self._send_file_group(group, captions, query_message, priority)  # type: ignore[arg-type]
+                replies.update(zip(album, sent))
+
+            if numbers:
+                text = "\n\n".join(
+                    f"{numbers[index]}. {combined[index].intro if index in in_albums else combined[index].caption}"
+                    for index in in_albums + as_text
                 )
-            elif type_ is Animation:
-                main_message = await query_message.reply_animation(
-                    animation=common_file, caption=result.caption, parse_mode=ParseMode.HTML, reply_markup=markup
+                markup = InlineKeyboardMarkup(
+                    [
+                        row
+                        for index in in_albums + as_text
+                        for row in chunks(self._result_buttons(combined[index], f"{numbers[index]}. "), 3)
+                    ]
                 )
-            else:
-                main_message = await query_message.reply_document(
-                    document=common_file, caption=result.caption, parse_mode=ParseMode.HTML, reply_markup=markup
+                summary = await self.sender.send(
+                    query_message.chat, partial(query_message.reply_html, text=text, reply_markup=markup), priority
                 )
-        else:
-            main_message = await query_message.reply_html(
-                text=result.caption,
-                reply_markup=markup,
-            )
 
-        # Send additional files if needed
-        if additional_files_tasks:
-            ready_files = [(file, type_) for file, type_ in await gather(*additional_files_tasks) if file is not None]
+                for index, files in additional_files.items():
+                    await self._send_additional_files(combined[index], files, replies.get(index) or summary)
+        except BaseException:
+            await gather(*map(self._discard_additional_files, additional_files.values()))
+            raise
+
+        for result in separate:
+            await self.send_message_construct(result, query_message)
 
-            await self._send_media_group(
-                files=ready_files,
-                message=main_message,
-                captions=result.message.additional_files_captions,
+    async def _send_additional_files(
+        self, result: SearchResult, additional_files: list[ADDITIONAL_FILE], message: Message
+    ) -> None:
+        """
+        Send the additional files of a result in media groups, each as soon as enough files are ready.
+
+        Args:
+            result (SearchResult): The result the files belong to.
+            additional_files (list[ADDITIONAL_FILE]): The files being prepared, see `_prepare_additional_files`.
+            message (Message): The message the groups reply to.
+        """
+        given_captions = result.message.additional_files_captions
+        captions: list[str | None] = [given_captions] if isinstance(given_captions, str) else list(given_captions or ())
+        captions += [None] * (len(additional_files) - len(captions))
+
+        group: list[GROUP_FILE] = []
+        group_captions: list[str | None] = []
+        for index, (task, source, original) in enumerate(additional_files):
+            file, type_ = await task
+            if file is not None:
+                group.append((file, type_, source, original))
+                group_captions.append(captions[index])
+
+            remaining = len(additional_files) - index - 1
+            # Keep a single remaining file in this group, Telegram needs at least two per group
+            if group and (not remaining or (len(group) >= self.arguments.media_group_size and remaining > 1)):
+                await self._send_file_group(group, group_captions, message)
+                group, group_captions = [], []
+
+    async def _send_file_group(
+        self,
+        group: list[GROUP_FILE],
+        captions: list[str | None],
+        message: Message,
+        priority: Priority = Priority.FOLLOW_UP,
+    ) -> list[Message | None]:
+        """
+        Send prepared files as media group, uploading those Telegram could not fetch itself.
+
+        Args:
+            group (list[GROUP_FILE]): The prepared files with their type, the URL on the provider and the file as
+                given by the provider.
+            captions (list[str | None]): The caption of each file in HTML format.
+            message (Message): The message the group replies to.
+            priority (Priority, optional): The priority of the group (defaults to Priority.FOLLOW_UP).
+
+        Returns:
+            list[Message | None]: The message of each file, None for files that could not be sent.
+        """
+        indices = list(range(len(group)))
+        try:
+            messages = await self._send_media_group(
+                files=[(file, type_) for file, type_, _, _ in group],
+                message=message,
+                captions=captions,
+                priority=priority,
+            )
+        except BadRequest:
+            # Telegram does not tell which file it rejected, upload those it had to fetch itself
+            remote = [index for index, (file, *_) in enumerate(group) if await self._is_remote(file)]
+            if not remote:
+                raise
+            for index in remote:
+                if source := group[index][2]:
+                    self.file_ids.forget(source)
+            self.send_paths["retry_upload"] += len(remote)
+            uploads = await gather(
+                *(self._prepare_file(group[index][3], None, force_download=True) for index in remote)
             )
+            retried: list[tuple[SENDABLE | None, TELEGRAM_FILES]] = [(file, type_) for file, type_, _, _ in group]
+            for index, upload in zip(remote, uploads):
+                retried[index] = upload
+
+            indices = [index for index, (file, _) in enumerate(retried) if file is not None]
+            messages = await self._send_media_group(
+                files=[retried[index] for index in indices],  # type: ignore[misc]
+                message=message,
+                captions=[captions[index] for index in indices],
+                priority=priority,
+            )
+
+        sent: list[Message | None] = [None] * len(group)
+        for index, sent_message in zip(indices, messages or ()):
+            sent[index] = sent_message
+            self._remember_file_id(group[index][2], sent_message)
+        return sent
+
+    async def _reply_file(
+        self,
+        query_message: Message,
+        file: SENDABLE,
+        type_: TELEGRAM_FILES,
+        caption: str,
+        markup: InlineKeyboardMarkup,
+        priority: Priority = Priority.RESULT,
+    ) -> Message:
+        """
+        Reply with a single file using the method matching its type.
+
+        Args:
+            query_message (Message): The message to reply to.
+            file (SENDABLE): A file like that can be used for telegram, a Telegram `file_id` or the file content.
+            type_ (TELEGRAM_FILES): What telegram equal it is PhotoSize, Video, Animation or Document.
+            caption (str): The caption in HTML format.
+            markup (InlineKeyboardMarkup): The keyboard to attach.
+            priority (Priority, optional): The priority of the message (defaults to Priority.RESULT).
+
+        Returns:
+            Message: The sent message.
+        """
+        common_file = file if isinstance(file, (str, bytes)) else await file.as_common()  #  pyright: ignore
+
+        if type_ is PhotoSize:
+            request = partial(query_message.reply_photo, photo=common_file)
+        elif type_ is Video:
+            request = partial(query_message.reply_video, video=common_file)
+        elif type_ is Animation:
+            request = partial(query_message.reply_animation, animation=common_file)
+        else:
+            request = partial(query_message.reply_document, document=common_file)
+        return await self.sender.send(
+            query_message.chat,
+            partial(request, caption=caption, parse_mode=ParseMode.HTML, reply_markup=markup),
+            priority,
+        )
+
+    @staticmethod
+    async def _is_remote(file: SENDABLE | None) -> bool:
+        """Whether Telegram has to fetch the file itself, by URL or `file_id`, instead of receiving its content"""
+        if file is None or isinstance(file, bytes):
+            return False
+        return isinstance(file, str) or isinstance(await file.as_common(), str)
+
+    async def _prepare_file(
+        self, file: FileSummary | Downloadable, source: str | None, force_download: bool = False
+    ) -> tuple[SENDABLE | None, TELEGRAM_FILES]:
+        """
+        Make a provider file ready to be sent to Telegram.
+
+        Files Telegram would fetch by URL are probed first, if Telegram would reject them they are downloaded and
+        uploaded right away instead of failing the first attempt. Downloaded images are downscaled and re-encoded
+        to Telegram's photo limits.
+
+        Args:
+            file (FileSummary | Downloadable): The file as given by the provider.
+            source (str, optional): The URL of the file on the provider.
+            force_download (bool, optional): Download the file instead of letting Telegram fetch its URL, the
+                `file_id` of previously sent files is not used either (defaults to False).
+
+        Returns:
+            tuple[SENDABLE | None, TELEGRAM_FILES]: The file, the `file_id` of the same file sent earlier or the
+                content of the prepared photo, and its Telegram type.
+        """
+        if source and not force_download and (known := self.file_ids.get(source)):
+            self.send_paths["file_id"] += 1
+            file_id, kind = known
+            return file_id, FILE_KINDS[kind]
+
+        if source and (photo := await self.media.cached(source)) is not None:
+            self.send_paths["prepared"] += 1
+            return photo, PhotoSize
+
+        # Images the bot has to download anyway are streamed to disk and prepared by a worker process straight from
+        # there, so large originals never end up in memory
+        if (
+            source
+            and isinstance(file, Downloadable)
+            and self.media.config.enabled
+            and Path(URL(source).path).suffix.lower() in STREAMED_SUFFIXES
+        ):
+            download = await self.downloader.fetch(source)
+            try:
+                photo = await self.media.prepare(source, download.content)
+            finally:
+                await to_thread(download.close)
+            if photo is not None:
+                self.send_paths["upload"] += 1
+                return photo, PhotoSize
+
+        # Downloadables are always downloaded by make_tg_compatible, no need to probe them
+        if source and not force_download and not isinstance(file, Downloadable):
+            if (probe := await probe_media(self.session, source)) and not probe.fits_url():
+                self.send_paths["preflight_upload"] += 1
+                force_download = True
+
+        with MAKE_TG_COMPATIBLE.time():
+            prepared, type_ = await make_tg_compatible(file=file, force_download=force_download)
+
+        # Downscale downloaded images before they are uploaded, large originals may also arrive as documents
+        if (
+            prepared is not None
+            and source
+            and type_ in (PhotoSize, Document)
+            and not await self._is_remote(prepared)
+            and (content := await file_content(await prepared.as_common()))
+            and (photo := await self.media.prepare(source, content)) is not None
+        ):
+            prepared, type_ = photo, PhotoSize
+        if prepared is not None and not force_download:
+            self.send_paths["url" if await self._is_remote(prepared) else "upload"] += 1
+        elif prepared is not None:
+            self.send_paths["upload"] += 1
+        return prepared, type_
+
+    def _remember_file_id(self, source: str | None, message: Message) -> None:
+        """
+        Store the `file_id` of media sent to Telegram, to send it by `file_id` the next time.
+
+        Args:
+            source (str, optional): The URL of the file on the provider.
+            message (Message): The message the file was sent with.
+        """
+        if not source:
+            return
+        if message.photo:
+            self.file_ids.set(source, message.photo[-1].file_id, "photo")
+            return
+        for kind in ("video", "animation", "document"):
+            if media := getattr(message, kind):
+                self.file_ids.set(source, media.file_id, kind)
+                return
 
     async def _get_input_media(
         self,
-        file: OutputFileType,
+        file: SENDABLE,
         type_: TELEGRAM_FILES,
         caption: str | None = None,
         parse_mode: str = ParseMode.HTML,
@@ -194,7 +907,7 @@ class ReverseImageSearch(Application):
         Get the respective `InputMedia` for the given file.
 
         Args:
-            file (OutputFileType): A file like that can be used for telegram
+            file (SENDABLE): A file like that can be used for telegram, a Telegram `file_id` or the file content
             type_ (TELEGRAM_FILES): What telegram equal it is PhotoSize, Video, Animation or Document
             caption (str, optional): An additional caption for this piece of media.
             parse_mode (str, optional): What parse mode to use for the caption (defaults to HTML)
@@ -204,7 +917,7 @@ class ReverseImageSearch(Application):
         Returns:
             The corresponding `InputMedia[file type]`
         """
-        common_format = await file.as_common()
+        common_format = file if isinstance(file, (str, bytes)) else await file.as_common()
         if type_ is PhotoSize:
             return InputMediaPhoto(media=common_format, caption=caption, parse_mode=parse_mode)
         elif type_ is Video or (no_animation and type_ is Animation):
@@ -216,20 +929,22 @@ class ReverseImageSearch(Application):
 
     async def _send_media_group(
         self,
-        files: Sequence[Tuple[OutputFileType, TELEGRAM_FILES]],
+        files: Sequence[Tuple[SENDABLE, TELEGRAM_FILES]],
         message: Message,
         captions: Sequence[str | None] | str | None = None,
+        priority: Priority = Priority.FOLLOW_UP,
     ) -> tuple[Message, ...] | None:
         """
         Send a group of file as reply to a message
 
         Args:
-            files (Sequence[tuple[OutputFileType, TELEGRAM_FILES]]]): The additional files already made compatible
-                with Telegram
+            files (Sequence[tuple[SENDABLE, TELEGRAM_FILES]]]): The additional files already made compatible with
+                Telegram, their `file_id` or content
             message (Message): The message that the group should reply to.
             captions (Sequence[str | None] | str, optional): A list of captions or a single caption for the media
                 group files in HTML format
             force_download (bool, optional): If we want to enforce downloading the files first (defaults to False).
+            priority (Priority, optional): The priority of the group (defaults to Priority.FOLLOW_UP).
 
         Returns:
             A tuple of all Messages in the MediaGroup or None if the files were empty or not Telegram compatible.
@@ -258,4 +973,74 @@ class ReverseImageSearch(Application):
         if not ready_media:
             return None
 
-        return await message.reply_media_group(media=ready_media)
+        return await self.sender.send(
+            message.chat, partial(message.reply_media_group, media=ready_media), priority, len(ready_media)
+        )
+
+
+class ReverseImageSearch(Application, SearchPipeline):
+    class Arguments(Application.Arguments, SearchPipeline.Arguments):
+        pass
+
+    arguments: "ReverseImageSearch.Arguments"
+
+    async def on_initialize(self) -> None:
+        await super().on_initialize()
+        self.application.add_handler(CommandHandler("start", self.cmd_start))
+        self.application.add_handler(
+            MessageHandler(
+                filters.PHOTO
+                | filters.Sticker.STATIC
+                | filters.Sticker.VIDEO
+                | filters.VIDEO
+                | filters.Document.VIDEO
+                | filters.Document.IMAGE
+                | filters.ANIMATION,
+                self.hndl_search,
+            )
+        )
+
+        post_shutdown = self.application.post_shutdown
+
+        async def shutdown(application: TelegramApplication) -> None:  # type: ignore[type-arg]
+            if post_shutdown:
+                await post_shutdown(application)
+            await self.shutdown_components()
+
+        self.application.post_shutdown = shutdown
+
+        if self.arguments.workers.enabled:
+            await self.initialize_workers()
+        else:
+            await self.initialize_components()
+
+    async def initialize_workers(self) -> None:
+        """Start the worker processes, `hndl_search` only queues the searches for them."""
+        self.sender = SendScheduler(self.arguments.sender)
+        self.downloads = DownloadStore(
+            self.arguments.downloads, self.arguments.downloads_store.model_copy(update={"shared": True})
+        )
+        await self.downloads.load()
+        self.file_server = FileServer(self.downloads, self.arguments.file_server)
+        await self.file_server.start()
+        self.workers = WorkerPool(self.arguments, self.application.bot)
+        self.workers.start()
+        atexit.register(self.workers.stop)
+
+        workers = self.workers
+        REGISTRY.register(
+            Callback(
+                "ris_worker_jobs_waiting",
+                "Searches queued for each worker process",
+                lambda: {str(index): waiting for index, waiting in enumerate(workers.waiting)},
+                labelname="worker",
+            )
+        )
+        self.metrics = MetricsServer(REGISTRY, self.arguments.metrics)
+        await self.metrics.start()
+
+    async def cmd_start(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        if not update.message:
+            return
+
+        await update.message.reply_text("Hello")
@@ -0,0 +1,378 @@
+import logging
+import pickle
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass
+from heapq import heappop, heappush
+from io import BytesIO
+from pathlib import Path
+from time import time
+from typing import Any, Callable
+
+from pydantic import BaseModel
+
+CacheKey = frozenset[tuple[str, Any]]
+
+MISSING: Any = object()
+"""Sentinel returned by `ResultCache.get` for missing or expired entries (cached values may be `None`)."""
+
+UNSIZED_ENTRY = 4096
+"""Estimated size in bytes of entries that cannot be serialised and therefore only live in memory."""
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_key(key: CacheKey) -> str:
+    """
+    Create a stable string representation of a cache key.
+
+    Args:
+        key (CacheKey): The query key as used by the search engines.
+
+    Returns:
+        str: The string representation, identical for equal keys across restarts.
+    """
+    return repr(sorted(key))
+
+
+class _Pickler(pickle.Pickler):
+    """Pickler that stores registered live objects (engines, API clients) by name instead of by value."""
+
+    def __init__(self, file: BytesIO, live_objects: dict[str, object]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._names = {id(obj): name for name, obj in live_objects.items()}
+
+    def persistent_id(self, obj: object) -> str | None:
+        return self._names.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickler resolving the names written by `_Pickler` back to the registered live objects."""
+
+    def __init__(self, file: BytesIO, resolve: Callable[[str], object]):
+        super().__init__(file)
+        self._resolve = resolve
+
+    def persistent_load(self, pid: str) -> object:
+        try:
+            return self._resolve(pid)
+        except KeyError:
+            raise pickle.UnpicklingError(f"Unknown live object {pid!r}") from None
+
+
+@dataclass(slots=True)
+class _Entry:
+    value: Any
+    expires: float
+    size: int
+
+
+class ResultCache:
+    """
+    Two-tier cache for search results.
+
+    The first tier is an in-memory LRU bounded by a byte budget, expired entries are evicted before any live
+    ones. The second tier is an SQLite database which survives restarts, entries read from it are promoted back
+    into memory.
+
+    Values are pickled for the disk tier. Objects which must not (or cannot) be pickled, like the search engines
+    or API clients a result references, can be registered with `register` or `register_lazy` and are stored by name
+    instead.
+
+    Attributes:
+        config (ResultCache.Config): The cache configuration.
+        memory_bytes (int): The current estimated size of the in-memory tier in bytes.
+        hits (int): Number of lookups answered from memory.
+        disk_hits (int): Number of lookups answered from disk.
+        misses (int): Number of lookups that found nothing.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the ResultCache.
+
+        Attributes:
+            path (Path | None): Location of the SQLite database, None keeps the cache in memory only.
+            memory_bytes (int): Byte budget of the in-memory tier (defaults to 32 MiB).
+            purge_interval (int): Remove expired entries from disk every n writes (defaults to 500).
+        """
+
+        path: Path | None = Path("cache.sqlite3")
+        memory_bytes: int = 32 * 1024 * 1024
+        purge_interval: int = 500
+
+    def __init__(self, config: "ResultCache.Config | None" = None):
+        """
+        Initialise the ResultCache and open the disk tier if configured.
+
+        Args:
+            config (ResultCache.Config, optional): The cache configuration (defaults to a memory only cache).
+        """
+        self.config = config or ResultCache.Config(path=None)
+        self.memory_bytes = 0
+        self.hits = self.disk_hits = self.misses = 0
+
+        self._memory: OrderedDict[str, _Entry] = OrderedDict()
+        self._expiry: list[tuple[float, str]] = []
+        self._live_objects: dict[str, object] = {}
+        self._lazy_objects: dict[str, Callable[[], dict[str, object]]] = {}
+        self._writes = 0
+
+        self._db: sqlite3.Connection | None = None
+        if self.config.path:
+            self._db = self._open(self.config.path)
+            self.purge()
+
+    @staticmethod
+    def _open(path: Path) -> sqlite3.Connection:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires REAL NOT NULL, value BLOB)")
+        db.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires)")
+        return db
+
+    def register(self, name: str, obj: object) -> None:
+        """
+        Register a live object which is referenced by name when a value is persisted.
+
+        Args:
+            name (str): A name that is stable across restarts, e.g. "engine.SauceNAO".
+            obj (object): The object to reference.
+        """
+        self._live_objects[name] = obj
+
+    def register_lazy(self, prefix: str, load: Callable[[], dict[str, object]]) -> None:
+        """
+        Register live objects which are only created when they are first needed, e.g. those of a data provider.
+
+        Args:
+            prefix (str): The part of the names before the first dot, e.g. "pixiv" for "pixiv.provider".
+            load (Callable[[], dict[str, object]]): Creates the objects, called at most once.
+        """
+        self._lazy_objects[prefix] = load
+
+    def _resolve(self, name: str) -> object:
+        if name not in self._live_objects and (load := self._lazy_objects.pop(name.split(".", 1)[0], None)):
+            self._live_objects.update(load())
+        return self._live_objects[name]
+
+    def _dumps(self, value: Any) -> bytes | None:
+        buffer = BytesIO()
+        try:
+            _Pickler(buffer, self._live_objects).dump(value)
+        except (pickle.PicklingError, TypeError, AttributeError) as error:
+            logger.debug("Cannot persist cache value %r: %s", value, error)
+            return None
+        return buffer.getvalue()
+
+    def _loads(self, data: bytes) -> Any:
+        try:
+            return _Unpickler(BytesIO(data), self._resolve).load()
+        except Exception as error:
+            logger.warning("Dropping unreadable cache entry: %s", error)
+            return MISSING
+
+    def get(self, key: CacheKey) -> Any:
+        """
+        Get the value for the given key.
+
+        Args:
+            key (CacheKey): The key to look up.
+
+        Returns:
+            Any: The cached value or `MISSING` if there is no unexpired entry.
+        """
+        skey = serialize_key(key)
+        now = time()
+
+        if entry := self._memory.get(skey):
+            if entry.expires > now:
+                self._memory.move_to_end(skey)
+                self.hits += 1
+                return entry.value
+            self._drop(skey)
+
+        if self._db:
+            row = self._db.execute("SELECT expires, value FROM results WHERE key = ?", (skey,)).fetchone()
+            if row and row[0] > now and (value := self._loads(row[1])) is not MISSING:
+                self._remember(skey, value, row[0], len(row[1]))
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: CacheKey, value: Any, ttl: float) -> None:
+        """
+        Store a value for the given key in both tiers.
+
+        Args:
+            key (CacheKey): The key to store the value under.
+            value (Any): The value, persisted to disk if it can be pickled.
+            ttl (float): Time to live in seconds.
+        """
+        skey = serialize_key(key)
+        expires = time() + ttl
+        data = self._dumps(value)
+
+        self._remember(skey, value, expires, len(data) if data is not None else UNSIZED_ENTRY)
+
+        if self._db and data is not None:
+            self._db.execute("REPLACE INTO results (key, expires, value) VALUES (?, ?, ?)", (skey, expires, data))
+            self._writes += 1
+            if self._writes % self.config.purge_interval == 0:
+                self.purge()
+
+    def _remember(self, skey: str, value: Any, expires: float, size: int) -> None:
+        self._drop(skey)
+        self._memory[skey] = _Entry(value, expires, size)
+        self.memory_bytes += size
+        heappush(self._expiry, (expires, skey))
+        self._evict()
+
+    def _drop(self, skey: str) -> None:
+        if entry := self._memory.pop(skey, None):
+            self.memory_bytes -= entry.size
+
+    def _evict(self) -> None:
+        """Evict expired entries first and the least recently used ones after until we are within budget."""
+        if self.memory_bytes <= self.config.memory_bytes:
+            return
+
+        now = time()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, skey = heappop(self._expiry)
+            if (entry := self._memory.get(skey)) and entry.expires == expires:
+                self._drop(skey)
+
+        while self.memory_bytes > self.config.memory_bytes and len(self._memory) > 1:
+            _, entry = self._memory.popitem(last=False)
+            self.memory_bytes -= entry.size
+
+        # Heap entries of evicted or overwritten keys are stale, rebuild once they dominate the heap
+        if len(self._expiry) > 2 * len(self._memory) + 64:
+            self._expiry = [(entry.expires, skey) for skey, entry in self._memory.items()]
+            self._expiry.sort()
+
+    def purge(self) -> int:
+        """
+        Remove all expired entries from the disk tier.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        if not self._db:
+            return 0
+        return self._db.execute("DELETE FROM results WHERE expires <= ?", (time(),)).rowcount
+
+    def close(self) -> None:
+        """Close the disk tier, the in-memory tier stays usable."""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+
+class FileIdCache:
+    """
+    Persistent map from provider media URLs to the Telegram `file_id` of the media once sent.
+
+    Media sent before can be sent again by its `file_id`, without downloading it from the provider or uploading it
+    to Telegram again. Entries are kept in an SQLite database, the most recently used ones in memory as well.
+
+    Attributes:
+        config (FileIdCache.Config): The cache configuration.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the FileIdCache.
+
+        Attributes:
+            path (Path | None): Location of the SQLite database, None keeps the cache in memory only.
+            memory_entries (int): Maximum number of entries kept in memory (defaults to 10000).
+        """
+
+        path: Path | None = Path("file_ids.sqlite3")
+        memory_entries: int = 10000
+
+    def __init__(self, config: "FileIdCache.Config | None" = None):
+        """
+        Initialise the FileIdCache and open the database if configured.
+
+        Args:
+            config (FileIdCache.Config, optional): The cache configuration (defaults to a memory only cache).
+        """
+        self.config = config or FileIdCache.Config(path=None)
+        self._memory: OrderedDict[str, tuple[str, str]] = OrderedDict()
+
+        self._db: sqlite3.Connection | None = None
+        if self.config.path:
+            self.config.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.config.path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids (url TEXT PRIMARY KEY, file_id TEXT NOT NULL, kind TEXT NOT NULL)"
+            )
+
+    def _remember(self, url: str, entry: tuple[str, str]) -> None:
+        self._memory[url] = entry
+        self._memory.move_to_end(url)
+        while len(self._memory) > self.config.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, url: str) -> tuple[str, str] | None:
+        """
+        Get the Telegram file for a media URL.
+
+        Args:
+            url (str): The URL of the media on the provider.
+
+        Returns:
+            tuple[str, str] | None: The `file_id` and the kind of media ("photo", "video", "animation" or
+                "document"), or None if the media was not sent before.
+        """
+        if entry := self._memory.get(url):
+            self._memory.move_to_end(url)
+            return entry
+        if self._db and (
+            row := self._db.execute("SELECT file_id, kind FROM file_ids WHERE url = ?", (url,)).fetchone()
+        ):
+            self._remember(url, (row[0], row[1]))
+            return row[0], row[1]
+        return None
+
+    def set(self, url: str, file_id: str, kind: str) -> None:
+        """
+        Store the Telegram file for a media URL.
+
+        Args:
+            url (str): The URL of the media on the provider.
+            file_id (str): The `file_id` Telegram returned for the sent media.
+            kind (str): The kind of media ("photo", "video", "animation" or "document").
+        """
+        if self._memory.get(url) == (file_id, kind):
+            return
+        self._remember(url, (file_id, kind))
+        if self._db:
+            self._db.execute("REPLACE INTO file_ids (url, file_id, kind) VALUES (?, ?, ?)", (url, file_id, kind))
+
+    def forget(self, url: str) -> None:
+        """
+        Remove the entry of a media URL, e.g. after Telegram rejected the `file_id`.
+
+        Args:
+            url (str): The URL of the media on the provider.
+        """
+        self._memory.pop(url, None)
+        if self._db:
+            self._db.execute("DELETE FROM file_ids WHERE url = ?", (url,))
+
+    def close(self) -> None:
+        """Close the database, the in-memory entries stay usable."""
+        if self._db:
+            self._db.close()
+            self._db = None
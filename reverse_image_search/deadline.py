@@ -0,0 +1,189 @@
+from asyncio import FIRST_COMPLETED, Task, Timeout, create_task, gather, timeout, wait
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
+from time import monotonic
+from typing import Awaitable, Callable, Iterator, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+_search_deadline: ContextVar[float | None] = ContextVar("search_deadline", default=None)
+"""Monotonic time the current search has to be done by, inherited by all tasks the search starts"""
+
+
+def until(deadline: float | None) -> Timeout:
+    """
+    Limit a block to end by the given time.
+
+    Args:
+        deadline (float | None): Monotonic time the block has to be done by, None for no limit.
+
+    Returns:
+        Timeout: The timeout context manager, raising `TimeoutError` once the deadline passed.
+    """
+    return timeout(None if deadline is None else max(0, deadline - monotonic()))
+
+
+def search_deadline() -> float | None:
+    """
+    Get the deadline of the search running in the current context.
+
+    Returns:
+        float | None: Monotonic time the search has to be done by, None outside of a search.
+    """
+    return _search_deadline.get()
+
+
+def shared_context() -> Context:
+    """
+    Copy the current context without the search deadline, for work shared by several searches.
+
+    Each search waiting for the shared work applies its own deadline, the work itself must not end with the
+    deadline of the search that happened to start it.
+
+    Returns:
+        Context: The context to run the shared work in.
+    """
+    context = copy_context()
+    context.run(_search_deadline.set, None)
+    return context
+
+
+async def hedged(factory: Callable[[], Awaitable[T]], delay: float | None, attempts: int = 2) -> T:
+    """
+    Run a request and send duplicates of it if it is slow.
+
+    If the request has not finished after `delay` seconds (or failed before that) another one is started, up to
+    `attempts` in total. The first successful one wins, all others are cancelled before returning.
+
+    Args:
+        factory (Callable[[], Awaitable[T]]): Creates a new request.
+        delay (float, optional): Time in seconds after which a duplicate is sent, None disables hedging.
+        attempts (int, optional): Maximum number of requests in total (defaults to 2).
+
+    Returns:
+        T: The result of the first successful request.
+
+    Raises:
+        Exception: The error of the last request if all of them failed.
+    """
+    if delay is None or attempts < 2:
+        return await factory()
+
+    pending: set[Task[T]] = {create_task(factory())}  # type: ignore[arg-type]
+    started = 1
+    error: BaseException | None = None
+    try:
+        while pending:
+            may_hedge = started < attempts
+            done, pending = await wait(pending, timeout=delay if may_hedge else None, return_when=FIRST_COMPLETED)
+            for task in done:
+                if (error := task.exception()) is None:
+                    return task.result()
+            if may_hedge and (not done or not pending):
+                pending.add(create_task(factory()))  # type: ignore[arg-type]
+                started += 1
+        raise error  # type: ignore[misc]
+    finally:
+        for task in pending:
+            task.cancel()
+        await gather(*pending, return_exceptions=True)
+
+
+class SearchBudget:
+    """
+    Time limits of a search.
+
+    Every search gets a deadline, each search engine request and provider fetch made for it additionally has its own
+    timeout, but never runs past the deadline of the search. The deadline is kept in a context variable, so it
+    reaches everything the search starts without passing it along.
+
+    Slow provider fetches can be hedged: if a fetch has not finished after a delay a duplicate is sent, the first
+    answer wins.
+
+    Attributes:
+        config (SearchBudget.Config): The budget configuration.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the SearchBudget.
+
+        Attributes:
+            deadline (float): Time in seconds a search may take to find results (defaults to 60).
+            engine_timeout (float): Timeout of a search engine request in seconds (defaults to 30).
+            engine_timeouts (dict[str, float]): Timeouts per search engine name, e.g. {"SauceNAO": 20}.
+            provider_timeout (float): Timeout of a provider fetch in seconds (defaults to 20).
+            provider_timeouts (dict[str, float]): Timeouts per provider, e.g. {"pixiv": 30}.
+            hedge_after (dict[str, float]): Per provider, the time in seconds after which a duplicate fetch is sent.
+                Providers not listed are not hedged (defaults to none).
+            hedge_attempts (int): Maximum number of fetches per hedged request (defaults to 2).
+        """
+
+        deadline: float = 60
+        engine_timeout: float = 30
+        engine_timeouts: dict[str, float] = {}
+        provider_timeout: float = 20
+        provider_timeouts: dict[str, float] = {}
+        hedge_after: dict[str, float] = {}
+        hedge_attempts: int = 2
+
+    def __init__(self, config: "SearchBudget.Config | None" = None):
+        """
+        Initialise the SearchBudget.
+
+        Args:
+            config (SearchBudget.Config, optional): The budget configuration (defaults to the default config).
+        """
+        self.config = config or SearchBudget.Config()
+
+    @contextmanager
+    def search(self) -> Iterator[float]:
+        """
+        Start the deadline of a search, for the current context and all tasks started in it.
+
+        Yields:
+            float: Monotonic time the search has to be done by.
+        """
+        deadline = monotonic() + self.config.deadline
+        token = _search_deadline.set(deadline)
+        try:
+            yield deadline
+        finally:
+            _search_deadline.reset(token)
+
+    def _deadline(self, seconds: float) -> float:
+        deadline = monotonic() + seconds
+        if (search_deadline := _search_deadline.get()) is not None:
+            return min(deadline, search_deadline)
+        return deadline
+
+    def engine_deadline(self, name: str) -> float:
+        """
+        Get the time a search engine request has to be done by.
+
+        Args:
+            name (str): The name of the search engine.
+
+        Returns:
+            float: Monotonic time of the engine timeout or the deadline of the search, whichever comes first.
+        """
+        return self._deadline(self.config.engine_timeouts.get(name, self.config.engine_timeout))
+
+    async def provide(self, name: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run a provider fetch within its timeout, hedged if configured.
+
+        Args:
+            name (str): The name of the provider as used by the search engines, e.g. "booru".
+            factory (Callable[[], Awaitable[T]]): Creates the fetch, called again for every hedged duplicate.
+
+        Returns:
+            T: The result of the fetch.
+
+        Raises:
+            TimeoutError: If the fetch did not finish in time.
+        """
+        deadline = self._deadline(self.config.provider_timeouts.get(name, self.config.provider_timeout))
+        async with until(deadline):
+            return await hedged(factory, self.config.hedge_after.get(name), self.config.hedge_attempts)
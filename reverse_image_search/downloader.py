@@ -0,0 +1,166 @@
+from asyncio import Semaphore, to_thread
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import IO
+
+from aiohttp import ClientSession
+from pydantic import BaseModel
+from yarl import URL
+
+from reverse_image_search.store import DownloadStore
+
+
+@dataclass(slots=True)
+class SpooledDownload:
+    """
+    A downloaded file, kept in memory if it is small and in a temporary file otherwise.
+
+    Attributes:
+        data (bytes | None): The content of a file kept in memory.
+        path (Path | None): The temporary file of a large file.
+        size (int): The file size in bytes.
+    """
+
+    data: bytes | None
+    path: Path | None
+    size: int
+
+    @property
+    def content(self) -> bytes | Path:
+        """The content in memory or the path of the temporary file, both can be passed to worker processes"""
+        return self.data if self.data is not None else self.path  # type: ignore[return-value]
+
+    def close(self) -> None:
+        """Delete the temporary file, if there is one."""
+        if self.path:
+            self.path.unlink(missing_ok=True)
+            self.path = None
+
+
+class Downloader:
+    """
+    Download scheduler for provider media.
+
+    Downloads run with a limited number of concurrent downloads per host, so a post with many pages does not pull
+    all of them into memory at the same time. Files are streamed in chunks, anything larger than the spool size is
+    written to a temporary file instead of being held in memory. Files downloaded with `save` end up in the
+    download store, a large file is streamed to a temporary file in the store directory and moved in place.
+
+    Attributes:
+        session (ClientSession): The session to download with.
+        store (DownloadStore): The store files downloaded with `save` are kept in.
+        config (Downloader.Config): The downloader configuration.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the Downloader.
+
+        Attributes:
+            per_host (int): Maximum number of concurrent downloads from the same host (defaults to 3).
+            spool_bytes (int): Files larger than this are written to a temporary file (defaults to 2 MiB).
+            chunk_size (int): Size of the chunks read from the network (defaults to 64 KiB).
+        """
+
+        per_host: int = 3
+        spool_bytes: int = 2 * 1024**2
+        chunk_size: int = 64 * 1024
+
+    def __init__(self, session: ClientSession, store: DownloadStore, config: "Downloader.Config | None" = None):
+        """
+        Initialise the Downloader.
+
+        Args:
+            session (ClientSession): The session to download with.
+            store (DownloadStore): The store files downloaded with `save` are kept in.
+            config (Downloader.Config, optional): The downloader configuration (defaults to the default config).
+        """
+        self.session = session
+        self.store = store
+        self.config = config or Downloader.Config()
+        self._slots: dict[str, Semaphore] = {}
+        self._headers: dict[str, dict[str, str]] = {}
+
+    def set_headers(self, host: str, headers: dict[str, str]) -> None:
+        """
+        Send additional headers with every download from a host, e.g. a referer.
+
+        Args:
+            host (str): The host name.
+            headers (dict[str, str]): The headers.
+        """
+        self._headers[host] = headers
+
+    def _slot(self, host: str) -> Semaphore:
+        if host not in self._slots:
+            self._slots[host] = Semaphore(self.config.per_host)
+        return self._slots[host]
+
+    async def fetch(self, url: str, directory: Path | None = None) -> SpooledDownload:
+        """
+        Download a file, call `close` on the result once it is no longer needed.
+
+        Args:
+            url (str): The URL of the file.
+            directory (Path, optional): Where to create the temporary file of a large file, its name starts with a
+                dot (defaults to the system's temporary directory).
+
+        Returns:
+            SpooledDownload: The downloaded file.
+
+        Raises:
+            aiohttp.ClientError: If the download failed.
+        """
+        host = URL(url).host or ""
+        buffer = BytesIO()
+        file: IO[bytes] | None = None
+        size = 0
+
+        async with self._slot(host), self.session.get(url, headers=self._headers.get(host)) as response:
+            response.raise_for_status()
+            try:
+                async for chunk in response.content.iter_chunked(self.config.chunk_size):
+                    size += len(chunk)
+                    if file is None and size > self.config.spool_bytes:
+                        file = await to_thread(
+                            NamedTemporaryFile, prefix=".ris-" if directory else "ris-", dir=directory, delete=False
+                        )
+                        await to_thread(file.write, buffer.getvalue())
+                        buffer = BytesIO()
+                    if file is not None:
+                        await to_thread(file.write, chunk)
+                    else:
+                        buffer.write(chunk)
+            except BaseException:
+                if file is not None:
+                    file.close()
+                    Path(file.name).unlink(missing_ok=True)
+                raise
+
+        if file is None:
+            return SpooledDownload(buffer.getvalue(), None, size)
+        await to_thread(file.close)
+        return SpooledDownload(None, Path(file.name), size)
+
+    async def save(self, url: str) -> Path:
+        """
+        Download a file into the download store, unless it has been downloaded before.
+
+        Args:
+            url (str): The URL of the file.
+
+        Returns:
+            Path: The stored file.
+        """
+        key = f"download:{url}"
+        if (path := await self.store.get(key)) is not None:
+            return path
+        suffix = Path(URL(url).path).suffix
+        download = await self.fetch(url, self.store.root)
+        try:
+            if download.data is not None:
+                return await self.store.put(download.data, suffix, key=key)
+            return await self.store.put_file(download.path, suffix, key)  # type: ignore[arg-type]
+        finally:
+            await to_thread(download.close)
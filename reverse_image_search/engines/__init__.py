@@ -1,38 +1,41 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Mapping
 
 from aiohttp import ClientSession
 
+from reverse_image_search.cache import ResultCache
+from reverse_image_search.deadline import SearchBudget
 from reverse_image_search.providers.base import Provider
+from reverse_image_search.registry import Registry
 
-from .ascii2d import Ascii2dSearchEngine
 from .base import SearchEngine
-from .bing import BingSearchEngine
-from .google import GoogleSearchEngine
-from .iqdb import Iqdb3DSearchEngine, IqdbSearchEngine
-from .saucenao import SauceNaoSearchEngine
-from .sogou import SogouSearchEngine
-from .tineye import TineyeSearchEngine
-from .tracer import TraceSearchEngine
-from .yandex import YandexSearchEngine
 
 if TYPE_CHECKING:
-    from reverse_image_search.app import ReverseImageSearch
+    from reverse_image_search.app import SearchPipeline
 
+ENGINES: Registry[SearchEngine] = Registry(
+    "engine",
+    {
+        "saucenao": "reverse_image_search.engines.saucenao:SauceNaoSearchEngine",
+        "google": "reverse_image_search.engines.google:GoogleSearchEngine",
+        "iqdb": "reverse_image_search.engines.iqdb:IqdbSearchEngine",
+        "iqdb3d": "reverse_image_search.engines.iqdb:Iqdb3DSearchEngine",
+        "trace": "reverse_image_search.engines.tracer:TraceSearchEngine",
+        "yandex": "reverse_image_search.engines.yandex:YandexSearchEngine",
+        "bing": "reverse_image_search.engines.bing:BingSearchEngine",
+        "tineye": "reverse_image_search.engines.tineye:TineyeSearchEngine",
+        "ascii2d": "reverse_image_search.engines.ascii2d:Ascii2dSearchEngine",
+        "sogou": "reverse_image_search.engines.sogou:SogouSearchEngine",
+    },
+    "reverse_image_search.engines",
+)
 
-async def initiate_engines(
+
+def initiate_engines(
     session: ClientSession,
-    config: "ReverseImageSearch.Arguments",
-    providers: dict[str, Provider],
+    config: "SearchPipeline.Arguments",
+    providers: Mapping[str, Provider],
+    cache: ResultCache,
+    budget: SearchBudget,
 ) -> list[SearchEngine]:
-    return [
-        SauceNaoSearchEngine(config.saucenao.api_key, session, providers),
-        GoogleSearchEngine(),
-        IqdbSearchEngine(),
-        Iqdb3DSearchEngine(),
-        TraceSearchEngine(),
-        YandexSearchEngine(),
-        BingSearchEngine(),
-        TineyeSearchEngine(),
-        Ascii2dSearchEngine(),
-        SogouSearchEngine(),
-    ]
+    engines = (ENGINES.create(name, session, config, providers, cache, budget) for name in config.engines)
+    return [engine for engine in engines if engine is not None]
@@ -12,6 +12,7 @@ class Ascii2dSearchEngine(SearchEngine):
     cons = ["Limited to anime"]
     credit_url = "https://ascii2d.net/"
     query_url_template = "https://ascii2d.net/search/url/{file_url}"
+    file_max_edge = 1024
 
     def __init__(self):
         super().__init__()
@@ -1,25 +1,22 @@
+import logging
 from abc import ABCMeta, abstractmethod
-from asyncio import Lock
-from time import time
-from typing import Any, AsyncGenerator, TypedDict
-
+from asyncio import Task, create_task, shield
+from collections import Counter
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncGenerator, Mapping
+
+from reverse_image_search.cache import MISSING, CacheKey, ResultCache
+from reverse_image_search.deadline import SearchBudget, search_deadline, shared_context, until
+from reverse_image_search.metrics import PROVIDE
 from reverse_image_search.providers.base import Provider, QueryData, SearchResult
 
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
 
-class CachedSearchResult(TypedDict):
-    """
-    CachedSearchResult represents a search result that has been cached.
-
-    Attributes:
-        found (int): The timestamp when the result was found.
-        message (MessageConstruct | None): The message construct of the result, or None if not available.
-    """
-
-    found: int
-    result: SearchResult | None
-
+    from reverse_image_search.app import SearchPipeline
 
-runtime_cache: dict[frozenset[tuple[str, Any]], CachedSearchResult] = {}
+logger = logging.getLogger(__name__)
 
 
 class SearchEngine(metaclass=ABCMeta):
@@ -33,9 +30,16 @@ class SearchEngine(metaclass=ABCMeta):
         cons (list[str]): A list of the search engine's disadvantages.
         credit_url (str): The URL to the search engine's website.
         query_url_template (str): The template for generating search URLs.
+        inline_results (bool): Whether `search` yields results, engines without are link only and just get a button
+            (default False, True for engines overriding `search`).
+        supports_upload (bool): Whether `search` makes use of the local copy of the image (default False).
+        file_max_edge (int | None): The image size the engine works with, it is given a downscaled variant of the
+            searched image if the file server offers one (default None for the original).
         cache_time (int): Time to cache a search result in seconds (default 2 days).
-        providers (dict[str, Provider], optional): A dict of data available providers (default empty dict)
-        provider_lock (Lock): A threading lock used to prevent double search results.
+        providers (Mapping[str, Provider], optional): The available data providers (default none)
+        cache (ResultCache): The cache search results are stored in (default a memory only cache).
+        budget (SearchBudget): The time limits of requests made for a search (default the default limits).
+        _in_flight (dict[CacheKey, Task]): Provider requests currently running, shared by all callers of a query.
     """
 
     name: str
@@ -45,19 +49,60 @@ class SearchEngine(metaclass=ABCMeta):
     credit_url: str
     query_url_template: str
 
+    inline_results: bool = False
+    supports_upload: bool = False
+    file_max_edge: int | None = None
     cache_time: int = 172800
 
+    def __init_subclass__(cls, **kwargs: object) -> None:
+        super().__init_subclass__(**kwargs)
+        # Results of engines which do not declare the flag must not get lost
+        if "inline_results" not in cls.__dict__ and cls.search is not SearchEngine.search:
+            cls.inline_results = True
+
     @abstractmethod
-    def __init__(self, providers: dict[str, Provider] = {}):
+    def __init__(
+        self,
+        providers: Mapping[str, Provider] = {},
+        cache: ResultCache | None = None,
+        budget: SearchBudget | None = None,
+    ):
         if not all(
             hasattr(self, attr) for attr in ("name", "description", "pros", "cons", "credit_url", "query_url_template")
         ):
             raise NotImplementedError("All required attributes must be provided by the subclass.")
 
         self.providers = providers
-        self.provider_lock = Lock()
+        self.cache = cache if cache is not None else ResultCache()
+        self.budget = budget if budget is not None else SearchBudget()
+        self._in_flight: dict[CacheKey, Task[SearchResult | None]] = {}
+        self._waiting: Counter[CacheKey] = Counter()
+
+    @classmethod
+    def from_arguments(
+        cls,
+        session: "ClientSession",
+        config: "SearchPipeline.Arguments",
+        providers: Mapping[str, Provider],
+        cache: ResultCache,
+        budget: SearchBudget,
+    ) -> "SearchEngine | None":
+        """
+        Create the search engine from the arguments of the bot, link only engines need none of them.
+
+        Args:
+            session (ClientSession): The shared aiohttp session.
+            config (SearchPipeline.Arguments): The arguments of the bot.
+            providers (Mapping[str, Provider]): The data providers, created on first use.
+            cache (ResultCache): The cache search results are stored in.
+            budget (SearchBudget): The time limits of requests made for a search.
 
-    def _get_cached(self, query: frozenset[tuple[str, Any]]) -> SearchResult | None | bool:
+        Returns:
+            SearchEngine | None: The search engine or None if it is not configured.
+        """
+        return cls()  # type: ignore[call-arg]
+
+    def _get_cached(self, query: CacheKey) -> SearchResult | None | bool:
         """Get cached result for a given query.
 
         Fetches the cached result for a given query if it exists and is not expired.
@@ -68,11 +113,11 @@ class SearchEngine(metaclass=ABCMeta):
         Returns:
             SearchResult | None | bool: The cached result if it exists and is not expired, otherwise False.
         """
-        if (result := runtime_cache.get(query)) and time() - result["found"] < self.cache_time:
-            return result["result"]
-        return False
+        if (result := self.cache.get(query)) is MISSING:
+            return False
+        return result  # type: ignore[no-any-return]
 
-    def _add_cached(self, query: frozenset[tuple[str, Any]], result: SearchResult | None = None) -> SearchResult | None:
+    def _add_cached(self, query: CacheKey, result: SearchResult | None = None) -> SearchResult | None:
         """Add a cached result for a given query.
 
         Stores the given message as the cached result for the specified query.
@@ -84,7 +129,7 @@ class SearchEngine(metaclass=ABCMeta):
         Returns:
             SearchResult | None: Returns the given message back
         """
-        runtime_cache[query] = CachedSearchResult(found=int(time()), result=result)
+        self.cache.set(query, result, self.cache_time)
         return result
 
     def generate_search_url(self, file_url: str) -> str:
@@ -101,28 +146,70 @@ class SearchEngine(metaclass=ABCMeta):
 
     async def _safe_search(self, query: QueryData, provider_name: str) -> SearchResult | None:
         """
-        Perform a safe search by querying the provider in a locked context.
+        Perform a safe search by querying the provider at most once per query at a time.
 
-        Executes the search by querying the specified provider and stores the result in a cache
-        while ensuring thread safety using a provider lock.
+        Returns the cached result if there is one. Otherwise concurrent callers for the same query share a single
+        in-flight provider request, while callers for different queries never wait on each other. Each caller waits
+        until the deadline of its own search, the request is cancelled once no caller waits for it anymore, e.g.
+        because all their searches ran out of time.
 
         Args:
             query (dict[str, Any]): The query to search for.
             provider_name (str): The name of the provider to use for the search.
 
         Returns:
-            SearchResult | None: The search result if successful, otherwise None.
+            SearchResult | None: The search result if successful, otherwise None (also if the provider timed out).
         """
-        async with self.provider_lock:
-            search_query = frozenset(query.items())
-            if not isinstance((result := self._get_cached(search_query)), bool):
-                return result
-            self._add_cached(search_query)  # Reserve spot until provider is finished
-
-        message = await self.providers[provider_name].provide(query)
+        search_query = frozenset(query.items())
+        if not isinstance((result := self._get_cached(search_query)), bool):
+            return result
+
+        if not (task := self._in_flight.get(search_query)):
+            # Detached from the deadline of this search, searches joining later may have more time left
+            task = create_task(self._provide(search_query, query, provider_name), context=shared_context())
+            self._in_flight[search_query] = task
+            task.add_done_callback(partial(self._finish_flight, search_query))
+
+        self._waiting[search_query] += 1
+        try:
+            # Shielded so one cancelled caller does not cancel the request for everyone else waiting on it
+            async with until(search_deadline()):
+                return await shield(task)
+        except TimeoutError:
+            logger.info("%s timed out for %s", provider_name, dict(query))
+            return None
+        finally:
+            self._waiting[search_query] -= 1
+            if not self._waiting[search_query]:
+                del self._waiting[search_query]
+                if not task.done():
+                    task.cancel()
+
+    def _finish_flight(self, search_query: CacheKey, task: "Task[SearchResult | None]") -> None:
+        if self._in_flight.get(search_query) is task:
+            del self._in_flight[search_query]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved, the waiting callers handle it
+
+    async def _provide(self, search_query: CacheKey, query: QueryData, provider_name: str) -> SearchResult | None:
+        provider = self.providers[provider_name]
+        with PROVIDE.time(provider=provider_name):
+            message = await self.budget.provide(provider_name, partial(provider.provide, query))
         provider_info = self.providers[provider_name].provider_info(query)
 
-        return self._add_cached(search_query, SearchResult(self, provider_info, message) if message else None)
+        return self._add_cached(
+            search_query, SearchResult(self, provider_info, message, search_query) if message else None
+        )
 
-    async def search(self, file_url: str) -> AsyncGenerator[SearchResult | None, None]:
+    async def search(self, file_url: str, file: Path | None = None) -> AsyncGenerator[SearchResult | None, None]:
+        """
+        Search for inline results.
+
+        Args:
+            file_url (str): The public URL of the image.
+            file (Path, optional): The local copy of the image, for engines that upload it (defaults to None).
+
+        Yields:
+            SearchResult | None: The results found, link only engines yield nothing.
+        """
         yield  # type: ignore
@@ -0,0 +1,36 @@
+"""
+Configuration of the search engines, kept apart so the arguments of the bot can be validated without importing them.
+"""
+
+from pydantic import BaseModel, model_validator
+
+from reverse_image_search.quota import SauceNaoScheduler
+
+
+class SauceNaoConfig(BaseModel):
+    """Configuration for the SauceNaoSearchEngine.
+
+    Attributes:
+        api_key (str, optional): A single API key.
+        api_keys (list[str]): Multiple API keys, requests are balanced over all of them.
+        scheduler (SauceNaoScheduler.Config): Quota and queue settings.
+        upload (bool): Upload the image instead of letting SauceNAO fetch it from the file URL (defaults to False).
+        upload_max_edge (int, optional): Downscale uploads to this width and height, trades CPU time for upload
+            bandwidth (defaults to None, upload the original).
+    """
+
+    api_key: str | None = None
+    api_keys: list[str] = []
+    scheduler: SauceNaoScheduler.Config = SauceNaoScheduler.Config()
+    upload: bool = False
+    upload_max_edge: int | None = None
+
+    @property
+    def keys(self) -> list[str]:
+        return ([self.api_key] if self.api_key else []) + self.api_keys
+
+    @model_validator(mode="after")
+    def _require_key(self) -> "SauceNaoConfig":
+        if not self.keys:
+            raise ValueError("Either api_key or api_keys must be set")
+        return self
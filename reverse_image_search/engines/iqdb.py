@@ -12,6 +12,7 @@ class IqdbSearchEngine(SearchEngine):
     cons = ["Limited to anime"]
     credit_url = "https://iqdb.org/"
     query_url_template = "https://iqdb.org/?url={file_url}"
+    file_max_edge = 1024
 
     def __init__(self):
         super().__init__()
@@ -27,6 +28,7 @@ class Iqdb3DSearchEngine(SearchEngine):
     cons = ["Limited to cosplay images"]
     credit_url = "https://3d.iqdb.org/"
     query_url_template = "https://3d.iqdb.org/?url={file_url}"
+    file_max_edge = 1024
 
     def __init__(self):
         super().__init__()
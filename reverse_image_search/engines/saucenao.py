@@ -1,15 +1,28 @@
+import logging
 import re
-from asyncio import as_completed
-from typing import AsyncGenerator, Coroutine
-
-from aiohttp import ClientSession
-from pydantic import BaseModel
-
+from asyncio import as_completed, to_thread
+from contextlib import suppress
+from pathlib import Path
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING, AsyncGenerator, Coroutine, Mapping
+
+from aiohttp import ClientError, ClientSession, FormData
+
+from reverse_image_search.cache import ResultCache
+from reverse_image_search.deadline import SearchBudget, until
+from reverse_image_search.media import read_image
+from reverse_image_search.metrics import SAUCENAO_REQUEST
 from reverse_image_search.providers.base import Provider, SearchResult
-from reverse_image_search.providers.booru import BooruQuery
-from reverse_image_search.providers.pixiv import PixivQuery
+from reverse_image_search.quota import QuotaExhausted, SauceNaoScheduler
 
 from .base import SearchEngine
+from .config import SauceNaoConfig
+
+if TYPE_CHECKING:
+    from reverse_image_search.app import SearchPipeline
+    from reverse_image_search.providers.pixiv import PixivQuery
+
+logger = logging.getLogger(__name__)
 
 
 class SauceNaoSearchEngine(SearchEngine):
@@ -19,8 +32,10 @@ class SauceNaoSearchEngine(SearchEngine):
     Inherits from SearchEngine.
 
     Attributes:
-        api_key (str): The API key for accessing the SauceNAO API.
+        scheduler (SauceNaoScheduler): Scheduler holding the API keys and keeping the requests within their quota.
         session (aiohttp.ClientSession): The aiohttp session for making requests.
+        upload (bool): Whether images are uploaded instead of sending their URL.
+        upload_max_edge (int | None): Uploads are downscaled to this width and height.
         min_similarity (int): The minimum similarity a picture needs to count as match
         provider_mapping (dict[int, str]): Mapping between DB IDs and their provider methods,
                                            ordered by priority.
@@ -37,6 +52,9 @@ class SauceNaoSearchEngine(SearchEngine):
     cons = ["Limited to specific sources"]
     credit_url = "https://saucenao.com"
     query_url_template = "https://saucenao.com/search.php?url={file_url}"
+    api_url = "https://saucenao.com/search.php"
+    inline_results = True
+    supports_upload = True
 
     min_similarity = 65
     provider_mapping = {
@@ -47,62 +65,136 @@ class SauceNaoSearchEngine(SearchEngine):
         26: "_booru",
     }
 
-    class Config(BaseModel):
-        api_key: str
-
-    def __init__(self, api_key: str, session: ClientSession, providers: dict[str, Provider]):
+    Config = SauceNaoConfig
+
+    def __init__(
+        self,
+        scheduler: SauceNaoScheduler,
+        session: ClientSession,
+        providers: Mapping[str, Provider],
+        cache: ResultCache,
+        budget: SearchBudget | None = None,
+        upload: bool = False,
+        upload_max_edge: int | None = None,
+    ):
         """
         Initialise the SauceNaoSearchEngine.
 
         Args:
-            api_key (str): The API key for accessing the SauceNAO API.
+            scheduler (SauceNaoScheduler): Scheduler holding the API keys and keeping the requests within their quota.
             session (aiohttp.ClientSession): The aiohttp session for making requests.
             providers (list[Formatter]): List of initialised data providers
+            cache (ResultCache): The cache to store provider results in
+            budget (SearchBudget, optional): The time limits of the requests (defaults to the default limits)
+            upload (bool, optional): Upload images instead of sending their URL (defaults to False)
+            upload_max_edge (int, optional): Downscale uploads to this width and height (defaults to None)
         """
-        super().__init__(providers)
-        self.api_key = api_key
+        super().__init__(providers, cache, budget)
+        self.scheduler = scheduler
         self.session = session
-
-    async def _api_search(self, file_url: str) -> dict:
+        self.upload = upload
+        self.upload_max_edge = upload_max_edge
+
+    @classmethod
+    def from_arguments(
+        cls,
+        session: ClientSession,
+        config: "SearchPipeline.Arguments",
+        providers: Mapping[str, Provider],
+        cache: ResultCache,
+        budget: SearchBudget,
+    ) -> "SauceNaoSearchEngine":
+        return cls(
+            SauceNaoScheduler(config.saucenao.keys, config.saucenao.scheduler),
+            session,
+            providers,
+            cache,
+            budget,
+            upload=config.saucenao.upload,
+            upload_max_edge=config.saucenao.upload_max_edge,
+        )
+
+    async def _api_search(self, file_url: str, file: Path | None = None) -> dict:
         """
-        Perform a search on the SauceNAO search engine using a file URL.
+        Perform a search on the SauceNAO search engine.
+
+        The image is uploaded directly if upload mode is enabled and a local file is given, otherwise SauceNAO
+        fetches it from the file URL.
 
         Args:
             file_url (str): The URL of the image to search for.
+            file (Path, optional): The local copy of the image (defaults to None).
 
         Returns:
             dict: A dictionary containing search results and related information.
 
         Raises:
             ValueError: If the file_url is not provided.
+            QuotaExhausted: If the API quota does not allow a request right now.
+            TimeoutError: If SauceNAO did not answer within the engine timeout or the deadline of the search.
 
         Example:
             >>> async with aiohttp.ClientSession() as session:
-                    sauce_nao = SauceNaoSearchEngine(api_key="your_api_key", session=session)
+                    sauce_nao = SauceNaoSearchEngine(SauceNaoScheduler(["your_api_key"]), session, {}, ResultCache())
                     result = await sauce_nao.search("https://example.com/image.png")
                     print(result)
         """
         if not file_url:
             raise ValueError("file_url must be provided")
 
-        query_url = self.query_url_template.format(file_url=file_url)
-        headers = {"User-Agent": "reverse_image_search_bot/2.0"}
+        upload: tuple[str, bytes, str] | None = None
+        if self.upload and file:
+            upload = (file.name, *await to_thread(read_image, file, self.upload_max_edge))
 
-        async with self.session.get(
-            query_url,
-            headers=headers,
-            params={"api_key": self.api_key, "output_type": 2},
-        ) as response:
-            return await response.json()
+        headers = {"User-Agent": "reverse_image_search_bot/2.0"}
 
-    async def search(self, file_url: str) -> AsyncGenerator[SearchResult, None]:
-        results = await self._api_search(file_url)
+        deadline = self.budget.engine_deadline(self.name)
+        quota = await self.scheduler.acquire(min(deadline, monotonic() + self.scheduler.config.max_wait))
+        header: dict | None = None
+        rate_limited = False
+        status = "error"
+        start = perf_counter()
+        try:
+            params = {"api_key": quota.key, "output_type": 2}
+            if upload:
+                form = FormData()
+                form.add_field("file", upload[1], filename=upload[0], content_type=upload[2])
+                request = self.session.post(self.api_url, headers=headers, params=params, data=form)
+            else:
+                request = self.session.get(self.api_url, headers=headers, params=params | {"url": file_url})
+
+            async with until(deadline), request as response:
+                status = str(response.status)
+                if response.status == 429:
+                    rate_limited = True
+                    with suppress(ValueError, ClientError):
+                        header = (await response.json(content_type=None)).get("header")
+                    raise QuotaExhausted("SauceNAO refused the request with 429 Too Many Requests")
+
+                data: dict = await response.json()
+                header = data.get("header")
+                return data
+        finally:
+            SAUCENAO_REQUEST.observe(perf_counter() - start, status=status)
+            quota.release(header, rate_limited)
+
+    async def search(self, file_url: str, file: Path | None = None) -> AsyncGenerator[SearchResult, None]:
+        try:
+            results = await self._api_search(file_url, file)
+        except QuotaExhausted as error:
+            # The link buttons are still there, we only skip the inline results
+            logger.info("Skipping SauceNAO inline results: %s", error)
+            return
+        except TimeoutError:
+            logger.info("Skipping SauceNAO inline results: SauceNAO did not answer in time")
+            return
 
         filtered_results = [
             result
             for result in results.get("results", [])
             if float(result["header"]["similarity"]) >= self.min_similarity
             and result["header"]["index_id"] in self.provider_mapping
+            and self.provider_mapping[result["header"]["index_id"]].removeprefix("_") in self.providers
         ]
 
         tasks: list[Coroutine[None, None, SearchResult | None]] = [
@@ -116,28 +208,28 @@ class SauceNaoSearchEngine(SearchEngine):
     async def _booru(self, data: dict[str, dict[str, str | int | list[str]]]) -> SearchResult | None:
         if post_id := data["data"].get("danbooru_id"):
             return await self._safe_search(
-                BooruQuery({"id": post_id, "provider": "danbooru"}),  # type: ignore[typeddict-item]
+                {"id": post_id, "provider": "danbooru"},  # type: ignore[typeddict-item]
                 "booru",
             )
         elif post_id := data["data"].get("yandere_id"):
             return await self._safe_search(
-                BooruQuery({"id": post_id, "provider": "yandere"}),  # type: ignore[typeddict-item]
+                {"id": post_id, "provider": "yandere"},  # type: ignore[typeddict-item]
                 "booru",
             )
         elif post_id := data["data"].get("gelbooru_id"):
             return await self._safe_search(
-                BooruQuery({"id": post_id, "provider": "gelbooru_id"}),  # type: ignore[typeddict-item]
+                {"id": post_id, "provider": "gelbooru_id"},  # type: ignore[typeddict-item]
                 "booru",
             )
         elif post_id := data["data"].get("konachan_id"):
             return await self._safe_search(
-                BooruQuery({"id": post_id, "provider": "konachan"}),  # type: ignore[typeddict-item]
+                {"id": post_id, "provider": "konachan"},  # type: ignore[typeddict-item]
                 "booru",
             )
         return None
 
     async def _pixiv(self, data: dict[str, dict[str, str | int | list[str]]]) -> SearchResult | None:
-        query_data: PixivQuery = {
+        query_data: "PixivQuery" = {
             "id": data["data"]["pixiv_id"],  # type: ignore[typeddict-item]
             "image_index": None,
         }
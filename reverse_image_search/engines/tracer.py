@@ -11,6 +11,7 @@ class TraceSearchEngine(SearchEngine):
     cons = ["Limited to anime"]
     credit_url = "https://trace.moe/"
     query_url_template = "https://trace.moe/?auto&url={file_url}"
+    file_max_edge = 1024
 
     def __init__(self):
         super().__init__()
@@ -0,0 +1,176 @@
+import mimetypes
+import re
+from asyncio import to_thread
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+from aiohttp import web
+from aiohttp.helpers import ETag
+from pydantic import BaseModel
+
+from reverse_image_search.media import read_image
+from reverse_image_search.metrics import FILE_SERVE
+from reverse_image_search.store import DownloadStore
+
+CONTENT_ADDRESSED = re.compile(r"[0-9a-f]{64}")
+
+
+class _TaggedFileResponse(web.FileResponse):
+    """A `FileResponse` sent with the given ETag, aiohttp would replace it by one of the modification time and size."""
+
+    def __init__(self, path: Path, etag: str, **kwargs: Any):
+        super().__init__(path, **kwargs)
+        self._content_etag = etag
+        self.etag = etag
+
+    @property  # type: ignore[override]
+    def etag(self) -> ETag | None:
+        return super().etag
+
+    @etag.setter
+    def etag(self, value: ETag | str | None) -> None:
+        web.FileResponse.etag.fset(self, self._content_etag)  # type: ignore[attr-defined]
+
+
+class FileServer:
+    """
+    HTTP server for the downloads, so search engines can fetch the searched images at `file_url`.
+
+    Files are sent with `sendfile` and support range requests. Stored files are named by their content hash and
+    never change, so clients may cache them for good and revalidate them by ETag. Downscaled variants are served
+    below `w<edge>/`, for search engines that do not need the original. They are created on the first request and
+    kept in the download store.
+
+    Attributes:
+        store (DownloadStore): The store the files are served from.
+        config (FileServer.Config): The server configuration.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the FileServer.
+
+        Attributes:
+            enabled (bool): Whether to serve the downloads, disable it if another web server does (defaults to
+                False).
+            host (str): The address to listen on (defaults to "127.0.0.1").
+            port (int): The port to listen on (defaults to 8080).
+            prefix (str): The path the files are served below, `file_url` has to point there (defaults to "/").
+            max_age (int): Time in seconds clients may cache files (defaults to one year).
+            variants (list[int]): Edge lengths of the downscaled variants that may be requested (defaults to 512,
+                1024 and 2048).
+            quality (int): JPEG quality of the downscaled variants (defaults to 85).
+        """
+
+        enabled: bool = False
+        host: str = "127.0.0.1"
+        port: int = 8080
+        prefix: str = "/"
+        max_age: int = 365 * 24 * 3600
+        variants: list[int] = [512, 1024, 2048]
+        quality: int = 85
+
+    def __init__(self, store: DownloadStore, config: "FileServer.Config | None" = None):
+        """
+        Initialise the FileServer.
+
+        Args:
+            store (DownloadStore): The store the files are served from.
+            config (FileServer.Config, optional): The server configuration (defaults to the default config).
+        """
+        self.store = store
+        self.config = config or FileServer.Config()
+        self._root = store.root.resolve()
+        self._runner: web.AppRunner | None = None
+
+    def url(self, file_url: str, path: Path, max_edge: int | None = None) -> str:
+        """
+        Get the public URL of a stored file.
+
+        Args:
+            file_url (str): The public URL of the store.
+            path (Path): The stored file.
+            max_edge (int, optional): The largest edge length the consumer needs, the smallest variant at least as
+                large is used (defaults to None for the original).
+
+        Returns:
+            str: The URL of the file or of its variant.
+        """
+        relative = self.store.relative(path)
+        if not self.config.enabled or max_edge is None:
+            return file_url + relative
+        if not (edges := [edge for edge in sorted(self.config.variants) if edge >= max_edge]):
+            return file_url + relative
+        return f"{file_url}w{edges[0]}/{relative}"
+
+    def _resolve(self, relative: str) -> Path:
+        path = (self._root / relative).resolve()
+        if not path.is_relative_to(self._root) or path.name.startswith(".") or not path.is_file():
+            raise web.HTTPNotFound()
+        return path
+
+    async def _variant(self, path: Path, edge: int) -> Path:
+        key = f"variant:{edge}:{path.relative_to(self._root).as_posix()}"
+        if (variant := await self.store.get(key)) is not None:
+            return variant
+        data, mime = await to_thread(read_image, path, edge, self.config.quality)
+        return await self.store.put(data, mimetypes.guess_extension(mime) or path.suffix, key=key)
+
+    @staticmethod
+    def _etag(path: Path) -> str:
+        if CONTENT_ADDRESSED.fullmatch(path.stem):
+            return path.stem
+        stat = path.stat()
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    async def _serve(self, request: web.Request) -> web.StreamResponse:
+        start = perf_counter()
+        edge = int(request.match_info.get("edge", 0))
+        variant = f"w{edge}" if edge in self.config.variants else "original"
+        try:
+            if edge and edge not in self.config.variants:
+                variant = "invalid"
+                raise web.HTTPNotFound()
+            path = self._resolve(request.match_info["path"])
+            if edge:
+                path = await self._variant(path, edge)
+
+            etag = self._etag(path)
+            headers = {"Cache-Control": f"public, max-age={self.config.max_age}, immutable"}
+            if_none_match = {
+                tag.strip().removeprefix("W/") for tag in request.headers.get("If-None-Match", "").split(",")
+            }
+            if f'"{etag}"' in if_none_match or "*" in if_none_match:
+                response = web.Response(status=304, headers=headers)
+                response.etag = etag
+                return response
+            return _TaggedFileResponse(path, etag, headers=headers)
+        finally:
+            FILE_SERVE.observe(perf_counter() - start, variant=variant)
+
+    def application(self) -> web.Application:
+        """
+        Create the web application serving the downloads below the configured prefix.
+
+        Returns:
+            web.Application: The application, `start` runs it on the configured address.
+        """
+        prefix = f"/{stripped}/" if (stripped := self.config.prefix.strip("/")) else "/"
+        app = web.Application()
+        app.router.add_get(prefix + r"w{edge:\d+}/{path:.+}", self._serve)
+        app.router.add_get(prefix + "{path:.+}", self._serve)
+        return app
+
+    async def start(self) -> None:
+        """Start serving the downloads, if enabled."""
+        if not self.config.enabled or self._runner:
+            return
+        self._runner = web.AppRunner(self.application(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.config.host, self.config.port).start()
+
+    async def stop(self) -> None:
+        """Stop serving the downloads."""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
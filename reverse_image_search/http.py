@@ -0,0 +1,138 @@
+from typing import Any
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from pydantic import BaseModel
+
+
+class HttpPool:
+    """
+    The shared HTTP connection pool of the bot.
+
+    Wraps one aiohttp session with per-host connection limits, keep-alive, a DNS cache and default timeouts, used by
+    the search engines, the booru APIs and the Pixiv downloads alike. Request tracing keeps count of how the pool is
+    used, so connection starvation shows up in `stats` as a growing number of queued requests.
+
+    Attributes:
+        config (HttpPool.Config): The pool configuration.
+        session (ClientSession): The session to make all requests with.
+        requests (int): Number of requests started.
+        errors (int): Number of requests failed with an exception.
+        queued (int): Number of requests currently waiting for a free connection.
+        queued_total (int): Number of requests that had to wait for a free connection.
+        created (int): Number of connections opened.
+        reused (int): Number of requests served by a kept-alive connection.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the HttpPool.
+
+        Attributes:
+            limit (int): Maximum number of open connections in total (defaults to 100).
+            limit_per_host (int): Maximum number of open connections to the same host (defaults to 10).
+            keepalive_timeout (float): Time in seconds idle connections are kept open (defaults to 30).
+            dns_cache_ttl (int): Time in seconds resolved host names are cached (defaults to 300).
+            connect_timeout (float): Time in seconds to get a connection, including waiting for a free one in the
+                pool (defaults to 10).
+            read_timeout (float): Time in seconds between two reads of a response (defaults to 30).
+        """
+
+        limit: int = 100
+        limit_per_host: int = 10
+        keepalive_timeout: float = 30
+        dns_cache_ttl: int = 300
+        connect_timeout: float = 10
+        read_timeout: float = 30
+
+    def __init__(self, config: "HttpPool.Config | None" = None):
+        """
+        Initialise the HttpPool, must be called with a running event loop.
+
+        Args:
+            config (HttpPool.Config, optional): The pool configuration (defaults to the default config).
+        """
+        self.config = config or HttpPool.Config()
+        self.requests = self.errors = 0
+        self.queued_total = 0
+        self.created = self.reused = 0
+        self._in_flight = 0
+
+        trace = TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_request_end.append(self._on_request_end)
+        trace.on_request_exception.append(self._on_request_exception)
+        trace.on_connection_queued_start.append(self._on_queued_start)
+        trace.on_connection_create_end.append(self._on_created)
+        trace.on_connection_reuseconn.append(self._on_reused)
+
+        self.connector = TCPConnector(
+            limit=self.config.limit,
+            limit_per_host=self.config.limit_per_host,
+            keepalive_timeout=self.config.keepalive_timeout,
+            ttl_dns_cache=self.config.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        self.session = ClientSession(
+            connector=self.connector,
+            timeout=ClientTimeout(
+                total=None,
+                connect=self.config.connect_timeout,
+                sock_read=self.config.read_timeout,
+            ),
+            trace_configs=[trace],
+        )
+
+    async def _on_request_start(self, *_: Any) -> None:
+        self.requests += 1
+        self._in_flight += 1
+
+    async def _on_request_end(self, *_: Any) -> None:
+        self._in_flight -= 1
+
+    async def _on_request_exception(self, *_: Any) -> None:
+        self._in_flight -= 1
+        self.errors += 1
+
+    async def _on_queued_start(self, *_: Any) -> None:
+        self.queued_total += 1
+
+    async def _on_created(self, *_: Any) -> None:
+        self.created += 1
+
+    async def _on_reused(self, *_: Any) -> None:
+        self.reused += 1
+
+    @property
+    def queued(self) -> int:
+        """Number of requests currently waiting for a free connection"""
+        # aiohttp only traces waits that end with a connection, cancelled and timed out ones would never be counted
+        # down, so count the waiters of the connector itself
+        return sum(len(waiters) for waiters in getattr(self.connector, "_waiters", {}).values())
+
+    @property
+    def in_use(self) -> int:
+        """Number of connections currently handed out to requests"""
+        # aiohttp does not trace connections being released, so ask the connector itself
+        return len(getattr(self.connector, "_acquired", ()))
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the usage statistics of the pool.
+
+        Returns:
+            dict[str, int]: Connections in use, requests in flight and queued, and the totals of requests, errors,
+                queued requests, created and reused connections.
+        """
+        return {
+            "in_use": self.in_use,
+            "in_flight": self._in_flight,
+            "queued": self.queued,
+            "requests": self.requests,
+            "errors": self.errors,
+            "queued_total": self.queued_total,
+            "created": self.created,
+            "reused": self.reused,
+        }
+
+    async def close(self) -> None:
+        """Close the session and all its connections."""
+        await self.session.close()
@@ -0,0 +1,261 @@
+import json
+import sqlite3
+from asyncio import sleep, to_thread
+from dataclasses import dataclass
+from pathlib import Path
+from secrets import token_hex
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Callable, Literal, Protocol, TypeVar
+
+Side = Literal["LEFT", "RIGHT"]
+T = TypeVar("T")
+
+
+class ListStore(Protocol):
+    """
+    The Redis list commands the job queue needs.
+
+    `redis.asyncio.Redis(decode_responses=True)` satisfies this protocol as well, so the queue can be moved to a
+    Redis server without changes.
+    """
+
+    async def rpush(self, name: str, *values: str) -> int:
+        ...
+
+    async def lmove(self, first_list: str, second_list: str, src: Side = "LEFT", dest: Side = "RIGHT") -> str | None:
+        ...
+
+    async def blmove(
+        self, first_list: str, second_list: str, timeout: float, src: Side = "LEFT", dest: Side = "RIGHT"
+    ) -> str | None:
+        ...
+
+    async def lrem(self, name: str, count: int, value: str) -> int:
+        ...
+
+    async def llen(self, name: str) -> int:
+        ...
+
+
+class SqliteListStore:
+    """
+    Durable lists with Redis semantics in a local SQLite database, safe to share between processes.
+
+    Every command runs in its own immediate transaction, so moving an item between lists is atomic across
+    processes. Commands run in a thread, waiting for the database lock of another process never blocks the event
+    loop. Moving from an empty list only reads, so idle consumers polling the queue do not take the write lock.
+    SQLite cannot notify waiting processes, blocking commands poll instead.
+
+    Attributes:
+        path (Path): The database file.
+        poll_interval (float): Time in seconds between two attempts of a blocking command.
+    """
+
+    def __init__(self, path: Path, poll_interval: float = 0.1, busy_timeout: float = 5):
+        """
+        Initialise the SqliteListStore, creating the database if necessary.
+
+        Args:
+            path (Path): The database file.
+            poll_interval (float, optional): Time in seconds between two attempts of a blocking command (defaults
+                to 0.1).
+            busy_timeout (float, optional): Time in seconds to wait for the lock of another process before a command
+                fails (defaults to 5).
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=busy_timeout, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items (name TEXT NOT NULL, position INTEGER NOT NULL, value TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_position ON items (name, position)")
+
+    async def _run(self, command: Callable[..., T], *args: Any) -> T:
+        def locked() -> T:
+            # The connection is shared by all threads of this process, one command at a time
+            with self._lock:
+                return command(*args)
+
+        return await to_thread(locked)
+
+    def _insert(self, name: str, value: str, side: Side) -> None:
+        if side == "LEFT":
+            position = "COALESCE(MIN(position), 0) - 1"
+        else:
+            position = "COALESCE(MAX(position), 0) + 1"
+        self._db.execute(f"INSERT INTO items SELECT ?, {position}, ? FROM items WHERE name = ?", (name, value, name))
+
+    def _pop(self, name: str, side: Side) -> str | None:
+        order = "ASC" if side == "LEFT" else "DESC"
+        row = self._db.execute(
+            f"SELECT rowid, value FROM items WHERE name = ? ORDER BY position {order} LIMIT 1", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._db.execute("DELETE FROM items WHERE rowid = ?", (row[0],))
+        return row[1]  # type: ignore[no-any-return]
+
+    def _rpush(self, name: str, values: tuple[str, ...]) -> int:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for value in values:
+                self._insert(name, value, "RIGHT")
+            length = self._db.execute("SELECT COUNT(*) FROM items WHERE name = ?", (name,)).fetchone()[0]
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return length  # type: ignore[no-any-return]
+
+    def _lmove(self, first_list: str, second_list: str, src: Side, dest: Side) -> str | None:
+        if self._db.execute("SELECT 1 FROM items WHERE name = ? LIMIT 1", (first_list,)).fetchone() is None:
+            return None
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if (value := self._pop(first_list, src)) is not None:
+                self._insert(second_list, value, dest)
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return value
+
+    def _lrem(self, name: str, count: int, value: str) -> int:
+        order = "DESC" if count < 0 else "ASC"
+        limit = abs(count) if count else -1
+        return self._db.execute(
+            "DELETE FROM items WHERE rowid IN (SELECT rowid FROM items WHERE name = ? AND value = ?"
+            f" ORDER BY position {order} LIMIT ?)",
+            (name, value, limit),
+        ).rowcount
+
+    def _llen(self, name: str) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM items WHERE name = ?", (name,)).fetchone()[0]  # type: ignore
+
+    async def rpush(self, name: str, *values: str) -> int:
+        return await self._run(self._rpush, name, values)
+
+    async def lmove(self, first_list: str, second_list: str, src: Side = "LEFT", dest: Side = "RIGHT") -> str | None:
+        return await self._run(self._lmove, first_list, second_list, src, dest)
+
+    async def blmove(
+        self, first_list: str, second_list: str, timeout: float, src: Side = "LEFT", dest: Side = "RIGHT"
+    ) -> str | None:
+        """Like `lmove`, but wait up to `timeout` seconds for an item, 0 waits forever."""
+        end = monotonic() + timeout if timeout else float("inf")
+        while (value := await self.lmove(first_list, second_list, src, dest)) is None:
+            if monotonic() >= end:
+                return None
+            await sleep(min(self.poll_interval, max(0, end - monotonic())))
+        return value
+
+    async def lrem(self, name: str, count: int, value: str) -> int:
+        return await self._run(self._lrem, name, count, value)
+
+    async def llen(self, name: str) -> int:
+        return await self._run(self._llen, name)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+@dataclass
+class Job:
+    """A job taken from a JobQueue.
+
+    Attributes:
+        raw (str): The job as stored in the queue, used to acknowledge it.
+        data (dict[str, Any]): The payload of the job.
+        queued (float | None): Unix time the job was put into the queue, None for jobs queued by older versions.
+    """
+
+    raw: str
+    data: dict[str, Any]
+    queued: float | None = None
+
+    @property
+    def age(self) -> float:
+        """Time in seconds since the job was queued, 0 if unknown"""
+        return time() - self.queued if self.queued is not None else 0
+
+
+class JobQueue:
+    """
+    A durable, crash safe job queue on top of Redis style lists.
+
+    Taking a job atomically moves it to a processing list, it is only removed from there once it is done. Jobs of a
+    crashed consumer are still in its processing list and are put back at the front of the queue by `recover`.
+
+    Attributes:
+        store (ListStore): The lists the jobs are kept in.
+        name (str): The name of the queue list.
+        processing (str): The name of the list of jobs taken but not done yet.
+    """
+
+    def __init__(self, store: ListStore, name: str):
+        """
+        Initialise the JobQueue.
+
+        Args:
+            store (ListStore): The lists the jobs are kept in.
+            name (str): The name of the queue, only one consumer may take jobs from it at a time.
+        """
+        self.store = store
+        self.name = name
+        self.processing = f"{name}:processing"
+
+    async def put(self, data: dict[str, Any]) -> None:
+        """
+        Add a job at the end of the queue.
+
+        Args:
+            data (dict[str, Any]): The JSON serialisable payload of the job.
+        """
+        # The ID keeps equal payloads apart, jobs are acknowledged by value
+        job = {"id": token_hex(8), "queued": time(), "data": data}
+        await self.store.rpush(self.name, json.dumps(job, separators=(",", ":")))
+
+    async def take(self, timeout: float = 0) -> Job | None:
+        """
+        Take the next job.
+
+        Args:
+            timeout (float, optional): Time in seconds to wait for a job, 0 waits forever (defaults to 0).
+
+        Returns:
+            Job | None: The job or None if there was none within the timeout.
+        """
+        if (raw := await self.store.blmove(self.name, self.processing, timeout)) is None:
+            return None
+        job = json.loads(raw)
+        return Job(raw, job["data"], job.get("queued"))
+
+    async def done(self, job: Job) -> None:
+        """
+        Acknowledge a job, it will not be recovered anymore.
+
+        Args:
+            job (Job): The job taken with `take`.
+        """
+        await self.store.lrem(self.processing, 1, job.raw)
+
+    async def recover(self) -> int:
+        """
+        Put the jobs taken but never acknowledged back at the front of the queue, in their original order.
+
+        Returns:
+            int: The number of recovered jobs.
+        """
+        recovered = 0
+        while await self.store.lmove(self.processing, self.name, "RIGHT", "LEFT") is not None:
+            recovered += 1
+        return recovered
+
+    async def size(self) -> int:
+        """Number of jobs waiting in the queue"""
+        return await self.store.llen(self.name)
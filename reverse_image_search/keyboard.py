@@ -0,0 +1,57 @@
+from typing import Callable, Mapping, Sequence
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from reverse_image_search.engines.base import SearchEngine
+from reverse_image_search.utils import chunks
+
+PLACEHOLDER = "{file_url}"
+
+
+def _compile(engine: SearchEngine) -> Callable[[str], str]:
+    template = engine.query_url_template
+    if type(engine).generate_search_url is not SearchEngine.generate_search_url or template.count("{") != 1:
+        return engine.generate_search_url
+    prefix, _, suffix = template.partition(PLACEHOLDER)
+    return lambda file_url: f"{prefix}{file_url}{suffix}"
+
+
+class SearchKeyboard:
+    """
+    The keyboard with a button per search engine, laid out once for the configured engines.
+
+    The search URL templates are split at their placeholder up front, so a keyboard is put together from the image
+    URLs without parsing any template. Engines with their own `generate_search_url` keep using it.
+
+    Attributes:
+        engines (list[SearchEngine]): The engines a button is created for, in order.
+        columns (int): Number of buttons per row.
+    """
+
+    def __init__(self, engines: Sequence[SearchEngine], columns: int = 3):
+        """
+        Initialise the SearchKeyboard.
+
+        Args:
+            engines (Sequence[SearchEngine]): The engines a button is created for, in order.
+            columns (int, optional): Number of buttons per row (defaults to 3).
+        """
+        self.engines = list(engines)
+        self.columns = columns
+        self._urls = [(engine, engine.name, _compile(engine)) for engine in self.engines]
+
+    def build(self, file_url: str, engine_urls: Mapping[SearchEngine, str]) -> InlineKeyboardMarkup:
+        """
+        Create the keyboard for a searched image.
+
+        Args:
+            file_url (str): The public URL of the image, opened by the first button.
+            engine_urls (Mapping[SearchEngine, str]): The public URL of the image for each search engine.
+
+        Returns:
+            InlineKeyboardMarkup: The keyboard.
+        """
+        buttons = [InlineKeyboardButton(name, url(engine_urls[engine])) for engine, name, url in self._urls]
+        return InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Open Image", url=file_url)], *chunks(buttons, self.columns)]
+        )
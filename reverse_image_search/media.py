@@ -0,0 +1,350 @@
+import logging
+import mimetypes
+import shutil
+from asyncio import Semaphore, create_subprocess_exec, get_running_loop, timeout, to_thread
+from asyncio.subprocess import DEVNULL, PIPE
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Literal
+
+from PIL import Image
+from pydantic import BaseModel
+
+from reverse_image_search.metrics import FRAME_EXTRACTION
+from reverse_image_search.store import DownloadStore
+
+logger = logging.getLogger(__name__)
+
+
+def read_image(path: Path, max_edge: int | None = None, quality: int = 90) -> tuple[bytes, str]:
+    """
+    Read an image file, downscaled to fit the given edge length if it is larger.
+
+    This is blocking, run it in a thread or executor.
+
+    Args:
+        path (Path): The image file.
+        max_edge (int, optional): The maximum width and height, None keeps the original (defaults to None).
+        quality (int, optional): JPEG quality used for downscaled images (defaults to 90).
+
+    Returns:
+        tuple[bytes, str]: The image data and its mime type.
+    """
+    if max_edge:
+        try:
+            with Image.open(path) as image:
+                if max(image.size) > max_edge:
+                    image.draft("RGB", (max_edge, max_edge))
+                    image = image.convert("RGB")
+                    image.thumbnail((max_edge, max_edge), Image.Resampling.BICUBIC)
+                    buffer = BytesIO()
+                    image.save(buffer, "JPEG", quality=quality)
+                    return buffer.getvalue(), "image/jpeg"
+        except (OSError, ValueError):
+            pass  # Not an image Pillow can read, upload it as is
+
+    return path.read_bytes(), mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+class FrameExtractionError(Exception):
+    """Raised when the first frame of a video could not be extracted."""
+
+
+def ffmpeg_executable() -> str:
+    """
+    Find the ffmpeg executable, preferring the one bundled with imageio-ffmpeg.
+
+    Returns:
+        str: Path to the ffmpeg executable.
+    """
+    try:
+        from imageio_ffmpeg import get_ffmpeg_exe
+    except ImportError:
+        pass
+    else:
+        return get_ffmpeg_exe()  # type: ignore[no-any-return]
+
+    if executable := shutil.which("ffmpeg"):
+        return executable
+    raise FrameExtractionError("ffmpeg not found")
+
+
+class FrameExtractor:
+    """
+    Extract the first frame of videos in ffmpeg subprocesses.
+
+    Decoding runs outside the event loop in a bounded pool of ffmpeg processes. The video is piped to ffmpeg's
+    stdin and the frame is read as JPEG from its stdout, so no intermediate files are written. Only videos which
+    cannot be decoded from a pipe (e.g. MP4 files with the index at the end) fall back to a temporary file.
+
+    Attributes:
+        config (FrameExtractor.Config): The extractor configuration.
+        waiting (int): Number of extractions queued or running.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the FrameExtractor.
+
+        Attributes:
+            concurrency (int): Maximum number of ffmpeg processes running at the same time (defaults to 2).
+            max_queue (int): Maximum number of extractions queued or running (defaults to 32).
+            timeout (float): Time in seconds a single extraction may take (defaults to 20).
+        """
+
+        concurrency: int = 2
+        max_queue: int = 32
+        timeout: float = 20
+
+    def __init__(self, config: "FrameExtractor.Config | None" = None):
+        """
+        Initialise the FrameExtractor.
+
+        Args:
+            config (FrameExtractor.Config, optional): The extractor configuration (defaults to the default config).
+        """
+        self.config = config or FrameExtractor.Config()
+        self.waiting = 0
+        self._slots = Semaphore(self.config.concurrency)
+        self._executable: str | None = None
+
+    async def _run(self, source: str, data: bytes | None) -> bytes:
+        if not self._executable:
+            self._executable = ffmpeg_executable()
+
+        process = await create_subprocess_exec(
+            self._executable,
+            *("-v", "error", "-i", source, "-frames:v", "1", "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", "2"),
+            "pipe:1",
+            stdin=PIPE if data is not None else DEVNULL,
+            stdout=PIPE,
+            stderr=PIPE,
+        )
+        try:
+            async with timeout(self.config.timeout):
+                stdout, stderr = await process.communicate(data)
+        except TimeoutError:
+            raise FrameExtractionError(f"ffmpeg did not finish within {self.config.timeout}s") from None
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if process.returncode or not stdout:
+            raise FrameExtractionError(stderr.decode(errors="replace").strip() or "ffmpeg returned no frame")
+        return stdout
+
+    async def first_frame(self, data: bytes) -> bytes:
+        """
+        Extract the first frame of a video.
+
+        Args:
+            data (bytes): The video file content.
+
+        Returns:
+            bytes: The first frame as JPEG.
+
+        Raises:
+            FrameExtractionError: If the queue is full, ffmpeg failed or timed out.
+        """
+        if self.waiting >= self.config.max_queue:
+            raise FrameExtractionError("Too many videos waiting for frame extraction")
+
+        self.waiting += 1
+        try:
+            async with self._slots, FRAME_EXTRACTION.time():
+                try:
+                    return await self._run("pipe:0", data)
+                except FrameExtractionError as error:
+                    logger.debug("Extracting from pipe failed, retrying from file: %s", error)
+
+                # Some containers need a seekable input
+                with NamedTemporaryFile() as file:
+                    await to_thread(file.write, data)
+                    await to_thread(file.flush)
+                    return await self._run(file.name, None)
+        finally:
+            self.waiting -= 1
+
+
+PHOTO_MAX_SIDES = 10000
+"""Telegram rejects photos whose width and height add up to more than this"""
+PHOTO_MAX_RATIO = 20
+"""Telegram rejects photos with a more extreme aspect ratio than this"""
+
+
+def transcode_photo(
+    source: bytes | Path, max_edge: int, format: str, quality: int, min_quality: int, max_bytes: int
+) -> bytes | None:
+    """
+    Downscale and re-encode an image to fit Telegram's photo limits and a size target.
+
+    Runs in a worker process, so it only takes and returns plain data. Large originals are passed as path, so they
+    are only ever loaded by the worker.
+
+    Args:
+        source (bytes | Path): The original image or its location.
+        max_edge (int): The maximum width and height.
+        format (str): The output format, "JPEG" or "WEBP".
+        quality (int): The initial encoder quality.
+        min_quality (int): The lowest quality tried to reach `max_bytes`.
+        max_bytes (int): The target size of the result.
+
+    Returns:
+        bytes | None: The prepared image, the original if it fits already, or None if it cannot be sent as photo.
+    """
+    try:
+        with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as image:
+            width, height = image.size
+            if getattr(image, "is_animated", False) or max(width, height) > PHOTO_MAX_RATIO * min(width, height):
+                return None
+            size = len(source) if isinstance(source, bytes) else source.stat().st_size
+            if (
+                image.format == format
+                and size <= max_bytes
+                and max(width, height) <= max_edge
+                and width + height <= PHOTO_MAX_SIDES
+            ):
+                return source if isinstance(source, bytes) else source.read_bytes()
+
+            image.draft("RGB", (max_edge, max_edge))
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+            image.thumbnail((max_edge, max_edge), Image.Resampling.BICUBIC)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    while True:
+        buffer = BytesIO()
+        image.save(buffer, format, quality=quality)
+        if buffer.tell() <= max_bytes or quality <= min_quality:
+            return buffer.getvalue()
+        quality = max(min_quality, quality - 10)
+
+
+class MediaPreparer:
+    """
+    Prepare result images before they are uploaded to Telegram.
+
+    Large originals (e.g. Pixiv illustrations of 10 - 40 MB) are downscaled to Telegram's photo limits and encoded
+    to a size target in a pool of worker processes. Prepared images are stored on disk by source URL and profile,
+    so the original does not have to be downloaded and processed again for the next search.
+
+    Attributes:
+        config (MediaPreparer.Config): The preparer configuration.
+        store (DownloadStore): The store of prepared images.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the MediaPreparer.
+
+        Attributes:
+            enabled (bool): Whether to prepare images at all (defaults to True).
+            path (Path): Directory for prepared images (defaults to "prepared/").
+            max_bytes (int): Byte quota of the prepared images directory (defaults to 1 GiB).
+            workers (int): Number of worker processes (defaults to 2).
+            max_edge (int): Maximum width and height, Telegram shows photos at up to 2560px (defaults to 2560).
+            format ("JPEG" | "WEBP"): Output format (defaults to "JPEG").
+            quality (int): Initial encoder quality (defaults to 90).
+            min_quality (int): Lowest encoder quality to reach the size target (defaults to 60).
+            target_bytes (int): Size target of a prepared image, Telegram allows up to 10 MB (defaults to 5 MB).
+        """
+
+        enabled: bool = True
+        path: Path = Path("prepared/")
+        max_bytes: int = 1024**3
+        workers: int = 2
+        max_edge: int = 2560
+        format: Literal["JPEG", "WEBP"] = "JPEG"
+        quality: int = 90
+        min_quality: int = 60
+        target_bytes: int = 5 * 1024**2
+
+    def __init__(self, config: "MediaPreparer.Config | None" = None):
+        """
+        Initialise the MediaPreparer, call `start` before use.
+
+        Args:
+            config (MediaPreparer.Config, optional): The preparer configuration (defaults to the default config).
+        """
+        self.config = config or MediaPreparer.Config()
+        self.store = DownloadStore(
+            self.config.path, DownloadStore.Config(max_bytes=self.config.max_bytes, persist_aliases=False)
+        )
+        self.profile = (
+            f"{self.config.max_edge}:{self.config.format}:{self.config.quality}:{self.config.min_quality}"
+            f":{self.config.target_bytes}"
+        )
+        self._slots = Semaphore(self.config.workers)
+        self._pool: ProcessPoolExecutor | None = None
+
+    async def start(self) -> None:
+        """Index the prepared images and start the worker processes."""
+        await self.store.load()
+        self.store.start()
+        self._pool = ProcessPoolExecutor(self.config.workers, mp_context=get_context("spawn"))
+
+    def stop(self) -> None:
+        """Stop the worker processes, waiting for the images they are preparing right now."""
+        self.store.stop()
+        self.store.close()
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _key(self, source: str) -> str:
+        return f"{source}\n{self.profile}"
+
+    async def cached(self, source: str) -> bytes | None:
+        """
+        Get the prepared image of a source URL if there is one.
+
+        Args:
+            source (str): The URL of the original image.
+
+        Returns:
+            bytes | None: The prepared image or None.
+        """
+        if not self.config.enabled or not (path := await self.store.get(self._key(source))):
+            return None
+        try:
+            return await to_thread(path.read_bytes)
+        except OSError:
+            return None
+
+    async def prepare(self, source: str, data: bytes | Path) -> bytes | None:
+        """
+        Prepare an image to be sent as Telegram photo and store the result.
+
+        Args:
+            source (str): The URL of the original image.
+            data (bytes | Path): The original image or its location.
+
+        Returns:
+            bytes | None: The prepared image or None if it cannot be sent as photo.
+        """
+        if not self.config.enabled or not self._pool:
+            return None
+
+        async with self._slots:
+            prepared = await get_running_loop().run_in_executor(
+                self._pool,
+                transcode_photo,
+                data,
+                self.config.max_edge,
+                self.config.format,
+                self.config.quality,
+                self.config.min_quality,
+                self.config.target_bytes,
+            )
+
+        if prepared is not None:
+            await self.store.put(prepared, "." + self.config.format.lower(), key=self._key(source))
+        return prepared
@@ -0,0 +1,284 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterator, Literal, TypeVar
+
+from aiohttp import web
+from pydantic import BaseModel
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""Histogram bucket bounds in seconds"""
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    """
+    Base class of all metrics.
+
+    Attributes:
+        name (str): The metric name, e.g. "ris_saucenao_seconds".
+        documentation (str): The help text.
+        labelnames (tuple[str, ...]): The names of the labels, their values are given on every observation.
+    """
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _labels(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """
+        Get the samples of the metric in the Prometheus text format.
+
+        Yields:
+            str: One line per sample.
+        """
+
+    def expose(self) -> str:
+        """
+        Get the metric in the Prometheus text format.
+
+        Returns:
+            str: The help and type lines followed by all samples.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only increases, e.g. the number of requests."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            amount (float, optional): The amount to increase by (defaults to 1).
+            **labels (str): The label values.
+        """
+        key = self._labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. latencies, in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record a value.
+
+        Args:
+            value (float): The observed value.
+            **labels (str): The label values.
+        """
+        key = self._labels(labels)
+        if key not in self._counts:
+            self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0
+        self._counts[key][bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Record the time the block takes in seconds, also if it raises.
+
+        Args:
+            **labels (str): The label values.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, counts in self._counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                total += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {total}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{labels} {total}"
+
+
+class Callback(Metric):
+    """
+    A metric read from elsewhere whenever it is collected, e.g. the counters an object keeps itself.
+
+    The callback returns either a single value or a value per value of the only label.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float | dict[str, float]],
+        type: Literal["counter", "gauge"] = "gauge",
+        labelname: str | None = None,
+    ):
+        super().__init__(name, documentation, (labelname,) if labelname else ())
+        self.type = type
+        self.callback = callback
+
+    def samples(self) -> Iterator[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            yield f"{self.name} {_format_value(values)}"
+            return
+        for label, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, (label,))} {_format_value(value)}"
+
+
+T_Metric = TypeVar("T_Metric", bound=Metric)
+
+
+class Registry:
+    """A collection of metrics exposed together."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: T_Metric) -> T_Metric:
+        """
+        Add a metric, a metric registered before under the same name is replaced.
+
+        Args:
+            metric (Metric): The metric.
+
+        Returns:
+            Metric: The same metric, to register it where it is defined.
+        """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """
+        Get all metrics in the Prometheus text format.
+
+        Returns:
+            str: The exposition text.
+        """
+        return "".join(metric.expose() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+"""The registry all metrics of the bot are registered in"""
+
+TELEGRAM_DOWNLOAD = REGISTRY.register(
+    Histogram("ris_telegram_download_seconds", "Time to download the searched file from Telegram")
+)
+FRAME_EXTRACTION = REGISTRY.register(
+    Histogram("ris_frame_extraction_seconds", "Time to extract the first frame of a video")
+)
+SAUCENAO_REQUEST = REGISTRY.register(
+    Histogram("ris_saucenao_request_seconds", "Latency of SauceNAO API requests", ("status",))
+)
+PROVIDE = REGISTRY.register(
+    Histogram("ris_provide_seconds", "Time a provider takes to create the result message", ("provider",))
+)
+MAKE_TG_COMPATIBLE = REGISTRY.register(
+    Histogram("ris_make_tg_compatible_seconds", "Time to make a result file compatible with Telegram")
+)
+SEARCH = REGISTRY.register(Histogram("ris_search_seconds", "Time from receiving a file until all results are sent"))
+FILE_SERVE = REGISTRY.register(
+    Histogram("ris_file_serve_seconds", "Time to start serving a download, including creating variants", ("variant",))
+)
+
+
+class MetricsServer:
+    """
+    HTTP server exposing the metrics at `/metrics` for Prometheus to scrape.
+
+    Attributes:
+        registry (Registry): The metrics to expose.
+        config (MetricsServer.Config): The server configuration.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the MetricsServer.
+
+        Attributes:
+            enabled (bool): Whether to serve the metrics at all (defaults to True).
+            host (str): The address to listen on (defaults to "127.0.0.1").
+            port (int): The port to listen on, it must differ from the bot manager's port (defaults to 9464).
+        """
+
+        enabled: bool = True
+        host: str = "127.0.0.1"
+        port: int = 9464
+
+    def __init__(self, registry: Registry, config: "MetricsServer.Config | None" = None):
+        self.registry = registry
+        self.config = config or MetricsServer.Config()
+        self._runner: web.AppRunner | None = None
+
+    async def _metrics(self, _: web.Request) -> web.Response:
+        return web.Response(text=self.registry.expose(), content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        """Start serving the metrics, if enabled."""
+        if not self.config.enabled or self._runner:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.config.host, self.config.port).start()
+
+    async def stop(self) -> None:
+        """Stop serving the metrics."""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,278 @@
+import json
+import sqlite3
+from asyncio import to_thread
+from pathlib import Path
+from time import time
+from typing import Literal
+
+import numpy as np
+from PIL import Image
+from pydantic import BaseModel
+
+from reverse_image_search.cache import CacheKey
+
+HASH_SIZE = 8
+PHASH_SIZE = 32
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix, `D @ x @ D.T` is the 2D DCT of `x`."""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int(np.packbits(bits.ravel()).view(">u8")[0])
+
+
+def _grayscale(image: Image.Image, size: tuple[int, int]) -> np.ndarray:
+    # Let the JPEG decoder downscale while decoding, this saves most of the work for large pictures
+    image.draft("L", (size[0] * 4, size[1] * 4))
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.BILINEAR), dtype=np.float64)
+
+
+def phash(image: Image.Image) -> int:
+    """
+    Calculate the 64-bit perceptual hash (DCT based) of an image.
+
+    Args:
+        image (Image.Image): The image to hash.
+
+    Returns:
+        int: The hash as unsigned 64-bit integer.
+    """
+    pixels = _grayscale(image, (PHASH_SIZE, PHASH_SIZE))
+    low_frequencies = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    median = np.median(low_frequencies.ravel()[1:])  # The DC term would skew the median
+    return _pack(low_frequencies > median)
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Calculate the 64-bit difference hash (horizontal gradient) of an image.
+
+    Args:
+        image (Image.Image): The image to hash.
+
+    Returns:
+        int: The hash as unsigned 64-bit integer.
+    """
+    pixels = _grayscale(image, (HASH_SIZE + 1, HASH_SIZE))
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    """
+    Calculate the Hamming distance between a single hash and an array of hashes.
+
+    Args:
+        hashes (np.ndarray): Array of uint64 hashes.
+        value (int): The hash to compare against.
+
+    Returns:
+        np.ndarray: The number of differing bits per hash.
+    """
+    xor = hashes ^ np.uint64(value)
+    if bitwise_count := getattr(np, "bitwise_count", None):  # NumPy >= 2.0
+        return bitwise_count(xor)  # type: ignore[no-any-return]
+    return np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class PerceptualHashIndex:
+    """
+    Index of already searched images by perceptual hash.
+
+    Stores which results a search produced so near-duplicate images (re-encodes, screenshots, stickers of the same
+    picture) can be answered from the result cache without asking the search engines again.
+
+    The hashes are kept in a packed uint64 array, a lookup is a single vectorised XOR and bit count over all unexpired
+    ones. Expired entries are dropped from the array and the database whenever the array is full, before it grows.
+    Entries are persisted in an SQLite database and loaded on startup. Several processes may share the database,
+    entries added by the others are picked up before every lookup.
+
+    Attributes:
+        config (PerceptualHashIndex.Config): The index configuration.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the PerceptualHashIndex.
+
+        Attributes:
+            path (Path | None): Location of the SQLite database, None keeps the index in memory only.
+            algorithm ("phash" | "dhash"): The hash algorithm to use (defaults to "phash").
+            max_distance (int): Maximum Hamming distance for two images to count as the same (defaults to 6).
+            ttl (int): Time in seconds an entry is used for, should match the result cache time (default 2 days).
+        """
+
+        path: Path | None = Path("hashes.sqlite3")
+        algorithm: Literal["phash", "dhash"] = "phash"
+        max_distance: int = 6
+        ttl: int = 172800
+
+    def __init__(self, config: "PerceptualHashIndex.Config | None" = None):
+        """
+        Initialise the PerceptualHashIndex and load the persisted entries.
+
+        Args:
+            config (PerceptualHashIndex.Config, optional): The index configuration (defaults to memory only).
+        """
+        self.config = config or PerceptualHashIndex.Config(path=None)
+        self._hash_function = HASH_FUNCTIONS[self.config.algorithm]
+
+        self._size = 0
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._created = np.zeros(1024, dtype=np.float64)
+        self._outcomes: list[list[CacheKey]] = []
+        self._last_id = 0
+
+        self._db: sqlite3.Connection | None = None
+        if self.config.path:
+            self._db = self._open(self.config.path)
+            self._load()
+
+    def _open(self, path: Path) -> sqlite3.Connection:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            # AUTOINCREMENT never reuses ids of deleted rows, so all rows after the last one read are new
+            "CREATE TABLE IF NOT EXISTS hashes (id INTEGER PRIMARY KEY AUTOINCREMENT, algorithm TEXT NOT NULL,"
+            " hash INTEGER NOT NULL, created REAL NOT NULL, outcome TEXT NOT NULL)"
+        )
+        return db
+
+    def _load(self) -> None:
+        assert self._db
+        self._db.execute("DELETE FROM hashes WHERE created <= ?", (time() - self.config.ttl,))
+        self._sync()
+
+    def _sync(self) -> None:
+        """Append the entries added to the database since the last read, by this or another process."""
+        assert self._db
+        for row_id, hash_, created, outcome in self._db.execute(
+            "SELECT id, hash, created, outcome FROM hashes WHERE id > ? AND algorithm = ? ORDER BY id",
+            (self._last_id, self.config.algorithm),
+        ):
+            keys = [frozenset(tuple(item) for item in key) for key in json.loads(outcome)]
+            self._append(hash_ & 0xFFFFFFFFFFFFFFFF, created, keys)
+            self._last_id = row_id
+
+    def _first_unexpired(self) -> int:
+        # Entries are appended in order of creation, so the expired ones are always at the front
+        return int(np.searchsorted(self._created[: self._size], time() - self.config.ttl, side="right"))
+
+    def _compact(self) -> None:
+        """Drop the expired entries from the arrays and the database."""
+        if not (expired := self._first_unexpired()):
+            return
+        self._size -= expired
+        self._hashes[: self._size] = self._hashes[expired : expired + self._size]
+        self._created[: self._size] = self._created[expired : expired + self._size]
+        del self._outcomes[:expired]
+        if self._db:
+            self._db.execute("DELETE FROM hashes WHERE created <= ?", (time() - self.config.ttl,))
+
+    def _append(self, value: int, created: float, keys: list[CacheKey]) -> None:
+        if self._size == len(self._hashes):
+            self._compact()
+        if self._size == len(self._hashes):
+            self._hashes = np.resize(self._hashes, self._size * 2)
+            self._created = np.resize(self._created, self._size * 2)
+        self._hashes[self._size] = value
+        self._created[self._size] = created
+        self._outcomes.append(keys)
+        self._size += 1
+
+    def hash_image(self, path: Path) -> int | None:
+        """
+        Calculate the hash of an image file with the configured algorithm.
+
+        Args:
+            path (Path): The image file.
+
+        Returns:
+            int | None: The hash or None if the file could not be read as image.
+        """
+        try:
+            with Image.open(path) as image:
+                return self._hash_function(image)
+        except (OSError, ValueError):
+            return None
+
+    async def hash_file(self, path: Path) -> int | None:
+        """
+        Calculate the hash of an image file without blocking the event loop.
+
+        Args:
+            path (Path): The image file.
+
+        Returns:
+            int | None: The hash or None if the file could not be read as image.
+        """
+        return await to_thread(self.hash_image, path)
+
+    def lookup(self, value: int) -> list[CacheKey] | None:
+        """
+        Find the stored outcome of the closest unexpired image within the configured distance.
+
+        Args:
+            value (int): The hash of the searched image.
+
+        Returns:
+            list[CacheKey] | None: The cache keys of the results found for the matching image, or None.
+        """
+        if self._db:
+            self._sync()
+        start = self._first_unexpired()
+        if start == self._size:
+            return None
+
+        distances = hamming_distances(self._hashes[start : self._size], value)
+        best = int(np.argmin(distances))
+        if distances[best] > self.config.max_distance:
+            return None
+        return self._outcomes[start + best]
+
+    def add(self, value: int, keys: list[CacheKey]) -> None:
+        """
+        Store the outcome of a search.
+
+        Empty outcomes should not be stored, as they cannot be told apart from failed upstream requests.
+
+        Args:
+            value (int): The hash of the searched image.
+            keys (list[CacheKey]): The cache keys of all results the search produced.
+        """
+        created = time()
+        if not self._db:
+            self._append(value, created, keys)
+            return
+        self._db.execute(
+            "INSERT INTO hashes (algorithm, hash, created, outcome) VALUES (?, ?, ?, ?)",
+            (self.config.algorithm, _to_signed(value), created, json.dumps([sorted(key) for key in keys])),
+        )
+        # Read back with the entries of other processes added in the meantime, to keep the arrays in database order
+        self._sync()
+
+    def close(self) -> None:
+        """Close the database, the in-memory index stays usable."""
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return self._size
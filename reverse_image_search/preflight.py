@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+MB = 1024**2
+
+URL_LIMITS = {"image": 5 * MB, "video": 20 * MB}
+"""Maximum file size Telegram accepts when fetching media by URL itself"""
+DEFAULT_URL_LIMIT = 20 * MB
+
+PROBE_TIMEOUT = ClientTimeout(total=5)
+
+
+@dataclass(slots=True)
+class MediaProbe:
+    """
+    Size and type of a remote file.
+
+    Attributes:
+        size (int | None): The file size in bytes, if the server reported it.
+        content_type (str | None): The mime type, if the server reported it.
+    """
+
+    size: int | None
+    content_type: str | None
+
+    @property
+    def url_limit(self) -> int:
+        """The maximum size for Telegram to fetch a file of this type by URL"""
+        return URL_LIMITS.get((self.content_type or "").partition("/")[0], DEFAULT_URL_LIMIT)
+
+    def fits_url(self) -> bool:
+        """
+        Whether Telegram will most likely accept this file by URL.
+
+        Returns:
+            bool: False if the file is too large or is not media at all (e.g. an error page), True otherwise.
+        """
+        if self.content_type and not self.content_type.startswith(("image/", "video/")):
+            return False
+        return self.size is None or self.size <= self.url_limit
+
+
+async def probe_media(session: ClientSession, url: str) -> MediaProbe | None:
+    """
+    Find out the size and type of a remote file without downloading it.
+
+    Uses a HEAD request and falls back to a single byte ranged GET for servers which do not answer HEAD requests
+    with a content length.
+
+    Args:
+        session (ClientSession): The session to make the requests with.
+        url (str): The URL of the file.
+
+    Returns:
+        MediaProbe | None: The size and type or None if the server could not be reached.
+    """
+    try:
+        async with session.head(url, allow_redirects=True, timeout=PROBE_TIMEOUT) as response:
+            if response.ok and response.content_length is not None:
+                return MediaProbe(response.content_length, response.content_type)
+
+        async with session.get(url, headers={"Range": "bytes=0-0"}, timeout=PROBE_TIMEOUT) as response:
+            if response.status == 206 and (total := response.headers.get("Content-Range", "").rpartition("/")[2]):
+                return MediaProbe(int(total) if total.isdigit() else None, response.content_type)
+            if response.ok:
+                return MediaProbe(response.content_length, response.content_type)
+    except (ClientError, TimeoutError):
+        pass
+    return None
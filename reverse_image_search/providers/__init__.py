@@ -1,19 +1,100 @@
-from typing import TYPE_CHECKING
+from asyncio import Task, create_task, gather
+from functools import partial
+from typing import TYPE_CHECKING, Iterator, Mapping
 
 from aiohttp import ClientSession
 
+from reverse_image_search.cache import ResultCache
+from reverse_image_search.downloader import Downloader
 from reverse_image_search.providers.base import Provider
-from reverse_image_search.providers.booru import BooruProvider
-from reverse_image_search.providers.pixiv import PixivProvider
+from reverse_image_search.registry import Registry
 
 if TYPE_CHECKING:
-    from reverse_image_search.app import ReverseImageSearch
+    from reverse_image_search.app import SearchPipeline
 
+PROVIDERS: Registry[Provider] = Registry(
+    "provider",
+    {
+        "booru": "reverse_image_search.providers.booru:BooruProvider",
+        "pixiv": "reverse_image_search.providers.pixiv:PixivProvider",
+    },
+    "reverse_image_search.providers",
+)
 
-async def initiate_data_providers(
-    session: ClientSession, config: "ReverseImageSearch.Arguments"
-) -> dict[str, Provider]:
-    return {
-        "booru": BooruProvider(session, config.boorus),
-        "pixiv": PixivProvider(config.pixiv),
-    }
+SETTINGS = {"booru": "boorus"}
+"""The argument holding the configuration of a provider, if it is not named after the provider"""
+
+
+class Providers(Mapping[str, Provider]):
+    """
+    The data providers by name, each one is imported, created and started the first time it is looked up.
+
+    Providers without configuration in the arguments of the bot are missing. Iterating the providers or testing for a
+    name only checks the configuration and creates none of them. The live objects of a provider are registered with the
+    result cache once it is created, or created on demand when a cached result referencing them is read.
+
+    Attributes:
+        names (list[str]): The names of the configured providers.
+        created (dict[str, Provider | None]): The providers looked up so far, None if not configured.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        downloader: Downloader,
+        config: "SearchPipeline.Arguments",
+        cache: ResultCache,
+    ):
+        """
+        Initialise the Providers.
+
+        Args:
+            session (ClientSession): The shared aiohttp session.
+            downloader (Downloader): The downloader for the files of the providers.
+            config (SearchPipeline.Arguments): The arguments of the bot.
+            cache (ResultCache): The cache the live objects of the providers are registered with.
+        """
+        self._session = session
+        self._downloader = downloader
+        self._config = config
+        self._cache = cache
+        self.names = [name for name in PROVIDERS.plugins if getattr(config, SETTINGS.get(name, name), None)]
+        self.created: dict[str, Provider | None] = {}
+        self._starting: set[Task[None]] = set()
+        for name in self.names:
+            cache.register_lazy(name, partial(self._live_objects, name))
+
+    def __getitem__(self, name: str) -> Provider:
+        if name not in self.created:
+            if name not in self.names:
+                raise KeyError(name)
+            provider = self.created[name] = PROVIDERS.create(name, self._session, self._downloader, self._config)
+            if provider is not None:
+                for key, obj in provider.live_objects().items():
+                    self._cache.register(key, obj)
+                # Lookups are synchronous, starting only schedules the background tasks of a provider anyway
+                task = create_task(provider.start())
+                self._starting.add(task)
+                task.add_done_callback(self._starting.discard)
+        if (provider := self.created[name]) is None:
+            raise KeyError(name)
+        return provider
+
+    def _live_objects(self, name: str) -> dict[str, object]:
+        provider = self.get(name)
+        return provider.live_objects() if provider is not None else {}
+
+    def __contains__(self, name: object) -> bool:
+        # Only the configuration is checked, the provider is created once it is looked up
+        return name in self.names and self.created.get(name, True) is not None  # type: ignore[call-overload]
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in self.names if self.created.get(name, True) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    async def stop(self) -> None:
+        """Stop the background tasks of the providers created so far."""
+        await gather(*self._starting, return_exceptions=True)
+        await gather(*(provider.stop() for provider in self.created.values() if provider is not None))
@@ -6,6 +6,11 @@ from pydantic import Field
 from tgtools.models.summaries import Downloadable, FileSummary
 
 if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
+    from reverse_image_search.app import SearchPipeline
+    from reverse_image_search.cache import CacheKey
+    from reverse_image_search.downloader import Downloader
     from reverse_image_search.engines.base import SearchEngine
 
 
@@ -77,11 +82,13 @@ class SearchResult:
         engine (SearchEngine): The search engine used to obtain the result.
         provider (ProviderInfo): The providers info
         message (MessageConstruct): The message construct associated with the result.
+        query (CacheKey | None): The cache key the result is stored under, if any.
     """
 
     engine: "SearchEngine"
     provider: ProviderInfo
     message: MessageConstruct
+    query: Optional["CacheKey"] = None
 
     @property
     def intro(self) -> str:
@@ -119,6 +126,24 @@ class Provider(Generic[T_QueryData], metaclass=ABCMeta):
     name: str = "Provider"
     credit_url: str = "https://example.com"
 
+    @classmethod
+    @abstractmethod
+    def from_arguments(
+        cls, session: "ClientSession", downloader: "Downloader", config: "SearchPipeline.Arguments"
+    ) -> "Provider | None":
+        """
+        Create the provider from the arguments of the bot.
+
+        Args:
+            session (ClientSession): The shared aiohttp session.
+            downloader (Downloader): The downloader for the files of the provider.
+            config (SearchPipeline.Arguments): The arguments of the bot.
+
+        Returns:
+            Provider | None: The provider or None if it is not configured.
+        """
+        ...
+
     def provider_info(self, data: T_QueryData | None) -> ProviderInfo:
         """
         Retrieve ProviderInfo based on input data
@@ -130,6 +155,24 @@ class Provider(Generic[T_QueryData], metaclass=ABCMeta):
         """
         return ProviderInfo(self.name, self.credit_url)
 
+    def live_objects(self) -> dict[str, object]:
+        """
+        Objects referenced by provided messages which must not be serialised by value.
+
+        Cached results are persisted to disk, results referencing e.g. an API client (through a download method)
+        store these objects by name and resolve them again on load.
+
+        Returns:
+            dict[str, object]: A mapping of stable names to objects
+        """
+        return {}
+
+    async def start(self) -> None:
+        """Start the background tasks of the provider, if it has any."""
+
+    async def stop(self) -> None:
+        """Stop the background tasks of the provider."""
+
     @abstractmethod
     async def provide(self, data: T_QueryData) -> MessageConstruct | None:
         """
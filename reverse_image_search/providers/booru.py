@@ -1,11 +1,18 @@
+from asyncio import Future, Task, TimerHandle, create_task, gather, get_running_loop
+from typing import TYPE_CHECKING, Any, Callable
+
 from aiohttp import BasicAuth, ClientSession
 from emoji import emojize
-from pydantic import BaseModel
 from tgtools.api import DanbooruApi, GelbooruApi, KonachanApi, YandereApi
 from tgtools.models import RATING
 from tgtools.telegram.text import tagified_string
 
+from reverse_image_search.downloader import Downloader
 from reverse_image_search.providers.base import Info, MessageConstruct, Provider, ProviderInfo, QueryData
+from reverse_image_search.providers.config import BooruConfig
+
+if TYPE_CHECKING:
+    from reverse_image_search.app import SearchPipeline
 
 
 class BooruQuery(QueryData):
@@ -13,6 +20,84 @@ class BooruQuery(QueryData):
     provider: str
 
 
+class PostBatcher:
+    """
+    Batches post lookups of one booru.
+
+    Post IDs requested within a short window are collected and resolved with a single multi-id search, the posts
+    are then handed back to the individual callers. IDs the search does not return are looked up one by one, as are
+    all IDs of APIs without a multi-id search (only Danbooru has one).
+
+    Attributes:
+        api (Any): The booru API to fetch posts with.
+        tags (Callable[[list[int]], str]): Creates the search tags for a list of post IDs.
+        window (float): Time in seconds to collect IDs before they are fetched.
+        max_batch (int): Maximum number of IDs per request, a full batch is fetched right away.
+    """
+
+    def __init__(self, api: Any, tags: Callable[[list[int]], str], window: float, max_batch: int) -> None:
+        self.api = api
+        self.tags = tags
+        self.window = window
+        self.max_batch = max_batch
+
+        self._pending: dict[int, list[Future[Any]]] = {}
+        self._timer: TimerHandle | None = None
+        self._tasks: set[Task[None]] = set()
+
+    async def post(self, post_id: int) -> Any:
+        """
+        Fetch a single post as part of the next batch.
+
+        Args:
+            post_id (int): The ID of the post.
+
+        Returns:
+            Any: The post or None if it does not exist.
+        """
+        loop = get_running_loop()
+        future: Future[Any] = loop.create_future()
+        self._pending.setdefault(post_id, []).append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif not self._timer:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+
+        task = create_task(self._resolve(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, pending: dict[int, list[Future[Any]]]) -> None:
+        ids = sorted(pending)
+        try:
+            found = {}
+            if len(ids) > 1 and isinstance(self.api, DanbooruApi):
+                posts = await self.api.posts(self.tags(ids), limit=len(ids))
+                found = {post.id: post for post in posts or ()}
+            # The search leaves out e.g. deleted or hidden posts, which a lookup by ID may still return
+            missing = [post_id for post_id in ids if post_id not in found]
+            found.update(zip(missing, await gather(*(self.api.post(post_id) for post_id in missing))))
+        except Exception as error:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+            return
+
+        for post_id, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(found.get(post_id))
+
+
 class BooruProvider(Provider[BooruQuery]):
     """A provider for fetching and processing booru posts.
 
@@ -21,20 +106,12 @@ class BooruProvider(Provider[BooruQuery]):
         yandere (YandereApi): An instance of the YandereApi class.
         gelbooru (GelbooruApi): An instance of the GelbooruApi class.
         threedbooru (ThreeDBooruApi): An instance of the ThreeDBooruApi class.
+        batchers (dict[str, PostBatcher]): Batches post lookups of boorus supporting multi-id searches.
     """
 
     name = "Booru"
 
-    class Config(BaseModel):
-        """Configuration for the BooruProvider.
-
-        Attributes:
-            danbooru_username (str): The username for accessing the Danbooru API.
-            danbooru_api_key (str): The API key for accessing the Danbooru API.
-        """
-
-        danbooru_username: str
-        danbooru_api_key: str
+    Config = BooruConfig
 
     def __init__(self, session: ClientSession, config: "Config") -> None:
         """
@@ -49,6 +126,30 @@ class BooruProvider(Provider[BooruQuery]):
         self.gelbooru = GelbooruApi(session)
         self.konachan = KonachanApi(session)
 
+        # Only Danbooru supports searching for a list of IDs
+        self.batchers = {
+            "danbooru": PostBatcher(
+                self.danbooru,
+                lambda ids: "id:" + ",".join(map(str, ids)),
+                config.batch_window,
+                config.batch_size,
+            ),
+        }
+
+    @classmethod
+    def from_arguments(
+        cls, session: ClientSession, downloader: Downloader, config: "SearchPipeline.Arguments"
+    ) -> "BooruProvider | None":
+        return cls(session, config.boorus) if config.boorus else None
+
+    def live_objects(self) -> dict[str, object]:
+        return {
+            "booru.danbooru": self.danbooru,
+            "booru.yandere": self.yandere,
+            "booru.gelbooru": self.gelbooru,
+            "booru.konachan": self.konachan,
+        }
+
     def provider_info(self, data: BooruQuery | None) -> ProviderInfo:
         """
         Fetch and process a booru post.
@@ -109,7 +210,10 @@ class BooruProvider(Provider[BooruQuery]):
 
         post_id: int = data["id"]
 
-        post = await provider.post(post_id)
+        if batcher := self.batchers.get(data["provider"]):
+            post = await batcher.post(post_id)
+        else:
+            post = await provider.post(post_id)
 
         if post is None:
             return None
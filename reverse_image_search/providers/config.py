@@ -0,0 +1,42 @@
+"""
+Configuration of the data providers, kept apart so the arguments of the bot can be validated without importing them.
+"""
+
+from pathlib import Path
+
+from pydantic import BaseModel
+
+
+class BooruConfig(BaseModel):
+    """Configuration for the BooruProvider.
+
+    Attributes:
+        danbooru_username (str): The username for accessing the Danbooru API.
+        danbooru_api_key (str): The API key for accessing the Danbooru API.
+        batch_window (float): Time in seconds to collect post lookups into one request (defaults to 0.05).
+        batch_size (int): Maximum number of posts fetched with one request (defaults to 20).
+    """
+
+    danbooru_username: str
+    danbooru_api_key: str
+    batch_window: float = 0.05
+    batch_size: int = 20
+
+
+class PixivConfig(BaseModel):
+    """Configuration for the PixivProvider
+
+    Attributes:
+        access_token (str): API JWT access token
+        refresh_token (str): API JWT refresh token
+        token_path (Path | None): File the refreshed tokens are stored in, they take precedence over the
+            configured ones once it exists. None disables storing them (defaults to "pixiv_tokens.json").
+        refresh_margin (float): Renew the access token this many seconds before it expires (defaults to 600).
+        retry_interval (float): Time in seconds to wait after a failed refresh (defaults to 60).
+    """
+
+    access_token: str
+    refresh_token: str
+    token_path: Path | None = Path("pixiv_tokens.json")
+    refresh_margin: float = 600
+    retry_interval: float = 60
@@ -1,14 +1,34 @@
+import logging
+from asyncio import CancelledError, Task, create_task, sleep, to_thread
+from contextlib import suppress
 from pathlib import Path
-from typing import Optional
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import TYPE_CHECKING, Optional
 
-from aiopixiv._api import PixivAPI
+from aiohttp import ClientError, ClientSession
 from emoji import emojize
 from pydantic import BaseModel
 from tgtools.models.summaries import ToDownload
 from tgtools.telegram.text import tagified_string
 from yarl import URL
 
+from reverse_image_search.downloader import Downloader
 from reverse_image_search.providers.base import Info, MessageConstruct, Provider, QueryData
+from reverse_image_search.providers.config import PixivConfig
+
+if TYPE_CHECKING:
+    from aiopixiv._api import PixivAPI
+
+    from reverse_image_search.app import SearchPipeline
+
+logger = logging.getLogger(__name__)
+
+# OAuth client of the pixiv Android app, see pixiv_auth.py
+USER_AGENT = "PixivAndroidApp/5.0.234 (Android 11; Pixel 5)"
+AUTH_TOKEN_URL = "https://oauth.secure.pixiv.net/auth/token"
+CLIENT_ID = "MOBrBDS8blbauoSck0ZfDbtuzpyT"
+CLIENT_SECRET = "lsACyCD94FhDUtGTXi3QzcFE2uU1hqtDaKeqrdwj"
 
 
 class PixivQuery(QueryData):
@@ -16,31 +36,188 @@ class PixivQuery(QueryData):
     image_index: Optional[int]
 
 
+class PixivTokens(BaseModel):
+    """Credentials for the pixiv API.
+
+    Attributes:
+        access_token (str): API JWT access token
+        refresh_token (str): API JWT refresh token
+        expires_at (float): Unix time the access token expires at, 0 if unknown
+    """
+
+    access_token: str
+    refresh_token: str
+    expires_at: float = 0
+
+
+async def refresh_tokens(session: ClientSession, refresh_token: str) -> PixivTokens:
+    """
+    Get a new access token from pixiv's OAuth server.
+
+    Args:
+        session (ClientSession): The session to make the request with.
+        refresh_token (str): The current refresh token.
+
+    Returns:
+        PixivTokens: The new tokens, pixiv may rotate the refresh token as well.
+
+    Raises:
+        ValueError: If pixiv did not return new tokens.
+    """
+    async with session.post(
+        AUTH_TOKEN_URL,
+        data={
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "include_policy": "true",
+            "refresh_token": refresh_token,
+        },
+        headers={"User-Agent": USER_AGENT},
+    ) as response:
+        data = await response.json(content_type=None)
+
+    try:
+        return PixivTokens(
+            access_token=data["access_token"],
+            refresh_token=data["refresh_token"],
+            expires_at=time() + int(data.get("expires_in", 3600)),
+        )
+    except (KeyError, TypeError) as error:
+        raise ValueError(f"pixiv did not return new tokens: {data}") from error
+
+
+def _client(tokens: PixivTokens) -> "PixivAPI":
+    # aiopixiv is only imported once pixiv is used
+    from aiopixiv._api import PixivAPI
+
+    return PixivAPI(access_token=tokens.access_token, refresh_token=tokens.refresh_token)
+
+
 class PixivProvider(Provider[PixivQuery]):
     """A provider for fetching and processing pixiv illustrations."""
 
     name = "Pixiv"
     credit_url = "http://pixiv.net"
+    referer = "https://app-api.pixiv.net/"
+    image_host = "i.pximg.net"
+
+    Config = PixivConfig
+
+    def __init__(self, session: ClientSession, downloader: Downloader, config: "Config") -> None:
+        """
+        Initialise the PixivProvider with a session and configuration.
+
+        Args:
+            session (ClientSession): The aiohttp ClientSession used to renew the access token.
+            downloader (Downloader): The downloader used to download the illustrations.
+            config (Config): The configuration object containing API credentials.
+        """
+        self.session = session
+        self.downloader = downloader
+        # pixiv's image servers only answer requests coming from the app
+        self.downloader.set_headers(self.image_host, {"Referer": self.referer})
+        self.config = config
+        self.tokens = self._load_tokens() or PixivTokens(
+            access_token=config.access_token, refresh_token=config.refresh_token
+        )
+        self.client = _client(self.tokens)
+        self._refresh_task: Task[None] | None = None
+        self._retired: "PixivAPI | None" = None
+
+    @classmethod
+    def from_arguments(
+        cls, session: ClientSession, downloader: Downloader, config: "SearchPipeline.Arguments"
+    ) -> "PixivProvider | None":
+        return cls(session, downloader, config.pixiv) if config.pixiv else None
+
+    def live_objects(self) -> dict[str, object]:
+        return {"pixiv.provider": self}
+
+    def _load_tokens(self) -> PixivTokens | None:
+        if not self.config.token_path or not self.config.token_path.is_file():
+            return None
+        try:
+            tokens = PixivTokens.model_validate_json(self.config.token_path.read_text())
+        except ValueError:
+            logger.warning("Ignoring unreadable pixiv tokens in %s", self.config.token_path)
+            return None
+        return tokens
 
-    class Config(BaseModel):
-        """Configuration for the PixivProvider
+    def _save_tokens(self, tokens: PixivTokens) -> None:
+        if not self.config.token_path:
+            return
+        path = self.config.token_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Worker processes may renew the tokens at the same time, each one writes its own temporary file which is
+        # only readable by the owner
+        temporary = NamedTemporaryFile("w", dir=path.parent, prefix=f".{path.name}.", delete=False)
+        try:
+            with temporary:
+                temporary.write(tokens.model_dump_json())
+            Path(temporary.name).replace(path)
+        except BaseException:
+            Path(temporary.name).unlink(missing_ok=True)
+            raise
 
-        Attributes:
-            access_token (str): API JWT access token
-            refresh_token (str): API JWT refresh token
+    async def start(self) -> None:
+        """Start renewing the access token in the background."""
+        if not self._refresh_task:
+            self._refresh_task = create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Stop renewing the access token and close the API clients."""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            with suppress(CancelledError):
+                await self._refresh_task
+            self._refresh_task = None
+        for client in (self._retired, self.client):
+            if client and (shutdown := getattr(client, "shutdown", None)):
+                with suppress(Exception):
+                    await shutdown()
+        self._retired = None
+
+    async def refresh(self) -> None:
         """
+        Renew the access token and store the new tokens.
+
+        Requests keep using the current client until the new one is ready, none of them waits for the refresh.
+        """
+        tokens = await refresh_tokens(self.session, self.tokens.refresh_token)
+        await to_thread(self._save_tokens, tokens)
+
+        # Requests may still run on the current client, it is closed at the next refresh
+        if self._retired and (shutdown := getattr(self._retired, "shutdown", None)):
+            with suppress(Exception):
+                await shutdown()
+        self._retired, self.tokens = self.client, tokens
+        self.client = _client(tokens)
+        logger.info("Renewed pixiv access token, valid for %ds", tokens.expires_at - time())
 
-        access_token: str
-        refresh_token: str
+    async def _refresh_loop(self) -> None:
+        while True:
+            # Tokens of unknown age are renewed right away
+            await sleep(max(0, self.tokens.expires_at - self.config.refresh_margin - time()))
+            try:
+                await self.refresh()
+            except (ClientError, TimeoutError, ValueError, OSError) as error:
+                logger.warning("Renewing pixiv access token failed: %s", error)
+                await sleep(self.config.retry_interval)
 
-    def __init__(self, config: "Config") -> None:
+    async def download(self, url: str) -> Path:
         """
-        Initialise the PixivProvider with a session and configuration.
+        Download an illustration into the download store, sharing the per host download limit with all other pages.
+
+        Large illustrations are streamed to disk, `make_tg_compatible` gets the path of the stored file.
 
         Args:
-            config (Config): The configuration object containing API credentials.
+            url (str): The URL of the illustration.
+
+        Returns:
+            Path: The stored illustration.
         """
-        self.client = PixivAPI(access_token=config.access_token, refresh_token=config.refresh_token)
+        return await self.downloader.save(url)
 
     async def provide(self, data: PixivQuery) -> MessageConstruct | None:
         """
@@ -84,10 +261,9 @@ class PixivProvider(Provider[PixivQuery]):
         source_url = f"https://www.pixiv.net/en/artworks/{post.id}"
         artist_url = f"https://www.pixiv.net/en/user/{post.user.id}"
 
-        client = post.get_client()
         main_file = ToDownload(
             url=post.meta_pages[data["image_index"] or 0].image_urls.best,
-            download_method=client.download,
+            download_method=self.download,
         )
 
         additional_files_captions = None
@@ -98,7 +274,7 @@ class PixivProvider(Provider[PixivQuery]):
                 additional_files.append(
                     ToDownload(
                         url=url,
-                        download_method=client.download,
+                        download_method=self.download,
                         filename=f"p_{post.id}_p{index}" + Path(URL(url).name).suffix,
                     )
                 )
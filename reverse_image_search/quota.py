@@ -0,0 +1,233 @@
+import logging
+from asyncio import Lock, sleep, timeout
+from hashlib import sha256
+from time import monotonic
+from typing import Any, Sequence
+
+from pydantic import BaseModel
+
+from reverse_image_search.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExhausted(Exception):
+    """Raised when a request cannot be made within its deadline because the API quota is used up."""
+
+
+class SauceNaoQuota:
+    """
+    Tracks the quota of a single SauceNAO API key.
+
+    SauceNAO limits each key by a short (30 seconds) and a long (24 hours) window. The local token buckets are
+    corrected with the remaining quota SauceNAO reports with every response.
+
+    Attributes:
+        key (str): The API key.
+        short (TokenBucket): The short window quota.
+        long (TokenBucket): The long window quota.
+        blocked_until (float): Monotonic time until which the key must not be used, after SauceNAO refused it.
+        in_flight (int): Number of requests sent but not yet answered.
+        requests (int): Total number of requests made with this key.
+        rate_limited (int): Total number of requests SauceNAO refused with 429.
+    """
+
+    def __init__(self, key: str, config: "SauceNaoScheduler.Config"):
+        self.key = key
+        self.config = config
+        self.short = TokenBucket(config.short_limit, config.short_period)
+        self.long = TokenBucket(config.long_limit, config.long_period)
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+
+    @property
+    def headroom(self) -> tuple[float, float]:
+        """Remaining short and long quota, used to pick the key with the most room"""
+        return self.short.tokens, self.long.tokens
+
+    @property
+    def blocked(self) -> bool:
+        return self.blocked_until > monotonic() or self.long.tokens < 1
+
+    def wait_time(self) -> float:
+        """Seconds until a request can be sent with this key, `inf` if the key is blocked."""
+        if self.blocked:
+            return float("inf")
+        return self.short.wait_time()
+
+    def try_acquire(self) -> bool:
+        if self.blocked or not self.short.try_acquire():
+            return False
+        self.long.try_acquire()
+        self.in_flight += 1
+        self.requests += 1
+        return True
+
+    def release(self, header: dict[str, Any] | None, rate_limited: bool = False) -> None:
+        """
+        Finish a request and update the quota with the data SauceNAO returned.
+
+        Args:
+            header (dict[str, Any], optional): The "header" object of the SauceNAO response.
+            rate_limited (bool, optional): Whether SauceNAO answered with 429 (defaults to False).
+        """
+        self.in_flight -= 1
+        header = header or {}
+
+        if short_limit := int(header.get("short_limit") or 0):
+            self.short.set_capacity(short_limit)
+        if long_limit := int(header.get("long_limit") or 0):
+            self.long.set_capacity(long_limit)
+
+        # Requests still in flight are already debited locally but not yet by SauceNAO
+        if (short_remaining := header.get("short_remaining")) is not None:
+            self.short.set_tokens(int(short_remaining) - self.in_flight)
+        if (long_remaining := header.get("long_remaining")) is not None:
+            self.long.set_tokens(int(long_remaining) - self.in_flight)
+
+        if rate_limited:
+            self.rate_limited += 1
+            self.short.set_tokens(0)
+            if self.long.tokens < 1 or (long_remaining is not None and int(long_remaining) <= 0):
+                self.blocked_until = monotonic() + self.config.long_cooldown
+                logger.warning(
+                    "SauceNAO daily limit of key %s reached, pausing it for %ss", self.name, self.config.long_cooldown
+                )
+            else:
+                self.blocked_until = monotonic() + self.config.short_period
+
+    @property
+    def name(self) -> str:
+        """A short hash identifying the API key in logs and stats without revealing any of it"""
+        return sha256(self.key.encode()).hexdigest()[:8]
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Current usage of this key.
+
+        Returns:
+            dict[str, Any]: The remaining quota per window, totals and the utilisation of the long window (0 - 1).
+        """
+        short_remaining, long_remaining = self.headroom
+        return {
+            "short_remaining": round(short_remaining, 2),
+            "short_limit": self.short.capacity,
+            "long_remaining": round(long_remaining, 2),
+            "long_limit": self.long.capacity,
+            "utilization": round(1 - long_remaining / self.long.capacity, 4),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "blocked": self.blocked,
+        }
+
+
+class SauceNaoScheduler:
+    """
+    Schedules requests to SauceNAO within the API quota of a pool of keys.
+
+    Each request is routed to the key with the most remaining quota, keys which SauceNAO refused are cooled down
+    until their window resets. Callers wait in a bounded FIFO queue until any key allows their request. If the
+    queue is full, all keys are exhausted or the request could not be sent before its deadline `QuotaExhausted`
+    is raised, so the caller can fall back to link-only results instead of failing.
+
+    Attributes:
+        config (SauceNaoScheduler.Config): The scheduler configuration.
+        quotas (list[SauceNaoQuota]): The quota of each API key.
+        waiting (int): Number of callers currently queued.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the SauceNaoScheduler.
+
+        The limits are only the starting point, they are updated with the limits SauceNAO reports for each key.
+
+        Attributes:
+            short_limit (int): Requests per short window and key (defaults to 4, the free tier).
+            short_period (float): Length of the short window in seconds (defaults to 30).
+            long_limit (int): Requests per long window and key (defaults to 100, the free tier).
+            long_period (float): Length of the long window in seconds (defaults to 24 hours).
+            long_cooldown (float): Pause of a key after its long quota was exhausted in seconds (defaults to 1 hour).
+            max_waiting (int): Maximum number of queued requests (defaults to 20).
+            max_wait (float): Maximum time a request waits for quota in seconds (defaults to 15).
+        """
+
+        short_limit: int = 4
+        short_period: float = 30
+        long_limit: int = 100
+        long_period: float = 86400
+        long_cooldown: float = 3600
+        max_waiting: int = 20
+        max_wait: float = 15
+
+    def __init__(self, keys: Sequence[str], config: "SauceNaoScheduler.Config | None" = None):
+        """
+        Initialise the SauceNaoScheduler.
+
+        Args:
+            keys (Sequence[str]): The API keys to balance the requests over.
+            config (SauceNaoScheduler.Config, optional): The scheduler configuration (defaults to the free tier).
+        """
+        if not keys:
+            raise ValueError("At least one API key is required")
+
+        self.config = config or SauceNaoScheduler.Config()
+        self.quotas = [SauceNaoQuota(key, self.config) for key in dict.fromkeys(keys)]
+        self.waiting = 0
+        self._queue = Lock()  # asyncio.Lock wakes up waiters in FIFO order
+
+    def wait_time(self) -> float:
+        """Seconds until any key can be used, `inf` if all keys are blocked."""
+        return min(quota.wait_time() for quota in self.quotas)
+
+    def _try_acquire(self) -> SauceNaoQuota | None:
+        available = [quota for quota in self.quotas if quota.wait_time() == 0]
+        for quota in sorted(available, key=lambda quota: quota.headroom, reverse=True):
+            if quota.try_acquire():
+                return quota
+        return None
+
+    async def acquire(self, deadline: float | None = None) -> SauceNaoQuota:
+        """
+        Wait until a request may be sent.
+
+        Args:
+            deadline (float, optional): Monotonic time after which to give up (defaults to now + `max_wait`).
+
+        Returns:
+            SauceNaoQuota: The quota of the key to use, `release` it once the response arrived.
+
+        Raises:
+            QuotaExhausted: If no request can be sent before the deadline.
+        """
+        if deadline is None:
+            deadline = monotonic() + self.config.max_wait
+
+        if self.wait_time() > deadline - monotonic():
+            raise QuotaExhausted("SauceNAO quota exhausted")
+        if self.waiting >= self.config.max_waiting:
+            raise QuotaExhausted("Too many requests waiting for SauceNAO quota")
+
+        self.waiting += 1
+        try:
+            async with timeout(deadline - monotonic()), self._queue:
+                while not (quota := self._try_acquire()):
+                    if (delay := self.wait_time()) > deadline - monotonic():
+                        raise QuotaExhausted("SauceNAO quota exhausted")
+                    await sleep(delay)
+        except TimeoutError:
+            raise QuotaExhausted("Timed out waiting for SauceNAO quota") from None
+        finally:
+            self.waiting -= 1
+        return quota
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """
+        Current usage per key, to see how many keys are needed for the traffic.
+
+        Returns:
+            dict[str, dict[str, Any]]: The `SauceNaoQuota.stats` by hashed key.
+        """
+        return {quota.name: quota.stats() for quota in self.quotas}
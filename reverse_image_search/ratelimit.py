@@ -0,0 +1,92 @@
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter.
+
+    The bucket holds up to `capacity` tokens and refills continuously, `capacity` tokens every `period` seconds.
+
+    Attributes:
+        capacity (float): The maximum number of tokens.
+        period (float): Time in seconds to refill an empty bucket.
+    """
+
+    def __init__(self, capacity: float, period: float):
+        """
+        Initialise a full TokenBucket.
+
+        Args:
+            capacity (float): The maximum number of tokens.
+            period (float): Time in seconds to refill an empty bucket.
+        """
+        self.capacity = capacity
+        self.period = period
+        self._tokens = capacity
+        self._updated = monotonic()
+
+    @property
+    def rate(self) -> float:
+        """Tokens added per second"""
+        return self.capacity / self.period
+
+    @property
+    def tokens(self) -> float:
+        """The currently available tokens"""
+        self._refill()
+        return self._tokens
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take tokens from the bucket if enough are available.
+
+        Args:
+            tokens (float, optional): The number of tokens to take (defaults to 1).
+
+        Returns:
+            bool: True if the tokens were taken.
+        """
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """
+        Time until the given number of tokens is available.
+
+        Args:
+            tokens (float, optional): The number of tokens needed (defaults to 1).
+
+        Returns:
+            float: Seconds to wait, 0 if the tokens are available now.
+        """
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def set_tokens(self, tokens: float) -> None:
+        """
+        Overwrite the available tokens, e.g. with the remaining quota reported by an API.
+
+        Args:
+            tokens (float): The available tokens, clamped to 0 and the capacity.
+        """
+        self._refill()
+        self._tokens = max(0.0, min(self.capacity, tokens))
+
+    def set_capacity(self, capacity: float) -> None:
+        """
+        Change the capacity while keeping the refill period.
+
+        Args:
+            capacity (float): The new maximum number of tokens.
+        """
+        self._refill()
+        self.capacity = capacity
+        self._tokens = min(self._tokens, capacity)
@@ -0,0 +1,86 @@
+import logging
+from importlib import import_module
+from importlib.metadata import entry_points
+from time import perf_counter
+from typing import Any, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Registry(Generic[T]):
+    """
+    Search engines or data providers by name, their modules are imported the first time they are needed.
+
+    Plugins are classes given as "module:attribute" paths, they are created by their `from_arguments` class method.
+    Installed packages may add their own through the entry point group of the registry, they take precedence over
+    the built-in plugins of the same name. The time it took to import and create each plugin is kept, a module shared
+    by several plugins counts for the first one importing it.
+
+    Attributes:
+        kind (str): What the plugins are, e.g. "engine", used in log messages and metric labels.
+        plugins (dict[str, str]): The import path of each plugin by name.
+        load_times (dict[str, float]): Time in seconds it took to import and create each plugin used so far.
+    """
+
+    def __init__(self, kind: str, plugins: dict[str, str], group: str | None = None):
+        """
+        Initialise the Registry.
+
+        Args:
+            kind (str): What the plugins are, e.g. "engine".
+            plugins (dict[str, str]): The import path of each built-in plugin by name.
+            group (str, optional): The entry point group additional plugins are registered in (defaults to None).
+        """
+        self.kind = kind
+        self.plugins = dict(plugins)
+        if group:
+            self.plugins.update({entry.name: entry.value for entry in entry_points(group=group)})
+        self.load_times: dict[str, float] = {}
+        self._loaded: dict[str, type[T]] = {}
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.plugins
+
+    def load(self, name: str) -> type[T]:
+        """
+        Import a plugin.
+
+        Args:
+            name (str): The name of the plugin.
+
+        Returns:
+            type[T]: The plugin class.
+
+        Raises:
+            KeyError: If there is no plugin with this name.
+        """
+        if (plugin := self._loaded.get(name)) is not None:
+            return plugin
+        if name not in self.plugins:
+            raise KeyError(f"Unknown {self.kind} {name!r}, available are {', '.join(self.plugins)}")
+
+        start = perf_counter()
+        module, _, attribute = self.plugins[name].partition(":")
+        plugin = self._loaded[name] = getattr(import_module(module), attribute)
+        self.load_times[name] = perf_counter() - start
+        return plugin
+
+    def create(self, name: str, *args: Any) -> T | None:
+        """
+        Import a plugin and create it with its `from_arguments` class method.
+
+        Args:
+            name (str): The name of the plugin.
+            *args (Any): The arguments of `from_arguments`.
+
+        Returns:
+            T | None: The plugin instance or None if it is not configured.
+        """
+        start = perf_counter()
+        imported = self.load_times.get(name, 0) if name in self._loaded else 0
+        instance: T | None = self.load(name).from_arguments(*args)  # type: ignore[attr-defined]
+        self.load_times[name] = imported + perf_counter() - start
+        logger.info("Loaded %s %s in %.0fms", self.kind, name, self.load_times[name] * 1000)
+        return instance
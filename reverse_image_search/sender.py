@@ -0,0 +1,209 @@
+import logging
+from asyncio import Future, TimerHandle, get_running_loop
+from bisect import insort
+from datetime import timedelta
+from enum import IntEnum
+from itertools import count
+from time import monotonic
+from typing import Awaitable, Callable, TypeVar
+
+from pydantic import BaseModel
+from telegram import Chat
+from telegram.constants import ChatType
+from telegram.error import RetryAfter
+
+from reverse_image_search.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Order in which waiting sends are served, lower first."""
+
+    FIRST = 0
+    """The first answer of a search, e.g. the search engine buttons or the first result"""
+    RESULT = 1
+    """Further results of a search"""
+    FOLLOW_UP = 2
+    """Additional files of a result sent as media groups"""
+
+
+class _Chat:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.blocked_until = 0.0
+
+
+class SendScheduler:
+    """
+    Schedules outgoing Telegram messages within the flood limits of Telegram.
+
+    Every send takes tokens from a global bucket and from a bucket of its chat, groups have a stricter limit than
+    private chats. Waiting sends are served by priority, the order within a chat is kept. When Telegram still answers
+    with `RetryAfter` the chat is paused for the given time and the send is retried.
+
+    Attributes:
+        config (SendScheduler.Config): The scheduler configuration.
+        bucket (TokenBucket): The global bucket shared by all chats.
+        retried (int): Total number of sends Telegram refused with `RetryAfter`.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the SendScheduler.
+
+        Attributes:
+            limit (int): Messages sent per period in total (defaults to 30).
+            period (float): Period of the global limit in seconds (defaults to 1).
+            chat_limit (int): Messages sent per chat_period to a private chat (defaults to 3).
+            chat_period (float): Period of the private chat limit in seconds (defaults to 3).
+            group_limit (int): Messages sent per group_period to a group or channel (defaults to 20).
+            group_period (float): Period of the group limit in seconds (defaults to 60).
+            max_retries (int): Number of times a send refused with `RetryAfter` is retried (defaults to 3).
+        """
+
+        limit: int = 30
+        period: float = 1
+        chat_limit: int = 3
+        chat_period: float = 3
+        group_limit: int = 20
+        group_period: float = 60
+        max_retries: int = 3
+
+    def __init__(self, config: "SendScheduler.Config | None" = None):
+        """
+        Initialise the SendScheduler.
+
+        Args:
+            config (SendScheduler.Config, optional): The scheduler configuration (defaults to the default config).
+        """
+        self.config = config or SendScheduler.Config()
+        self.bucket = TokenBucket(self.config.limit, self.config.period)
+        self.retried = 0
+        self._chats: dict[int, _Chat] = {}
+        self._waiting: list[tuple[int, int, int, int, Future[None]]] = []
+        self._sequence = count()
+        self._timer: TimerHandle | None = None
+
+    @property
+    def waiting(self) -> int:
+        """Number of sends waiting for their turn"""
+        return len(self._waiting)
+
+    def _chat(self, chat: Chat) -> _Chat:
+        if (state := self._chats.get(chat.id)) is None:
+            if chat.type == ChatType.PRIVATE:
+                bucket = TokenBucket(self.config.chat_limit, self.config.chat_period)
+            else:
+                bucket = TokenBucket(self.config.group_limit, self.config.group_period)
+            state = self._chats[chat.id] = _Chat(bucket)
+        return state
+
+    def _prune(self) -> None:
+        """Forget chats that are back to their full limit."""
+        waiting = {chat_id for _, _, chat_id, _, _ in self._waiting}
+        now = monotonic()
+        for chat_id, state in list(self._chats.items()):
+            if chat_id in waiting or state.blocked_until > now:
+                continue
+            if state.bucket.tokens >= state.bucket.capacity:
+                del self._chats[chat_id]
+
+    def _dispatch(self) -> None:
+        """Let waiting sends go as far as the limits allow and wake up again once the next one may go."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        now = monotonic()
+        wait = float("inf")
+        held: set[int] = set()
+        remaining: list[tuple[int, int, int, int, Future[None]]] = []
+        for index, entry in enumerate(self._waiting):
+            _, _, chat_id, cost, future = entry
+            if future.done():
+                continue
+            if chat_id in held:
+                remaining.append(entry)
+                continue
+
+            state = self._chats[chat_id]
+            chat_cost = min(cost, state.bucket.capacity)
+            if (chat_wait := max(state.blocked_until - now, state.bucket.wait_time(chat_cost))) > 0:
+                # Later sends of this chat have to wait as well, to keep the order within the chat
+                held.add(chat_id)
+                wait = min(wait, chat_wait)
+                remaining.append(entry)
+                continue
+
+            global_cost = min(cost, self.bucket.capacity)
+            if (global_wait := self.bucket.wait_time(global_cost)) > 0:
+                # Sends with a lower priority must not take the tokens this one waits for
+                wait = min(wait, global_wait)
+                remaining.extend(item for item in self._waiting[index:] if not item[4].done())
+                break
+
+            state.bucket.try_acquire(chat_cost)
+            self.bucket.try_acquire(global_cost)
+            future.set_result(None)
+
+        self._waiting = remaining
+        if len(self._chats) > 1000:
+            self._prune()
+        if remaining and wait != float("inf"):
+            self._timer = get_running_loop().call_later(wait, self._dispatch)
+
+    async def _acquire(self, chat: Chat, priority: Priority, cost: int, sequence: int) -> None:
+        self._chat(chat)
+        future: Future[None] = get_running_loop().create_future()
+        # The sequence number is unique, so entries are ordered by priority first and by arrival second
+        insort(self._waiting, (priority, sequence, chat.id, cost, future))
+        self._dispatch()
+        try:
+            await future
+        except BaseException:
+            future.cancel()
+            if future.cancelled():
+                # Let the sends behind it go
+                self._dispatch()
+            raise
+
+    def _pause(self, chat: Chat, retry_after: int | timedelta) -> None:
+        seconds = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+        state = self._chat(chat)
+        state.blocked_until = max(state.blocked_until, monotonic() + seconds)
+        self._dispatch()
+
+    async def send(
+        self, chat: Chat, request: Callable[[], Awaitable[T]], priority: Priority = Priority.RESULT, cost: int = 1
+    ) -> T:
+        """
+        Send a message once the flood limits allow it.
+
+        Args:
+            chat (Chat): The chat the message is sent to.
+            request (Callable[[], Awaitable[T]]): Sends the message, called again for every retry.
+            priority (Priority, optional): The priority of the message (defaults to Priority.RESULT).
+            cost (int, optional): The number of messages sent, e.g. the size of a media group (defaults to 1).
+
+        Returns:
+            T: The result of the request.
+
+        Raises:
+            RetryAfter: If Telegram still refused the message after `max_retries` retries.
+        """
+        retries = 0
+        # Retries keep the place of the first attempt, so sends queued in the meantime do not overtake it
+        sequence = next(self._sequence)
+        while True:
+            await self._acquire(chat, priority, cost, sequence)
+            try:
+                return await request()
+            except RetryAfter as error:
+                if retries >= self.config.max_retries:
+                    raise
+                retries += 1
+                self.retried += 1
+                logger.info("Flood control in chat %s, retrying in %ss", chat.id, error.retry_after)
+                self._pause(chat, error.retry_after)
@@ -0,0 +1,370 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from asyncio import Event, Task, create_task, timeout, to_thread
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass
+from pathlib import Path
+from secrets import token_hex
+from threading import Lock
+from time import time
+from typing import Any, Callable, TypeVar
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+INDEX_NAME = ".index.sqlite3"
+"""Name of the database in the store directory the `file_unique_id` aliases are kept in"""
+
+
+@dataclass(slots=True)
+class StoredFile:
+    path: Path
+    size: int
+    accessed: float
+
+
+class DownloadStore:
+    """
+    Content-addressed store for downloaded files.
+
+    Files are named by the SHA-256 of their content and sharded into two directory levels
+    (`ab/cd/abcd….jpg`), so identical uploads share one file. An in-memory index of all files is loaded at startup,
+    lookups never touch the disk. A background task deletes the least recently used files once the store grows
+    beyond its byte quota.
+
+    Telegram's `file_unique_id` is mapped to the content hash as well, so files already known do not have to be
+    downloaded again. The mapping is persisted in an SQLite database in the store directory, so it survives restarts
+    and is shared by all processes using the store.
+
+    Worker processes share the store directory, each with its own index. A shared store checks on lookup that the
+    file still exists, as another process may have collected it, and marks the files it uses by their modification
+    time. Only one process collects garbage, it indexes the directory again before every run, so the quota covers
+    the files of all processes. The checks of a shared store and the alias database run in a thread, off the event
+    loop.
+
+    Attributes:
+        root (Path): The directory the files are stored in.
+        config (DownloadStore.Config): The store configuration.
+        size (int): The total size of all stored files in bytes.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the DownloadStore.
+
+        Attributes:
+            max_bytes (int): Byte quota of the store (defaults to 2 GiB).
+            gc_interval (float): Time between two garbage collection runs in seconds (defaults to 10 minutes).
+            shared (bool): Whether other processes use the same directory (defaults to False).
+            persist_aliases (bool): Keep the `file_unique_id` aliases in a database in the store directory
+                (defaults to True).
+        """
+
+        max_bytes: int = 2 * 1024**3
+        gc_interval: float = 600
+        shared: bool = False
+        persist_aliases: bool = True
+
+    def __init__(self, root: Path, config: "DownloadStore.Config | None" = None):
+        """
+        Initialise an empty DownloadStore, call `load` to index the existing files.
+
+        Args:
+            root (Path): The directory the files are stored in.
+            config (DownloadStore.Config, optional): The store configuration (defaults to the default config).
+        """
+        self.root = root
+        self.config = config or DownloadStore.Config()
+        self.size = 0
+
+        self._files: OrderedDict[str, StoredFile] = OrderedDict()
+        self._aliases: dict[str, str] = {}
+        self._over_quota = Event()
+        self._gc_task: Task[None] | None = None
+        self._db: sqlite3.Connection | None = None
+        self._lock = Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.root / INDEX_NAME, isolation_level=None, timeout=5, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS aliases (file_unique_id TEXT PRIMARY KEY, digest TEXT NOT NULL,"
+            " path TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS aliases_digest ON aliases (digest)")
+        return db
+
+    def _scan(self) -> list[tuple[str, StoredFile]]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(directory, filename)
+                if path.parent == self.root and filename.startswith(INDEX_NAME):
+                    continue
+                stat = path.stat()
+                if filename.startswith("."):
+                    # Leftover of an interrupted write, unless another process is still writing it
+                    if not self.config.shared or stat.st_mtime < time() - 60:
+                        path.unlink(missing_ok=True)
+                    continue
+                # Files from before the store was content-addressed are indexed by path to be collected eventually
+                key = path.stem if path.parent != self.root else f"legacy:{filename}"
+                files.append((key, StoredFile(path, stat.st_size, max(stat.st_atime, stat.st_mtime))))
+        files.sort(key=lambda item: item[1].accessed)
+        return files
+
+    async def load(self) -> None:
+        """Index all files in the store directory and open the alias database."""
+        self._files = OrderedDict(await to_thread(self._scan))
+        if self.config.persist_aliases and not self._db:
+            self._db = self._open()
+        self.size = sum(file.size for file in self._files.values())
+        logger.info("Indexed %d downloads, %.1f MiB", len(self._files), self.size / 1024**2)
+        self._check_quota()
+
+    def _path(self, digest: str, suffix: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / (digest + suffix)
+
+    async def _run(self, command: Callable[..., T], *args: Any) -> T:
+        def locked() -> T:
+            # The connection is shared by all threads of this process, one command at a time
+            with self._lock:
+                return command(*args)
+
+        return await to_thread(locked)
+
+    @staticmethod
+    def _mark_used(path: Path) -> bool:
+        if not path.exists():
+            return False
+        # Tell the process collecting garbage that the file is still in use
+        with suppress(OSError):
+            os.utime(path)
+        return True
+
+    async def _touch(self, digest: str) -> StoredFile | None:
+        if self.config.shared and not await to_thread(self._mark_used, self._files[digest].path):
+            # Collected by another process
+            if (collected := self._files.pop(digest, None)) is not None:
+                self.size -= collected.size
+            return None
+        if (file := self._files.get(digest)) is None:
+            # Collected by this process while the file was marked
+            return None
+        file.accessed = time()
+        self._files.move_to_end(digest)
+        return file
+
+    def _find_alias(self, db: sqlite3.Connection, file_unique_id: str) -> tuple[str, Path, int | None] | None:
+        row = db.execute("SELECT digest, path FROM aliases WHERE file_unique_id = ?", (file_unique_id,)).fetchone()
+        if row is None:
+            return None
+        digest, relative = row
+        path = self.root / relative
+        return digest, path, path.stat().st_size if path.is_file() else None
+
+    async def _alias(self, file_unique_id: str) -> str | None:
+        if (digest := self._aliases.get(file_unique_id)) is not None or not self._db:
+            return digest
+        if (found := await self._run(self._find_alias, self._db, file_unique_id)) is None:
+            return None
+        digest, path, size = found
+        if digest not in self._files and size is not None:
+            # Stored by another process since the store was indexed
+            self._files[digest] = StoredFile(path, size, time())
+            self.size += size
+            self._check_quota()
+        self._aliases[file_unique_id] = digest
+        return digest
+
+    async def lookup(self, file_unique_id: str) -> Path | None:
+        """
+        Get the stored file for a Telegram file.
+
+        Args:
+            file_unique_id (str): The Telegram `file_unique_id`.
+
+        Returns:
+            Path | None: The stored file or None if it is unknown.
+        """
+        if (
+            (digest := await self._alias(file_unique_id))
+            and digest in self._files
+            and (file := await self._touch(digest))
+        ):
+            return file.path
+        return None
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{token_hex(4)}.{path.name}")
+        temporary.write_bytes(data)
+        temporary.replace(path)
+
+    async def get(self, key: str) -> Path | None:
+        """
+        Get a file stored under a key instead of its content.
+
+        Args:
+            key (str): The key the file was stored with.
+
+        Returns:
+            Path | None: The stored file or None if there is none.
+        """
+        if (digest := hashlib.sha256(key.encode()).hexdigest()) in self._files and (file := await self._touch(digest)):
+            return file.path
+        return None
+
+    async def put(self, data: bytes, suffix: str, file_unique_id: str | None = None, key: str | None = None) -> Path:
+        """
+        Store a file, if a file with identical content exists already it is reused.
+
+        Args:
+            data (bytes): The file content.
+            suffix (str): The file suffix including the dot, e.g. ".jpg".
+            file_unique_id (str, optional): The Telegram `file_unique_id` to map to this file (defaults to None).
+            key (str, optional): Address the file by this key instead of its content, for derived files which are
+                looked up by their origin with `get` (defaults to None).
+
+        Returns:
+            Path: The location of the stored file.
+        """
+        digest = hashlib.sha256(key.encode() if key is not None else data).hexdigest()
+        if digest in self._files and (file := await self._touch(digest)):
+            path = file.path
+        else:
+            path = self._path(digest, suffix)
+            await to_thread(self._write, path, data)
+            path = self._index(digest, path, len(data))
+
+        if file_unique_id:
+            self._aliases[file_unique_id] = digest
+            if self._db:
+                await self._run(
+                    self._db.execute,
+                    "REPLACE INTO aliases (file_unique_id, digest, path) VALUES (?, ?, ?)",
+                    (file_unique_id, digest, self.relative(path)),
+                )
+        return path
+
+    @staticmethod
+    def _move(source: Path, path: Path) -> int:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = source.stat().st_size
+        source.replace(path)
+        return size
+
+    async def put_file(self, source: Path, suffix: str, key: str) -> Path:
+        """
+        Move a file into the store, addressed by a key like `put` with a key.
+
+        The file has to be on the same file system as the store, e.g. a temporary file in the store directory whose
+        name starts with a dot. If the key is stored already the file is deleted instead.
+
+        Args:
+            source (Path): The file to move.
+            suffix (str): The file suffix including the dot, e.g. ".jpg".
+            key (str): The key the file is looked up by with `get`.
+
+        Returns:
+            Path: The location of the stored file.
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        if digest in self._files and (file := await self._touch(digest)):
+            await to_thread(source.unlink, missing_ok=True)
+            return file.path
+        path = self._path(digest, suffix)
+        size = await to_thread(self._move, source, path)
+        return self._index(digest, path, size)
+
+    def _index(self, digest: str, path: Path, size: int) -> Path:
+        if digest not in self._files:  # Could have been stored concurrently
+            self._files[digest] = StoredFile(path, size, time())
+            self.size += size
+            self._check_quota()
+        return self._files[digest].path
+
+    def relative(self, path: Path) -> str:
+        """
+        Get the location of a stored file relative to the store root, as used in its public URL.
+
+        Args:
+            path (Path): The stored file.
+
+        Returns:
+            str: The relative path with forward slashes.
+        """
+        return path.relative_to(self.root).as_posix()
+
+    def _check_quota(self) -> None:
+        if self.size > self.config.max_bytes:
+            self._over_quota.set()
+
+    async def collect(self) -> int:
+        """
+        Delete the least recently used files until the store is within its quota.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        if self.config.shared:
+            # Other processes store and use files as well, only the directory knows about all of them
+            self._files = OrderedDict(await to_thread(self._scan))
+            self.size = sum(file.size for file in self._files.values())
+
+        victims: list[Path] = []
+        digests: list[str] = []
+        freed = 0
+        while self.size - freed > self.config.max_bytes and len(self._files) > 1:
+            digest, file = self._files.popitem(last=False)
+            victims.append(file.path)
+            digests.append(digest)
+            freed += file.size
+        self.size -= freed
+        self._over_quota.clear()
+        self._aliases = {alias: digest for alias, digest in self._aliases.items() if digest in self._files}
+        if self._db and digests:
+            await self._run(
+                self._db.executemany, "DELETE FROM aliases WHERE digest = ?", [(digest,) for digest in digests]
+            )
+
+        if victims:
+            await to_thread(lambda: [path.unlink(missing_ok=True) for path in victims])
+            logger.info("Deleted %d downloads, freed %.1f MiB", len(victims), freed / 1024**2)
+        return freed
+
+    async def _run_gc(self) -> None:
+        while True:
+            with suppress(TimeoutError):
+                async with timeout(self.config.gc_interval):
+                    await self._over_quota.wait()
+            try:
+                await self.collect()
+            except Exception:
+                logger.exception("Garbage collecting downloads failed")
+
+    def start(self) -> None:
+        """Start the background garbage collector."""
+        if not self._gc_task:
+            self._gc_task = create_task(self._run_gc())
+
+    def stop(self) -> None:
+        """Stop the background garbage collector."""
+        if self._gc_task:
+            self._gc_task.cancel()
+            self._gc_task = None
+
+    def close(self) -> None:
+        """Close the alias database, aliases stored from now on are kept in memory only."""
+        if self._db:
+            with self._lock:
+                self._db.close()
+            self._db = None
@@ -1,12 +1,19 @@
-import hashlib
+import logging
+from asyncio import to_thread
+from io import IOBase
 from pathlib import Path
 from typing import Generator, Sequence, TypeVar
 
-import imageio
-from telegram import Update
+from telegram import InputFile, Update
+
+from reverse_image_search.media import FrameExtractionError, FrameExtractor
+from reverse_image_search.metrics import TELEGRAM_DOWNLOAD
+from reverse_image_search.store import DownloadStore
 
 T = TypeVar("T")
 
+logger = logging.getLogger(__name__)
+
 
 def chunks(sequence: Sequence[T], size: int) -> Generator[Sequence[T], None, None]:
     """Yield successive n-sized chunks from lst."""
@@ -14,59 +21,78 @@ def chunks(sequence: Sequence[T], size: int) -> Generator[Sequence[T], None, Non
         yield sequence[i : i + size]
 
 
-def create_short_hash(text: str) -> str:
-    """Create a SHA-256 hash of a given text and return a 10-character long string representation of the hash.
+def media_url(file: object) -> str | None:
+    """Get the URL a provider file was or will be downloaded from, if it has one.
 
     Args:
-        text: The text to be hashed.
+        file: A FileSummary or Downloadable as given by a provider.
 
     Returns:
-        A 10-character long string representation of the hash.
+        The URL or None for files without a known source.
     """
-    hash_object = hashlib.sha256(text.encode())
-    hash_hex = hash_object.hexdigest()
+    if url := getattr(file, "url", None):
+        return str(url)
+    return None
+
 
-    return hash_hex[:10]
+async def file_content(file: object) -> bytes | None:
+    """Get the content of a file in one of the forms python-telegram-bot accepts for uploads.
 
+    Args:
+        file: Bytes, an InputFile, a Path or a binary file object.
 
-async def download_file(update: Update, downloads_dir: Path) -> Path | None:
+    Returns:
+        The file content or None if the file is given by URL or `file_id`.
+    """
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, InputFile):
+        return file.input_file_content
+    if isinstance(file, Path):
+        return await to_thread(file.read_bytes)
+    if isinstance(file, IOBase) and file.seekable():
+        position = file.tell()
+        content = file.read()
+        file.seek(position)
+        return content if isinstance(content, bytes) else None
+    return None
+
+
+async def download_file(update: Update, store: DownloadStore, extractor: FrameExtractor) -> Path | None:
     """
-    Downloads a file from a Telegram update to a specified location with a filename that includes a hash of the file ID.
-    If the downloaded file is a video, it extracts the first frame as an image.
+    Downloads a file from a Telegram update into the download store.
+    If the downloaded file is a video, only its first frame is stored as an image.
 
     Args:
         update: A Telegram update object that contains the file to be downloaded.
-        downloads_dir: A pathlib.Path object representing the directory where the downloaded file will be saved.
+        store: The DownloadStore the file is saved in.
+        extractor: The FrameExtractor used to get the first frame of videos.
 
     Returns:
         A pathlib.Path object representing the path to the downloaded file (or the first frame image if the file is
-        a video), or None if the update message is empty.
+        a video), or None if the update message is empty or the video could not be decoded.
     """
     msg = update.message
     if not msg:
         return None
 
     unloaded_tg_file = msg.document or msg.video or msg.sticker or msg.photo[-1]
-    loaded_tg_file = await unloaded_tg_file.get_file()
-
-    suffix = Path(loaded_tg_file.file_path).suffix  # pyright: ignore[reportGeneralTypeIssues]
-    file_location = downloads_dir / (create_short_hash(unloaded_tg_file.file_unique_id) + suffix)
-    image_location = file_location.with_stem(".jpg")
-
-    if file_location.is_file():
-        return file_location
-    elif image_location.is_file():
-        return image_location
+    if stored := await store.lookup(unloaded_tg_file.file_unique_id):
+        return stored
 
-    await loaded_tg_file.download_to_drive(file_location)
+    loaded_tg_file = await unloaded_tg_file.get_file()
+    with TELEGRAM_DOWNLOAD.time():
+        data = bytes(await loaded_tg_file.download_as_bytearray())
 
     if msg.video or msg.animation or (msg.sticker and msg.sticker.is_video):
-        # Extract the first frame of the video as an image
-        video_reader = imageio.get_reader(file_location, "ffmpeg")  # pyright: ignore[reportGeneralTypeIssues]
-        first_frame = video_reader.get_data(0)
-        image_location = downloads_dir / (create_short_hash(unloaded_tg_file.file_unique_id) + ".jpg")
-        imageio.imwrite(image_location, first_frame)
-        file_location.unlink()
-        return image_location
+        # Only the first frame of the video is kept, decode it straight from memory
+        try:
+            data = await extractor.first_frame(data)
+        except FrameExtractionError as error:
+            logger.warning("Could not extract first frame of %s: %s", unloaded_tg_file.file_unique_id, error)
+            return None
+        suffix = ".jpg"
     else:
-        return file_location
+        suffix = Path(loaded_tg_file.file_path).suffix  # pyright: ignore[reportGeneralTypeIssues]
+
+    return await store.put(data, suffix, unloaded_tg_file.file_unique_id)
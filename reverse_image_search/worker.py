@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import signal
+from asyncio import CancelledError, Semaphore, Task, create_task, gather, get_running_loop, sleep, wait
+from contextlib import suppress
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+
+from pydantic import BaseModel, Field
+from telegram import Bot, Update
+
+from reverse_image_search.admission import Overloaded
+from reverse_image_search.jobs import Job, JobQueue, SqliteListStore
+
+if TYPE_CHECKING:
+    from reverse_image_search.app import SearchPipeline
+
+logger = logging.getLogger(__name__)
+
+MEDIA_KINDS = ("photo", "video", "animation", "document", "sticker")
+"""The message attributes holding the media a search is started for"""
+
+SHUTDOWN_TIMEOUT = 10
+"""Time in seconds a worker gets to close its components after draining its jobs"""
+
+
+class WorkerPool:
+    """
+    Runs the search pipeline in worker processes, the bot process only hands out jobs.
+
+    Each worker has its own job queue in a durable list store, jobs are assigned by chat. So all searches of a chat
+    run in the same process and its per chat admission and flood limits stay exact, while the searches of different
+    chats spread over all cores. The caches are SQLite databases and the download store is a directory, all workers
+    share them. Crashed workers are restarted and continue with the jobs they had not finished.
+
+    Attributes:
+        config (WorkerPool.Config): The worker configuration.
+        arguments (SearchPipeline.Arguments): The arguments of the bot, passed on to the workers.
+        processes (list[BaseProcess | None]): The worker processes.
+        waiting (list[int]): Number of jobs waiting per worker, updated every second.
+    """
+
+    class Config(BaseModel):
+        """Configuration for the WorkerPool.
+
+        Attributes:
+            enabled (bool): Run searches in worker processes (defaults to False).
+            processes (int, optional): Number of worker processes (defaults to the number of CPUs).
+            queue (Path): Path of the SQLite job queue database (defaults to "jobs.sqlite3").
+            poll_interval (float): Time in seconds between two checks of an empty queue (defaults to 0.1).
+            prefetch (int): Jobs a worker takes at once, running or waiting for admission (defaults to 32).
+            restart_delay (float): Time in seconds before a crashed worker is restarted (defaults to 5).
+            max_job_age (float): Jobs queued longer ago than this many seconds are dropped instead of answered, e.g.
+                those recovered after a long outage (defaults to 600).
+            drain_timeout (float): Time in seconds a stopping worker lets its running jobs finish, the rest are
+                continued after the next start (defaults to 30).
+        """
+
+        enabled: bool = False
+        processes: int | None = Field(None, ge=1)
+        queue: Path = Path("jobs.sqlite3")
+        poll_interval: float = 0.1
+        prefetch: int = Field(32, ge=1)
+        restart_delay: float = 5
+        max_job_age: float = 600
+        drain_timeout: float = 30
+
+        @property
+        def count(self) -> int:
+            """The number of worker processes"""
+            return self.processes or os.cpu_count() or 1
+
+    def __init__(self, arguments: "SearchPipeline.Arguments", bot: Bot):
+        """
+        Initialise the WorkerPool.
+
+        Args:
+            arguments (SearchPipeline.Arguments): The arguments of the bot.
+            bot (Bot): The bot of the application, the workers use the same token and API server.
+        """
+        self.config = arguments.workers
+        self.arguments = arguments
+        self._bot = (bot.token, bot.base_url.removesuffix(bot.token), bot.base_file_url.removesuffix(bot.token))
+        self._store = SqliteListStore(self.config.queue, self.config.poll_interval)
+        self._queues = [JobQueue(self._store, f"ris:jobs:{index}") for index in range(self.config.count)]
+        self.processes: list[BaseProcess | None] = [None] * self.config.count
+        self.waiting = [0] * self.config.count
+        self._supervisor: Task[None] | None = None
+
+    def _spawn(self, index: int) -> None:
+        process = get_context("spawn").Process(
+            target=run_worker, args=(self.arguments, self._bot, index), name=f"ris-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def _supervise(self) -> None:
+        while True:
+            await sleep(1)
+            self.waiting = [await queue.size() for queue in self._queues]
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.warning("Worker %d exited with %s, restarting it", index, process.exitcode)
+                    self.processes[index] = None
+                    await sleep(self.config.restart_delay)
+                    self._spawn(index)
+
+    def start(self) -> None:
+        """Start the worker processes and restart them whenever they exit."""
+        for index in range(self.config.count):
+            self._spawn(index)
+        self._supervisor = create_task(self._supervise())
+
+    def stop(self) -> None:
+        """
+        Stop the worker processes, unfinished jobs are continued after the next start.
+
+        The workers are sent SIGTERM, they take no more jobs and let the running ones finish within `drain_timeout`.
+        Workers still alive after that and the time to shut down their components are killed.
+        """
+        if self._supervisor:
+            self._supervisor.cancel()
+            self._supervisor = None
+        processes = [process for process in self.processes if process is not None]
+        for process in processes:
+            process.terminate()
+        deadline = monotonic() + self.config.drain_timeout + SHUTDOWN_TIMEOUT
+        for process in processes:
+            process.join(max(0, deadline - monotonic()))
+        for process in processes:
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, killing it", process.name)
+                process.kill()
+                process.join()
+        self.processes = [None] * self.config.count
+
+    async def submit(self, update: Update) -> None:
+        """
+        Queue the search of an update for the worker of its chat.
+
+        Args:
+            update (Update): The update with the file to search for.
+
+        Raises:
+            Overloaded: If the queue of the worker is full.
+        """
+        assert update.effective_chat
+        queue = self._queues[update.effective_chat.id % len(self._queues)]
+        if await queue.size() >= self.arguments.admission.queue:
+            raise Overloaded("Too many searches waiting")
+        await queue.put({"update": compact_update(update)})
+
+
+def compact_update(update: Update) -> dict[str, Any]:
+    """
+    Strip an update down to what a worker needs to search its file and reply to it.
+
+    Only the ids of the update, message and chat are kept together with the searched media, the largest photo size
+    without thumbnails. A worker turns the result back into an `Update` with `Update.de_json`.
+
+    Args:
+        update (Update): The update with the file to search for.
+
+    Returns:
+        dict[str, Any]: The update in the format of the Bot API.
+    """
+    assert update.message
+    message = update.message
+    compact: dict[str, Any] = {
+        "message_id": message.message_id,
+        "date": int(message.date.timestamp()),
+        "chat": {"id": message.chat.id, "type": message.chat.type},
+    }
+    for kind in MEDIA_KINDS:
+        if media := getattr(message, kind):
+            data = (media[-1] if kind == "photo" else media).to_dict()
+            data.pop("thumbnail", None)
+            compact[kind] = [data] if kind == "photo" else data
+    return {"update_id": update.update_id, "message": compact}
+
+
+def run_worker(arguments: "SearchPipeline.Arguments", bot: tuple[str, str, str], index: int) -> None:
+    """
+    Entry point of a worker process.
+
+    Args:
+        arguments (SearchPipeline.Arguments): The arguments of the bot.
+        bot (tuple[str, str, str]): The token, API URL and file URL of the bot.
+        index (int): The number of the worker, it takes the jobs of the queue with the same number.
+    """
+    logging.basicConfig(format=f"%(asctime)s worker-{index} %(name)s %(levelname)s: %(message)s", level=logging.INFO)
+    asyncio.run(_work(arguments, bot, index))
+
+
+async def _work(arguments: "SearchPipeline.Arguments", bot_info: tuple[str, str, str], index: int) -> None:
+    from reverse_image_search.app import SearchPipeline
+
+    config = arguments.workers
+    parent = os.getppid()
+    # Each worker serves its own metrics, the flood limits of the bot are split among the workers
+    arguments = arguments.model_copy(
+        update={
+            "metrics": arguments.metrics.model_copy(update={"port": arguments.metrics.port + 1 + index}),
+            "sender": arguments.sender.model_copy(update={"limit": max(1, arguments.sender.limit // config.count)}),
+            "downloads_store": arguments.downloads_store.model_copy(update={"shared": True}),
+        }
+    )
+    app = SearchPipeline(arguments)
+    await app.initialize_components(serve_files=False)
+    if index:
+        app.downloads.stop()  # One worker collecting garbage in the shared store is enough
+
+    token, base_url, base_file_url = bot_info
+    bot = Bot(token, base_url=base_url, base_file_url=base_file_url)
+    await bot.initialize()
+
+    queue = JobQueue(SqliteListStore(config.queue, config.poll_interval), f"ris:jobs:{index}")
+    if recovered := await queue.recover():
+        logger.info("Continuing %d unfinished jobs", recovered)
+
+    slots = Semaphore(config.prefetch)
+    running: set[Task[None]] = set()
+
+    async def run(job: Job) -> None:
+        try:
+            try:
+                if job.age > config.max_job_age:
+                    logger.info("Dropping a search queued %ds ago", job.age)
+                else:
+                    await app.hndl_search(Update.de_json(job.data["update"], bot), None)  # type: ignore[arg-type]
+            except Exception:
+                logger.exception("Search failed")
+            # Cancelled searches are not acknowledged, `recover` continues them after the next start
+            await queue.done(job)
+        finally:
+            slots.release()
+
+    async def take_jobs() -> None:
+        while os.getppid() == parent:
+            await slots.acquire()
+            if (job := await queue.take(timeout=1)) is None:
+                slots.release()
+                continue
+            task = create_task(run(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        logger.warning("Bot process is gone, stopping")
+
+    # The bot process stops its workers with SIGTERM, Ctrl+C in a terminal sends SIGINT to all of them
+    taking = create_task(take_jobs())
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        get_running_loop().add_signal_handler(signum, taking.cancel)
+    with suppress(CancelledError):
+        await taking
+
+    if running:
+        _, unfinished = await wait(running, timeout=config.drain_timeout)
+        for task in unfinished:
+            task.cancel()
+        await gather(*unfinished, return_exceptions=True)
+    await app.shutdown_components()
+    await bot.shutdown()
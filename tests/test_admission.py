@@ -0,0 +1,199 @@
+from asyncio import Event, create_task, run, sleep
+from typing import Hashable
+
+import pytest
+
+from reverse_image_search.admission import AdmissionControl, Overloaded
+
+
+def control(**config: int) -> AdmissionControl:
+    return AdmissionControl(AdmissionControl.Config(**config))
+
+
+async def settle() -> None:
+    """Let all tasks run until they wait for something."""
+    for _ in range(5):
+        await sleep(0)
+
+
+async def hold(admission: AdmissionControl, key: Hashable, release: Event, started: list[str], name: str) -> None:
+    async with admission.admit(key):
+        started.append(name)
+        await release.wait()
+
+
+def test_runs_immediately_below_limits() -> None:
+    async def main() -> None:
+        admission = control(concurrency=2)
+        async with admission.admit("a"):
+            async with admission.admit("b"):
+                assert admission.running == 2
+                assert admission.queued == 0
+        assert admission.running == 0
+
+    run(main())
+
+
+def test_serves_chats_round_robin() -> None:
+    async def main() -> None:
+        admission = control(concurrency=1, chat_concurrency=1)
+        release = Event()
+        order: list[str] = []
+        holder = create_task(hold(admission, "holder", release, [], "holder"))
+        await settle()
+
+        async def search(key: str, name: str) -> None:
+            async with admission.admit(key):
+                order.append(name)
+
+        tasks = [create_task(search(key, name)) for key, name in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"))]
+        await settle()
+        assert admission.queued == 4
+
+        release.set()
+        await holder
+        for task in tasks:
+            await task
+
+        assert order == ["a1", "b1", "a2", "a3"]
+        assert admission.running == 0
+
+    run(main())
+
+
+def test_limits_searches_per_chat() -> None:
+    async def main() -> None:
+        admission = control(concurrency=4, chat_concurrency=1)
+        release = Event()
+        started: list[str] = []
+        tasks = [create_task(hold(admission, key, release, started, name)) for key, name in (("a", "a1"), ("a", "a2"))]
+        tasks.append(create_task(hold(admission, "b", release, started, "b1")))
+        await settle()
+
+        assert started == ["a1", "b1"]
+        assert admission.queued == 1
+
+        release.set()
+        for task in tasks:
+            await task
+        assert started == ["a1", "b1", "a2"]
+
+    run(main())
+
+
+def test_reports_queue_position() -> None:
+    async def main() -> None:
+        admission = control(concurrency=1)
+        release = Event()
+        positions: list[int] = []
+        holder = create_task(hold(admission, "holder", release, [], "holder"))
+        await settle()
+
+        async def queued(position: int) -> None:
+            positions.append(position)
+
+        async def search(key: str) -> None:
+            async with admission.admit(key, queued):
+                pass
+
+        tasks = [create_task(search(key)) for key in ("a", "a", "b")]
+        await settle()
+
+        # The search of chat b only waits for the first search of chat a
+        assert positions == [1, 2, 2]
+
+        release.set()
+        await holder
+        for task in tasks:
+            await task
+
+    run(main())
+
+
+def test_sheds_when_chat_queue_is_full() -> None:
+    async def main() -> None:
+        admission = control(concurrency=1, chat_queue=1)
+        release = Event()
+        holder = create_task(hold(admission, "holder", release, [], "holder"))
+        waiting = create_task(hold(admission, "a", release, [], "a1"))
+        await settle()
+
+        with pytest.raises(Overloaded):
+            async with admission.admit("a"):
+                pass
+        assert admission.rejected == 1
+        assert admission.queued == 1
+
+        release.set()
+        await holder
+        await waiting
+
+    run(main())
+
+
+def test_sheds_when_all_queues_are_full() -> None:
+    async def main() -> None:
+        admission = control(concurrency=1, queue=1)
+        release = Event()
+        holder = create_task(hold(admission, "holder", release, [], "holder"))
+        waiting = create_task(hold(admission, "a", release, [], "a1"))
+        await settle()
+
+        with pytest.raises(Overloaded):
+            async with admission.admit("b"):
+                pass
+        assert admission.rejected == 1
+
+        release.set()
+        await holder
+        await waiting
+
+    run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue() -> None:
+    async def main() -> None:
+        admission = control(concurrency=1)
+        release = Event()
+        started: list[str] = []
+        holder = create_task(hold(admission, "holder", release, started, "holder"))
+        cancelled = create_task(hold(admission, "a", release, started, "a1"))
+        waiting = create_task(hold(admission, "b", release, started, "b1"))
+        await settle()
+
+        cancelled.cancel()
+        await settle()
+        assert admission.queued == 1
+
+        release.set()
+        await holder
+        await waiting
+        assert cancelled.cancelled()
+        assert started == ["holder", "b1"]
+        assert admission.running == 0
+
+    run(main())
+
+
+def test_slot_of_waiter_cancelled_after_admission_is_passed_on() -> None:
+    async def main() -> None:
+        admission = control(concurrency=1)
+        release = Event()
+        started: list[str] = []
+        async with admission.admit("holder"):
+            cancelled = create_task(hold(admission, "a", release, started, "a1"))
+            waiting = create_task(hold(admission, "b", release, started, "b1"))
+            await settle()
+
+        # Leaving the context handed the slot to a1, which is cancelled before it gets to run
+        assert admission.running == 1
+        cancelled.cancel()
+        await settle()
+        assert started == ["b1"]
+
+        release.set()
+        await waiting
+        assert cancelled.cancelled()
+        assert admission.running == 0
+
+    run(main())
@@ -0,0 +1,135 @@
+from pathlib import Path
+
+import pytest
+
+from reverse_image_search import cache as cache_module
+from reverse_image_search.cache import MISSING, CacheKey, ResultCache
+
+VALUE = "x" * 1000
+"""A value which takes roughly 1KB in the memory budget"""
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+def key(name: str) -> CacheKey:
+    return frozenset({("query", name)})
+
+
+def memory_cache(budget: int) -> ResultCache:
+    return ResultCache(ResultCache.Config(path=None, memory_bytes=budget))
+
+
+def test_get_missing() -> None:
+    cache = memory_cache(10_000)
+
+    assert cache.get(key("a")) is MISSING
+    assert cache.misses == 1
+
+
+def test_cached_none_is_a_hit() -> None:
+    cache = memory_cache(10_000)
+    cache.set(key("a"), None, ttl=60)
+
+    assert cache.get(key("a")) is None
+    assert cache.hits == 1
+
+
+def test_evicts_least_recently_used_over_budget(clock: Clock) -> None:
+    cache = memory_cache(2500)
+    cache.set(key("a"), VALUE, ttl=60)
+    cache.set(key("b"), VALUE, ttl=60)
+    cache.get(key("a"))
+    cache.set(key("c"), VALUE, ttl=60)
+
+    assert len(cache) == 2
+    assert cache.memory_bytes <= 2500
+    assert cache.get(key("b")) is MISSING
+    assert cache.get(key("a")) == VALUE
+    assert cache.get(key("c")) == VALUE
+
+
+def test_evicts_expired_before_live_entries(clock: Clock) -> None:
+    cache = memory_cache(2500)
+    cache.set(key("short"), VALUE, ttl=10)
+    cache.set(key("long"), VALUE, ttl=100)
+    cache.get(key("short"))  # Most recently used, but expired by the time the budget is exceeded
+
+    clock.now += 20
+    cache.set(key("new"), VALUE, ttl=100)
+
+    assert cache.get(key("long")) == VALUE
+    assert cache.get(key("new")) == VALUE
+    assert len(cache) == 2
+
+
+def test_overwrite_keeps_size(clock: Clock) -> None:
+    cache = memory_cache(10_000)
+    cache.set(key("a"), VALUE, ttl=60)
+    size = cache.memory_bytes
+    cache.set(key("a"), VALUE, ttl=60)
+
+    assert cache.memory_bytes == size
+    assert len(cache) == 1
+
+
+def test_expired_entry_is_missing(clock: Clock) -> None:
+    cache = memory_cache(10_000)
+    cache.set(key("a"), VALUE, ttl=10)
+
+    clock.now += 11
+
+    assert cache.get(key("a")) is MISSING
+    assert cache.memory_bytes == 0
+
+
+def test_disk_tier_answers_evicted_entries(clock: Clock, tmp_path: Path) -> None:
+    cache = ResultCache(ResultCache.Config(path=tmp_path / "cache.sqlite3", memory_bytes=1500))
+    cache.set(key("a"), VALUE, ttl=60)
+    cache.set(key("b"), VALUE, ttl=60)
+
+    assert cache.get(key("a")) == VALUE
+    assert cache.disk_hits == 1
+    cache.close()
+
+
+def test_disk_tier_survives_restart(clock: Clock, tmp_path: Path) -> None:
+    config = ResultCache.Config(path=tmp_path / "cache.sqlite3")
+    cache = ResultCache(config)
+    cache.set(key("a"), VALUE, ttl=60)
+    cache.set(key("b"), VALUE, ttl=10)
+    cache.close()
+
+    clock.now += 20
+    cache = ResultCache(config)
+
+    assert cache.get(key("a")) == VALUE
+    assert cache.get(key("b")) is MISSING
+    cache.close()
+
+
+def test_registered_objects_are_persisted_by_name(clock: Clock, tmp_path: Path) -> None:
+    config = ResultCache.Config(path=tmp_path / "cache.sqlite3")
+    engine = object()
+    cache = ResultCache(config)
+    cache.register("engine.test", engine)
+    cache.set(key("a"), [engine, "result"], ttl=60)
+    cache.close()
+
+    cache = ResultCache(config)
+    cache.register("engine.test", engine)
+
+    assert cache.get(key("a")) == [engine, "result"]
+    cache.close()
@@ -0,0 +1,45 @@
+from asyncio import run
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from reverse_image_search.downloader import Downloader
+from reverse_image_search.store import INDEX_NAME, DownloadStore
+
+CONTENT = b"page" * 1024
+
+
+def test_save_streams_large_files_into_the_store(tmp_path: Path) -> None:
+    async def main() -> None:
+        requests = 0
+
+        async def page(request: web.Request) -> web.Response:
+            nonlocal requests
+            requests += 1
+            return web.Response(body=CONTENT)
+
+        app = web.Application()
+        app.router.add_get("/p0.png", page)
+        store = DownloadStore(tmp_path)
+        await store.load()
+
+        async with TestServer(app) as server, ClientSession() as session:
+            downloader = Downloader(session, store, Downloader.Config(spool_bytes=1024, chunk_size=512))
+            url = str(server.make_url("/p0.png"))
+            path = await downloader.save(url)
+
+            assert path.suffix == ".png"
+            assert path.read_bytes() == CONTENT
+            assert store.size == len(CONTENT)
+            # Only the stored file is left, no temporary file
+            assert [
+                file for file in tmp_path.rglob("*") if file.is_file() and not file.name.startswith(INDEX_NAME)
+            ] == [path]
+
+            assert await downloader.save(url) == path
+            assert requests == 1
+
+        store.close()
+
+    run(main())
@@ -0,0 +1,55 @@
+import hashlib
+import os
+from asyncio import run
+from pathlib import Path
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from reverse_image_search.fileserver import FileServer
+from reverse_image_search.store import DownloadStore
+
+CONTENT = b"not really an image, the file server does not care"
+
+
+def test_etag_is_the_content_hash(tmp_path: Path) -> None:
+    async def main() -> None:
+        store = DownloadStore(tmp_path, DownloadStore.Config(shared=True))
+        await store.load()
+        path = await store.put(CONTENT, ".jpg")
+        server = FileServer(store, FileServer.Config(enabled=True))
+
+        async with TestClient(TestServer(server.application())) as client:
+            response = await client.get("/" + store.relative(path))
+            assert response.status == 200
+            assert await response.read() == CONTENT
+            assert response.headers["ETag"] == f'"{hashlib.sha256(CONTENT).hexdigest()}"'
+            etag = response.headers["ETag"]
+
+            # Another worker using the file updates its modification time, the ETag stays the same
+            os.utime(path, (0, 0))
+            response = await client.get("/" + store.relative(path), headers={"If-None-Match": etag})
+            assert response.status == 304
+            assert response.headers["ETag"] == etag
+
+            response = await client.get("/" + store.relative(path), headers={"If-None-Match": '"other"'})
+            assert response.status == 200
+            assert response.headers["ETag"] == etag
+
+        store.close()
+
+    run(main())
+
+
+def test_missing_file(tmp_path: Path) -> None:
+    async def main() -> None:
+        store = DownloadStore(tmp_path)
+        await store.load()
+        server = FileServer(store, FileServer.Config(enabled=True))
+
+        async with TestClient(TestServer(server.application())) as client:
+            assert (await client.get("/ab/cd/missing.jpg")).status == 404
+            assert (await client.get("/../outside.jpg")).status == 404
+
+        store.close()
+
+    run(main())
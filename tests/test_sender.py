@@ -0,0 +1,137 @@
+from asyncio import Event, create_task, gather, run, sleep
+from typing import Awaitable, Callable
+
+import pytest
+from telegram import Chat
+from telegram.constants import ChatType
+from telegram.error import RetryAfter
+
+from reverse_image_search.sender import Priority, SendScheduler
+
+
+def chat(chat_id: int) -> Chat:
+    return Chat(chat_id, ChatType.PRIVATE)
+
+
+async def settle() -> None:
+    """Let all tasks run until they wait for something."""
+    for _ in range(5):
+        await sleep(0)
+
+
+def test_sends_by_priority() -> None:
+    async def main() -> None:
+        scheduler = SendScheduler(SendScheduler.Config(limit=1, period=0.02))
+        order: list[str] = []
+
+        def request(name: str) -> Callable[[], Awaitable[str]]:
+            async def send() -> str:
+                order.append(name)
+                return name
+
+            return send
+
+        await scheduler.send(chat(1), request("first"))
+        # The global bucket is empty now, everything below waits and is sorted
+        tasks = [
+            create_task(scheduler.send(chat(2), request("follow-up"), Priority.FOLLOW_UP)),
+            create_task(scheduler.send(chat(3), request("result"), Priority.RESULT)),
+            create_task(scheduler.send(chat(4), request("answer"), Priority.FIRST)),
+        ]
+        await settle()
+        assert scheduler.waiting == 3
+
+        assert await gather(*tasks) == ["follow-up", "result", "answer"]
+        assert order == ["first", "answer", "result", "follow-up"]
+        assert scheduler.waiting == 0
+
+    run(main())
+
+
+def test_keeps_order_of_equal_priority() -> None:
+    async def main() -> None:
+        scheduler = SendScheduler(SendScheduler.Config(limit=1, period=0.01))
+        order: list[int] = []
+
+        async def send(number: int) -> None:
+            async def request() -> None:
+                order.append(number)
+
+            await scheduler.send(chat(number), request)
+
+        await gather(*(send(number) for number in range(5)))
+        assert order == list(range(5))
+
+    run(main())
+
+
+def test_retry_keeps_its_place() -> None:
+    async def main() -> None:
+        scheduler = SendScheduler(SendScheduler.Config(chat_limit=1, chat_period=0.05))
+        order: list[str] = []
+        refused = Event()
+
+        async def flooded() -> None:
+            order.append("flooded")
+            if len(order) == 1:
+                await refused.wait()
+                raise RetryAfter(0)
+
+        async def later() -> None:
+            order.append("later")
+
+        first = create_task(scheduler.send(chat(1), flooded))
+        await settle()
+        # Queued while the first send is in flight, it waits for the chat limit
+        second = create_task(scheduler.send(chat(1), later))
+        await settle()
+        refused.set()
+        await gather(first, second)
+
+        assert order == ["flooded", "flooded", "later"]
+        assert scheduler.retried == 1
+
+    run(main())
+
+
+def test_gives_up_after_max_retries() -> None:
+    async def main() -> None:
+        scheduler = SendScheduler(SendScheduler.Config(max_retries=2))
+        attempts = 0
+
+        async def flooded() -> None:
+            nonlocal attempts
+            attempts += 1
+            raise RetryAfter(0)
+
+        with pytest.raises(RetryAfter):
+            await scheduler.send(chat(1), flooded)
+        assert attempts == 3
+        assert scheduler.retried == 2
+
+    run(main())
+
+
+def test_cancelled_send_lets_the_next_go() -> None:
+    async def main() -> None:
+        scheduler = SendScheduler(SendScheduler.Config(limit=1, period=0.05))
+        sent: list[str] = []
+
+        def request(name: str) -> Callable[[], Awaitable[None]]:
+            async def send() -> None:
+                sent.append(name)
+
+            return send
+
+        await scheduler.send(chat(1), request("first"))
+        cancelled = create_task(scheduler.send(chat(2), request("cancelled"), Priority.FIRST))
+        waiting = create_task(scheduler.send(chat(3), request("waiting")))
+        await settle()
+
+        cancelled.cancel()
+        await waiting
+
+        assert sent == ["first", "waiting"]
+        assert scheduler.waiting == 0
+
+    run(main())
@@ -0,0 +1,38 @@
+from asyncio import run
+from pathlib import Path
+
+from reverse_image_search.store import DownloadStore
+
+CONTENT = b"not really an image"
+
+
+def test_lookup_finds_files_of_other_processes(tmp_path: Path) -> None:
+    async def main() -> None:
+        config = DownloadStore.Config(shared=True)
+        writer, reader = DownloadStore(tmp_path, config), DownloadStore(tmp_path, config)
+        await writer.load()
+        await reader.load()
+
+        path = await writer.put(CONTENT, ".jpg", "unique")
+        assert await reader.lookup("unique") == path
+        assert reader.size == len(CONTENT)
+
+        writer.close()
+        reader.close()
+
+    run(main())
+
+
+def test_lookup_drops_files_collected_by_other_processes(tmp_path: Path) -> None:
+    async def main() -> None:
+        store = DownloadStore(tmp_path, DownloadStore.Config(shared=True))
+        await store.load()
+        path = await store.put(CONTENT, ".jpg", "unique")
+
+        path.unlink()
+        assert await store.lookup("unique") is None
+        assert store.size == 0
+
+        store.close()
+
+    run(main())